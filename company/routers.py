@@ -0,0 +1,54 @@
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+REPLICA = 'replica'
+
+# Выставляется ReplicaMiddleware на время обработки GET/HEAD-запроса
+_read_only_request = ContextVar('read_only_request', default=False)
+
+
+class ReplicaRouter:
+    """Чтение в GET-обработчиках — с реплики (если она настроена), всё остальное — с primary.
+
+    Чтения внутри пишущих запросов (проверки перед update_or_create и т.п.) остаются на primary,
+    чтобы не видеть отставание реплики.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _read_only_request.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+@sync_and_async_middleware
+def ReplicaMiddleware(get_response):
+    safe_methods = ('GET', 'HEAD')
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = _read_only_request.set(request.method in safe_methods)
+            try:
+                return await get_response(request)
+            finally:
+                _read_only_request.reset(token)
+    else:
+        def middleware(request):
+            token = _read_only_request.set(request.method in safe_methods)
+            try:
+                return get_response(request)
+            finally:
+                _read_only_request.reset(token)
+
+    return middleware
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import copy
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'organization.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'company.routers.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'company.urls'
@@ -74,17 +78,109 @@ WSGI_APPLICATION = 'company.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Пул соединений psycopg 3 (DB_POOL=1) несовместим с CONN_MAX_AGE, без пула соединения
+# переиспользуются между запросами DB_CONN_MAX_AGE секунд и проверяются перед использованием.
+DB_POOL = os.environ.get('DB_POOL', '0') == '1'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'mydatabase',
-        'USER': 'user',
-        'PASSWORD': 'password',
-        'HOST': 'db',  # Имя сервиса базы данных из docker-compose
-        'PORT': '5432',
+        'NAME': os.environ.get('POSTGRES_DB', 'mydatabase'),
+        'USER': os.environ.get('POSTGRES_USER', 'user'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'password'),
+        'HOST': os.environ.get('POSTGRES_HOST', 'db'),  # Имя сервиса базы данных из docker-compose
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'options': '-c statement_timeout={}'.format(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000)),
+        },
     }
 }
 
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+        'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    }
+
+# Реплика для чтения: GET-запросы читают с неё (company/routers.py), запись всегда в primary
+if os.environ.get('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = copy.deepcopy(DATABASES['default'])
+    DATABASES['replica'].update({
+        'HOST': os.environ['POSTGRES_REPLICA_HOST'],
+        'PORT': os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    })
+
+DATABASE_ROUTERS = ['company.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# В продакшене 'default' стоит заменить на общий для всех процессов бэкенд
+# (django.core.cache.backends.redis.RedisCache или filebased.FileBasedCache)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Кэш ответов API (organization/cache.py)
+ORGANIZATION_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAXSIZE': 1024,
+    'LOCAL_TTL': 30,
+}
+
+# Сериализация списков (organization/serializers.py): values() и скомпилированные схемы вместо
+# marshmallow; ORJSON — компактный вывод orjson (байты отличаются от стандартного json)
+ORGANIZATION_SERIALIZER = {
+    'FAST': True,
+    'ORJSON': False,
+}
+
+# Метрики запросов: заголовок Server-Timing и /metrics (organization/metrics.py); SLOW_REQUEST_MS
+# включает запись медленных запросов со списком SQL в лог organization.metrics
+ORGANIZATION_METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'SLOW_REQUEST_MS': None,
+    'SLOW_SAMPLE_RATE': 1.0,
+}
+
+# Фоновое удаление организаций и поддеревьев (organization/purge.py); без THREAD задания выполняет
+# manage.py run_purge_jobs (он же подбирает задания, брошенные упавшим процессом)
+ORGANIZATION_PURGE = {
+    'BATCH_SIZE': 1000,
+    'THREAD': True,
+    'STALE_AFTER': 300,
+}
+
+# Журнал изменений /api/changes/ (organization/feed.py)
+CHANGE_FEED = {
+    'POLL_INTERVAL': 0.5,
+    'MAX_WAIT': 30,
+}
+
+# Доставка журнала изменений подписчикам (organization/webhooks.py, manage.py run_webhook_worker):
+# событий в одном запросе, параллельных доставок, таймаут запроса и экспоненциальная пауза после ошибок, секунды
+ORGANIZATION_WEBHOOKS = {
+    'BATCH_SIZE': 500,
+    'CONCURRENCY': 64,
+    'TIMEOUT': 10,
+    'BACKOFF_BASE': 1,
+    'BACKOFF_MAX': 600,
+    'POLL_INTERVAL': 0.5,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
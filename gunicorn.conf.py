@@ -0,0 +1,27 @@
+# Конфигурация gunicorn, все параметры задаются переменными окружения.
+# WSGI:  gunicorn company.wsgi:application -c gunicorn.conf.py
+# ASGI:  SERVER_MODE=asgi gunicorn company.asgi:application -c gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+if os.environ.get('SERVER_MODE') == 'asgi':
+    # Асинхронный воркер: один процесс обслуживает много медленных клиентов и long-poll запросов
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    worker_class = 'gthread' if threads > 1 else 'sync'
+
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# Перезапуск воркеров ограничивает рост памяти при долгой работе
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
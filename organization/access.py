@@ -0,0 +1,69 @@
+from django.db import connection, transaction
+
+from .models import Employee, Permission, EffectivePermission
+
+BATCH_SIZE = 2000
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def refresh_employees(employee_ids):
+    """Пересчёт эффективных прав сотрудников по их текущим должностям"""
+    through = Employee.positions.through
+    with transaction.atomic(savepoint=False):
+        for chunk in _chunks(employee_ids):
+            EffectivePermission.objects.filter(employee_id__in=chunk).delete()
+            pairs = (through.objects.filter(employee_id__in=chunk, position__permissions__isnull=False)
+                     .values_list("employee_id", "position__permissions").distinct())
+            EffectivePermission.objects.bulk_create(
+                [EffectivePermission(employee_id=e, permission_id=p) for e, p in pairs],
+                batch_size=BATCH_SIZE,
+                # Ту же пару может пересобрать параллельная запись другой стороны (сотрудника или права)
+                ignore_conflicts=True,
+            )
+
+
+def refresh_permissions(permission_ids):
+    """Пересчёт списка сотрудников, которым выдано каждое из прав"""
+    through = Permission.positions.through
+    with transaction.atomic(savepoint=False):
+        for chunk in _chunks(permission_ids):
+            EffectivePermission.objects.filter(permission_id__in=chunk).delete()
+            pairs = (through.objects.filter(permission_id__in=chunk, position__employees__isnull=False)
+                     .values_list("position__employees", "permission_id").distinct())
+            EffectivePermission.objects.bulk_create(
+                [EffectivePermission(employee_id=e, permission_id=p) for e, p in pairs],
+                batch_size=BATCH_SIZE,
+                # Ту же пару может пересобрать параллельная запись другой стороны (сотрудника или права)
+                ignore_conflicts=True,
+            )
+
+
+def add_employees(employee_ids):
+    """Индекс для только что созданных сотрудников: INSERT ... SELECT на пачку, без удаления и выборки в Python"""
+    employees, permissions = Employee.positions.through._meta, Permission.positions.through._meta
+    with connection.cursor() as cursor:
+        for chunk in _chunks(employee_ids):
+            cursor.execute(
+                f"INSERT INTO {EffectivePermission._meta.db_table} (employee_id, permission_id) "
+                f"SELECT DISTINCT e.employee_id, p.permission_id FROM {employees.db_table} e "
+                f"JOIN {permissions.db_table} p ON p.position_id = e.position_id "
+                f"WHERE e.employee_id = ANY(%s) ON CONFLICT DO NOTHING",
+                [chunk],
+            )
+
+
+def check(pairs):
+    """Проверка пар (employee_id, permission_id): одно обращение к индексу на BATCH_SIZE пар"""
+    granted = set()
+    for chunk in _chunks(pairs):
+        granted.update(
+            EffectivePermission.objects
+            .filter(employee_id__in={e for e, _ in chunk}, permission_id__in={p for _, p in chunk})
+            .values_list("employee_id", "permission_id")
+        )
+    return [pair in granted for pair in pairs]
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class OrganizationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'organization'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from . import metrics, schemas, serializers
+
+        # Счётчики запросов к БД для metrics.MetricsMiddleware на всех соединениях
+        connection_created.connect(metrics.install)
+
+        # Быстрые сериализаторы полных схем компилируются один раз при старте
+        for schema_class in (schemas.OrganizationSchema, schemas.DivisionSchema, schemas.PositionSchema,
+                             schemas.EmployeeSchema, schemas.PermissionSchema):
+            serializers.compile_schema(schema_class())
@@ -0,0 +1,29 @@
+from django.urls import path
+from .async_views import AsyncListView, AsyncDetailView, AsyncChangesView
+from .models import Organization, Division, Position, Employee, Permission
+from .schemas import OrganizationSchema, DivisionSchema, PositionSchema, EmployeeSchema, PermissionSchema
+
+# Асинхронные варианты read-эндпоинтов для ASGI-режима (SERVER_MODE=asgi), смонтированы в /api/async/
+urlpatterns = [
+    path('organizations/', AsyncListView.as_view(model=Organization, schema_class=OrganizationSchema),
+         name='async_organization_list'),
+    path('organizations/<int:pk>/', AsyncDetailView.as_view(model=Organization, schema_class=OrganizationSchema),
+         name='async_organization'),
+    path('divisions/', AsyncListView.as_view(model=Division, schema_class=DivisionSchema),
+         name='async_division_list'),
+    path('divisions/<int:pk>/', AsyncDetailView.as_view(model=Division, schema_class=DivisionSchema),
+         name='async_division'),
+    path('positions/', AsyncListView.as_view(model=Position, schema_class=PositionSchema),
+         name='async_position_list'),
+    path('positions/<int:pk>/', AsyncDetailView.as_view(model=Position, schema_class=PositionSchema),
+         name='async_position'),
+    path('employees/', AsyncListView.as_view(model=Employee, schema_class=EmployeeSchema),
+         name='async_employee_list'),
+    path('employees/<int:pk>/', AsyncDetailView.as_view(model=Employee, schema_class=EmployeeSchema),
+         name='async_employee'),
+    path('permissions/', AsyncListView.as_view(model=Permission, schema_class=PermissionSchema),
+         name='async_permission_list'),
+    path('permissions/<int:pk>/', AsyncDetailView.as_view(model=Permission, schema_class=PermissionSchema),
+         name='async_permission'),
+    path('changes/', AsyncChangesView.as_view(), name='async_changes'),
+]
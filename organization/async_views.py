@@ -0,0 +1,83 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from marshmallow import ValidationError
+
+from . import feed
+from .conditional import aconditional
+from .batch import parse_ids, resolve
+from .filters import filter_queryset
+from .pagination import decode_cursor, next_cursor, ordered, parse_limit
+from .schemas import ChangeSchema, requested_schema, with_related
+from .serializers import dump_rows, json_response
+
+
+class AsyncListView(View):
+    """Асинхронный вариант списка (keyset-пагинация как в pagination.paginate)"""
+    model = None
+    schema_class = None
+
+    async def get(self, request, *args, **kwargs):
+        return await aconditional(self.model, None, self.respond, request)
+
+    async def respond(self, request):
+        try:
+            schema = requested_schema(self.schema_class, request.GET)
+            queryset, ordering = filter_queryset(self.model.objects.all(), request.GET)
+            ids = parse_ids(request.GET["ids"]) if "ids" in request.GET else None
+            after = decode_cursor(request.GET.get("after"), ordering)
+            limit = parse_limit(request.GET.get("limit"))
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+
+        if ids is not None:
+            results = await sync_to_async(resolve)(with_related(queryset, schema), schema, ids)
+            return json_response({"results": results})
+
+        queryset = ordered(with_related(queryset, schema), ordering, after)
+        # Выборка и сборка ответа синхронные: вложенные объекты дочитываются пачками по мере надобности
+        page = await sync_to_async(dump_rows)(queryset[:limit + 1], schema)
+        cursor = None
+        if len(page) > limit:
+            cursor = await sync_to_async(next_cursor)(queryset, ordering, page[limit - 1][0])
+        return json_response({"results": [data for _, data in page[:limit]], "next": cursor})
+
+
+class AsyncDetailView(View):
+    model = None
+    schema_class = None
+
+    async def get(self, request, pk, *args, **kwargs):
+        return await aconditional(self.model, pk, self.respond, request, pk)
+
+    async def respond(self, request, pk):
+        try:
+            schema = requested_schema(self.schema_class, request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        try:
+            obj = await with_related(self.model.objects.all(), schema).aget(pk=pk)
+        except self.model.DoesNotExist:
+            return JsonResponse({"error": f"No {self.model._meta.model_name} matches the given query"}, status=404)
+        return JsonResponse(await sync_to_async(schema.dump)(obj))
+
+
+class AsyncChangesView(View):
+    """Long-poll журнала изменений без блокировки потока на время ожидания"""
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.GET.get("since") or 0)
+            wait = float(request.GET.get("wait") or 0)
+        except ValueError:
+            return JsonResponse({"error": "since and wait must be numbers."}, status=400)
+        try:
+            limit = parse_limit(request.GET.get("limit"))
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+
+        events = await feed.aread(since, limit, wait)
+        return JsonResponse({
+            "results": ChangeSchema(many=True).dump(events),
+            "next": events[-1].seq if events else since,
+        })
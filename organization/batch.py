@@ -0,0 +1,47 @@
+"""Чтение объектов по списку id: ?ids= у списков и POST /api/batch/ со смешанными ресурсами
+
+Объекты каждого ресурса читаются одним запросом id__in (плюс запросы вложенных объектов), ответ —
+словарь по id, где каждый элемент — {"status": 200, "data": {...}} или {"status": 404, "error": ...}.
+"""
+from marshmallow import ValidationError
+
+from .schemas import with_related
+from .serializers import Loader, dump_rows
+
+MAX_IDS = 1000
+
+
+def parse_ids(value):
+    """id из "1,2,3" без повторов, в порядке запроса"""
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in value.split(",") if pk.strip()))
+    except ValueError:
+        raise ValidationError({"ids": ["Must be a comma-separated list of integers."]})
+    if not ids:
+        raise ValidationError({"ids": ["At least one id is required."]})
+    if len(ids) > MAX_IDS:
+        raise ValidationError({"ids": [f"At most {MAX_IDS} ids are allowed."]})
+    return ids
+
+
+def resolve(queryset, schema, ids, loader=None):
+    """{id: элемент ответа} для ids из выборки queryset (уже with_related); отсутствующие в ней — 404"""
+    model = queryset.model
+    found = dict(dump_rows(queryset.filter(pk__in=ids), schema, loader))
+    missing = {"status": 404, "error": f"No {model._meta.verbose_name} matches the given query"}
+    return {str(pk): {"status": 200, "data": found[pk]} if pk in found else missing for pk in ids}
+
+
+def resolve_lookups(lookups, schemas):
+    """Ответ POST /api/batch/: {ресурс: {id: элемент}} для [{"type": ресурс, "id": ...}, ...]
+
+    schemas — {ресурс: схема}; ресурсы читаются в порядке schemas с общим Loader, так что, например,
+    организации, запрошенные вместе с подразделениями, не читаются второй раз для вложенного organization.
+    """
+    wanted = {}
+    for lookup in lookups:
+        wanted.setdefault(lookup["type"], {})[lookup["id"]] = None
+    loader = Loader()
+    return {resource: resolve(with_related(schema.Meta.model.objects.all(), schema), schema, list(wanted[resource]),
+                              loader)
+            for resource, schema in schemas.items() if resource in wanted}
@@ -0,0 +1,267 @@
+import json
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Q, Value
+from marshmallow import ValidationError
+
+from . import counters, directory, tracking
+from .models import Organization, Division, Position, Employee, Permission, Change
+
+BATCH_SIZE = 2000
+
+# Поля-ссылки, которые при массовой загрузке проверяются одним запросом на всю пачку
+REFERENCES = {
+    "organization_id": (Organization, "Invalid organization id."),
+    "parent_id": (Division, "Invalid parent id."),
+    "positions_ids": (Position, "Some provided Position IDs do not exist."),
+}
+
+
+# Пересчёт индексов по должностям (лексемы подсказок) после смены должностей (сигналы m2m_changed здесь не
+# срабатывают); эффективные права пересобирает counters.positions_changed
+REFRESH_INDEXES = {
+    Employee: directory.refresh_positions,
+}
+
+BATCH_CONFLICT = "The batch conflicts with a concurrent change and was not written, retry these items."
+
+
+def parse_items(request):
+    """Массив объектов из тела запроса: JSON-массив или NDJSON (по строке на объект)"""
+    try:
+        if request.content_type == "application/x-ndjson":
+            items = [json.loads(line) for line in request if line.strip()]
+        else:
+            items = json.load(request)
+    except ValueError:
+        raise ValidationError({"error": "Malformed JSON payload."})
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValidationError({"error": "Expected an array of objects."})
+    return items
+
+
+def batched(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def existing_ids(model, ids):
+    """Множество id из ids, которые есть в таблице model (запрос на каждые BATCH_SIZE id)"""
+    found = set()
+    for batch in batched(set(ids)):
+        found.update(model.objects.filter(id__in=batch).values_list("id", flat=True))
+    return found
+
+
+def existing_references(wanted):
+    """{поле: найденные id} для {поле: искомые id} по всем таблицам REFERENCES одним запросом (UNION ALL)"""
+    queries = [
+        REFERENCES[field][0].objects.filter(id__in=batch).values_list(Value(field, output_field=CharField()), "id")
+        for field, ids in wanted.items() for batch in batched(ids)
+    ]
+    found = {field: set() for field in wanted}
+    if queries:
+        for field, pk in queries[0].union(*queries[1:], all=True):
+            found[field].add(pk)
+    return found
+
+
+def check_references(rows, errors):
+    """Проверка внешних ключей всех строк пачкой, ошибки дописываются в errors по индексу"""
+    wanted = {}
+    for field in REFERENCES:
+        for row in rows.values():
+            value = row.get(field)
+            if isinstance(value, list):
+                wanted.setdefault(field, set()).update(value)
+            elif value is not None:
+                wanted.setdefault(field, set()).add(value)
+    found = existing_references(wanted)
+
+    for field, (model, message) in REFERENCES.items():
+        if field not in wanted or model is Division:
+            continue
+        for index, row in rows.items():
+            value = row.get(field)
+            values = value if isinstance(value, list) else [value] if value is not None else []
+            if any(v not in found[field] for v in values):
+                errors.setdefault(index, {})[field] = [message]
+
+    if "parent_id" in wanted:
+        # Родитель из пачки годится, только если его строка сама прошла проверку: отбракованная строка
+        # не будет записана, и её потомки в пачке тоже отбраковываются
+        rejected = True
+        while rejected:
+            rejected = False
+            known = found["parent_id"] | {row["id"] for index, row in rows.items()
+                                          if index not in errors and row.get("id") is not None}
+            for index, row in rows.items():
+                value = row.get("parent_id")
+                if index in errors or value is None:
+                    continue
+                if value not in known:
+                    errors.setdefault(index, {})["parent_id"] = [REFERENCES["parent_id"][1]]
+                    rejected = True
+                elif value == row.get("id"):
+                    errors.setdefault(index, {})["parent_id"] = ["Division cannot be its own parent."]
+                    rejected = True
+
+
+def check_cycles(rows, errors):
+    """Подразделения, которые пачка переносит под самих себя: цепочка parent после записи замкнулась бы
+
+    Родитель берётся из строки пачки, если она его задаёт, иначе — предки из сохранённого path до первого
+    подразделения, которое пачка переносит. Пути родителей — запрос на каждые BATCH_SIZE id.
+    """
+    parents = {row["id"]: row["parent_id"] for row in rows.values()
+               if row.get("id") is not None and "parent_id" in row}
+    targets = {parent_id for parent_id in parents.values() if parent_id is not None}
+    # Предки от самого подразделения к корню
+    ancestors = {}
+    for batch in batched(targets):
+        for pk, path in Division.objects.filter(pk__in=batch).exclude(path="").values_list("pk", "path"):
+            ancestors[pk] = [int(part) for part in reversed(path.strip("/").split("/"))]
+
+    def closes(start):
+        current, seen = parents[start], set()
+        while current is not None and current not in seen:
+            if current == start:
+                return True
+            seen.add(current)
+            if current in parents:
+                current = parents[current]
+                continue
+            following = None
+            for pk in ancestors.get(current, [current])[1:]:
+                if pk == start:
+                    return True
+                if pk in parents:
+                    following = pk
+                    break
+            current = following
+        return False
+
+    for index, row in rows.items():
+        if row.get("id") in parents and closes(row["id"]):
+            errors.setdefault(index, {})["parent_id"] = ["Division cannot be moved under itself."]
+
+
+def update_paths(ids):
+    """Пути подразделений ids, только что записанных пачкой, и поддеревьев тех из них, что уже были в таблице
+
+    У существующих строк в таблице ещё прежний путь: по нему находятся их потомки (условие по индексу пути).
+    """
+    old_paths = sorted(Division.objects.filter(pk__in=ids).exclude(path="").values_list("path", flat=True))
+    subtrees = Q(pk__in=ids)
+    covered = None
+    for path in old_paths:
+        # После сортировки вложенное поддерево идёт сразу за объемлющим и уже входит в него
+        if covered is None or not path.startswith(covered):
+            subtrees |= Q(path__startswith=path)
+            covered = path
+    Division.rebuild_paths(Division.objects.filter(subtrees))
+
+
+def write_batch(model, rows, existing):
+    """Вставка/обновление пачки строк, их M2M-связей с positions, путей подразделений и событий журнала одной
+    транзакцией
+
+    Возвращает {индекс: (id, статус)}; existing — id, которые были в таблице до загрузки.
+    """
+    m2m = {}
+    groups = {}
+    for index, row in rows:
+        positions_ids = row.pop("positions_ids", None)
+        obj = model(**row)
+        m2m[index] = (obj, positions_ids or [])
+        # update_fields у bulk_create общий на пачку, поэтому группируем по набору переданных полей
+        groups.setdefault((obj.pk is None, frozenset(row) - {"id"}), []).append(obj)
+
+    with transaction.atomic(), tracking.collect(), counters.collect():
+        if model is Division:
+            # Счётчики организаций, откуда подразделения уходят
+            moved = Division.objects.filter(pk__in=existing & {obj.pk for obj, _ in m2m.values()})
+            counters.touch(organizations=moved.values_list("organization_id", flat=True))
+        for (new, update_fields), objs in groups.items():
+            if new:
+                model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+            else:
+                model.objects.bulk_create(
+                    objs,
+                    batch_size=BATCH_SIZE,
+                    update_conflicts=bool(update_fields),
+                    ignore_conflicts=not update_fields,
+                    unique_fields=["id"] if update_fields else None,
+                    update_fields=list(update_fields) or None,
+                )
+        if model in counters.COUNTERS:
+            # Созданные строки — и без id, и с явно переданным id, которого не было в таблице
+            counters.create(model, [obj.pk for obj, _ in m2m.values() if obj.pk not in existing])
+
+        if any(f.name == "positions" for f in model._meta.many_to_many):
+            field = model._meta.get_field("positions")
+            through = field.remote_field.through
+            source, target = f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"
+            links = through.objects.filter(**{f"{source}__in": [obj.pk for obj, _ in m2m.values()]})
+            linked = set(links.values_list(target, flat=True))
+            links.delete()
+            through.objects.bulk_create(
+                [through(**{source: obj.pk, target: position_id})
+                 for obj, positions_ids in m2m.values() for position_id in set(positions_ids)],
+                batch_size=BATCH_SIZE,
+            )
+            if model in REFRESH_INDEXES:
+                REFRESH_INDEXES[model]([obj.pk for obj, _ in m2m.values()])
+            # Прежние и новые должности: у тех и других могли измениться счётчики
+            linked.update(position_id for _, positions_ids in m2m.values() for position_id in positions_ids)
+            counters.positions_changed(model, [obj.pk for obj, _ in m2m.values()], linked)
+        if model is Division:
+            update_paths([obj.pk for obj, _ in m2m.values()])
+            counters.touch(organizations={obj.organization_id for obj, _ in m2m.values() if obj.organization_id})
+
+        written = {index: (obj.pk, Change.UPDATED if obj.pk in existing else Change.CREATED)
+                   for index, (obj, _) in m2m.items()}
+        for action in (Change.CREATED, Change.UPDATED):
+            tracking.changed(tracking.resource_name(model),
+                             [pk for pk, status in written.values() if status == action], action)
+
+    return written
+
+
+def bulk_upsert(schema, items):
+    """Массовое создание/обновление: одна проверка схемой, запись пачками по BATCH_SIZE
+
+    Возвращает результат по каждому элементу в порядке items. Пачка, которую откатил IntegrityError (например,
+    параллельный запрос удалил упомянутую в ней должность), даёт ошибку у каждого своего элемента, остальные
+    пачки записываются.
+    """
+    model = schema.Meta.model
+    try:
+        loaded = schema.load(items, many=True)
+        errors = {}
+    except ValidationError as e:
+        loaded, errors = e.valid_data, dict(e.messages)
+
+    rows = {index: row for index, row in enumerate(loaded) if index not in errors}
+    if model is Division:
+        # До проверки ссылок: потомки отбракованных строк пачки отбраковываются вместе с ними
+        check_cycles(rows, errors)
+        rows = {index: row for index, row in rows.items() if index not in errors}
+    check_references(rows, errors)
+    rows = {index: row for index, row in rows.items() if index not in errors}
+
+    existing = existing_ids(model, [row["id"] for row in rows.values() if row.get("id") is not None])
+    results = [{"index": index, "status": "error", "errors": messages} for index, messages in errors.items()]
+    for batch in batched(rows.items()):
+        try:
+            written = write_batch(model, batch, existing)
+        except IntegrityError:
+            results.extend({"index": index, "status": "error", "errors": {"error": [BATCH_CONFLICT]}}
+                           for index, _ in batch)
+            continue
+        for index, (pk, status) in written.items():
+            results.append({"index": index, "status": status, "id": pk})
+
+    return sorted(results, key=lambda result: result["index"])
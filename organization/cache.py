@@ -0,0 +1,169 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+DEFAULTS = {
+    "ENABLED": True,
+    # Общий уровень: алиас из CACHES (locmem/файлы/Redis), хранит и ответы, и версии ключей
+    "ALIAS": "default",
+    "TIMEOUT": 300,
+    # Локальный уровень в памяти процесса
+    "LOCAL_MAXSIZE": 1024,
+    "LOCAL_TTL": 30,
+    # При большем числе затронутых объектов сбрасывается весь ресурс, а не отдельные id
+    "INVALIDATE_LIMIT": 1000,
+}
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, "ORGANIZATION_CACHE", {}))
+
+
+class LRUCache(object):
+    """Потокобезопасный LRU-кэш с ограничением размера и временем жизни записей"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = None
+
+
+def local_cache():
+    global _local
+    config = get_config()
+    if _local is None or (_local.maxsize, _local.ttl) != (config["LOCAL_MAXSIZE"], config["LOCAL_TTL"]):
+        _local = LRUCache(config["LOCAL_MAXSIZE"], config["LOCAL_TTL"])
+    return _local
+
+
+def shared_cache():
+    return caches[get_config()["ALIAS"]]
+
+
+def _version_key(resource, scope):
+    return f"organization:version:{resource}:{scope}"
+
+
+def _versions(resource, scope):
+    """(версия ресурса целиком, версия scope)"""
+    keys = [_version_key(resource, "all"), _version_key(resource, scope)]
+    versions = shared_cache().get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Версия, вытесненная из кэша, заменяется новой — иначе могли бы снова читаться старые ответы
+        for key in missing:
+            shared_cache().add(key, uuid.uuid4().hex, None)
+        versions.update(shared_cache().get_many(missing))
+    return tuple(versions[key] for key in keys)
+
+
+def response_key(resource, request, pk=None):
+    """Ключ ответа: включает версии ресурса целиком и объекта (или списка), так что
+    инвалидация — это смена версии, а старые записи просто перестают читаться"""
+    all_version, scope_version = _versions(resource, "list" if pk is None else pk)
+    # Версии сменяются только после коммита; состояние строк, прочитанное conditional.py, отделяет ответы
+    # сразу после коммита, иначе в этом окне старое тело отдавалось бы с ETag новой версии
+    state = getattr(request, "row_state", "")
+    # Состояние и путь произвольной длины, с пробелами: в ключ идёт их хэш (ограничения ключей memcached)
+    digest = hashlib.md5(f"{state}:{request.get_full_path()}".encode()).hexdigest()
+    return f"organization:response:{resource}:{all_version}:{scope_version}:{digest}"
+
+
+def cached_value(name, resources, compute):
+    """compute() под ключом name до любой записи в resources (версии их списков меняет каждое изменение)"""
+    config = get_config()
+    if not config["ENABLED"]:
+        return compute()
+    versions = ":".join(version for resource in resources for version in _versions(resource, "list"))
+    key = f"organization:value:{versions}:{name}"
+    item = local_cache().get(key)
+    if item is None:
+        item = shared_cache().get(key)
+        if item is None:
+            # В кортеже: закэшированный None отличается от промаха
+            item = (compute(),)
+            shared_cache().set(key, item, config["TIMEOUT"])
+        local_cache().set(key, item)
+    return item[0]
+
+
+def cached(resource, pk_kwarg=None):
+    """Кэширование GET-ответов view: байты JSON по ресурсу/объекту и строке запроса"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            config = get_config()
+            if request.method != "GET" or not config["ENABLED"]:
+                return view(request, *args, **kwargs)
+
+            key = response_key(resource, request, kwargs.get(pk_kwarg) if pk_kwarg else None)
+            content = local_cache().get(key)
+            if content is None:
+                content = shared_cache().get(key)
+                if content is not None:
+                    local_cache().set(key, content)
+            if content is not None:
+                return HttpResponse(content, content_type="application/json")
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                shared_cache().set(key, response.content, config["TIMEOUT"])
+                local_cache().set(key, response.content)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate(resource, ids=None):
+    """Смена версий после коммита: ids=None — весь ресурс, иначе объекты ids и все страницы списка"""
+    config = get_config()
+    if ids is not None and len(ids) > config["INVALIDATE_LIMIT"]:
+        ids = None
+    scopes = ["all"] if ids is None else ["list", *ids]
+    version = uuid.uuid4().hex
+    versions = {_version_key(resource, scope): version for scope in scopes}
+    transaction.on_commit(lambda: shared_cache().set_many(versions, None))
+
+
+def clear():
+    """Полный сброс (тесты, ручное обслуживание)"""
+    local_cache().clear()
+    shared_cache().clear()
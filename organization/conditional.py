@@ -0,0 +1,122 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.utils.http import parse_etags, parse_http_date_safe, quote_etag
+from django.views.decorators.http import condition
+
+from . import tracking
+
+
+def row_state(model, pk=None):
+    """(etag-основа, last_modified): версия строки или, для списка, версия списков ресурса (tracking.list_version) —
+    одним запросом по ключу; у списка нет Last-Modified"""
+    if pk is not None:
+        state = model.objects.filter(pk=pk).values_list("version", "updated_at").first()
+        if state is None:
+            return None
+        version, updated_at = state
+        return f"{pk}:{version}", updated_at
+    return f"list:{tracking.list_version(tracking.resource_name(model))}", None
+
+
+def make_etag(request, key, pk=None):
+    """ETag состояния key (row_state)
+
+    У списка в него входит строка запроса: страницы и режимы выдачи — разные ответы одного состояния. У объекта —
+    сама строка "<pk>:<version>": представления (?fields=, ?expand=) отличаются лишь выбором полей, и If-Match
+    с ETag любого из них подходит для записи по любому адресу объекта, а версия читается из него без запроса к БД.
+    """
+    if pk is not None:
+        return key
+    return hashlib.md5(f"{request.get_full_path()}:{key}".encode()).hexdigest()
+
+
+def write_condition(request, pk):
+    """Условие записи из If-Match/If-Unmodified-Since — lookups для UPDATE (schemas.save) или None без условий
+
+    If-Match сверяется строго, как у condition(): слабые и чужие ETag не совпадают ни с какой версией, и запись
+    даёт 412. If-Unmodified-Since учитывается, только если нет If-Match; Last-Modified сравнивается с точностью
+    до секунды.
+    """
+    if "HTTP_IF_MATCH" in request.META:
+        etags = parse_etags(request.META["HTTP_IF_MATCH"])
+        if etags == ["*"]:
+            return {}
+        versions = []
+        for etag in etags:
+            key, _, version = etag.strip('"').rpartition(":")
+            if not etag.startswith("W/") and key == str(pk) and version.isdigit():
+                versions.append(int(version))
+        return {"version__in": versions}
+    since = parse_http_date_safe(request.META.get("HTTP_IF_UNMODIFIED_SINCE"))
+    if since is not None:
+        return {"updated_at__lt": datetime.fromtimestamp(since + 1, tz=timezone.utc)}
+    return None
+
+
+def conditional_write(model, pk, view, request, *args, **kwargs):
+    """PUT/PATCH объекта: If-Match/If-Unmodified-Since проверяются самим UPDATE, без чтения версии заранее
+
+    Условие передаётся записи (request.write_condition, см. schemas.save): UPDATE выполняется только поверх
+    проверенной версии и сам её повышает, иначе 412. Ответ получает ETag новой версии — следующую запись можно
+    делать с ним, без повторного GET. После If-Match с одной версией она известна без запроса к БД: UPDATE сделал
+    её на единицу больше и держит строку до коммита, а tracking.changed не повышает её ещё раз.
+    """
+    condition = request.write_condition = write_condition(request, pk)
+    response = view(request, *args, **kwargs)
+    if response.status_code != 200:
+        return response
+    versions = (condition or {}).get("version__in", ())
+    if len(versions) == 1:
+        response["ETag"] = quote_etag(make_etag(request, f"{pk}:{versions[0] + 1}", pk))
+    else:
+        state = row_state(model, pk)
+        if state is not None:
+            response["ETag"] = quote_etag(make_etag(request, state[0], pk))
+    return response
+
+
+def conditional(model, pk_kwarg=None):
+    """ETag и Last-Modified для GET; If-None-Match/If-Modified-Since дают 304 без сериализации
+
+    PUT/PATCH объекта проверяют If-Match/If-Unmodified-Since, см. conditional_write.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            pk = kwargs.get(pk_kwarg) if pk_kwarg else None
+            if request.method in ("PUT", "PATCH") and pk is not None:
+                return conditional_write(model, pk, view, request, *args, **kwargs)
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            state = row_state(model, pk)
+            if state is None:
+                return view(request, *args, **kwargs)
+            return _condition(request, state, pk)(view)(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _condition(request, state, pk):
+    """Декоратор condition() для состояния, прочитанного row_state"""
+    key, last_modified = state
+    etag = make_etag(request, key, pk)
+    # Кэш ответов (cache.py) хранит тело под этим же состоянием: тело не старше ETag
+    request.row_state = key
+    return condition(
+        etag_func=lambda *args, **kwargs: etag,
+        last_modified_func=lambda *args, **kwargs: last_modified,
+    )
+
+
+async def aconditional(model, pk, view, request, *args, **kwargs):
+    """GET асинхронной view (async_views.py) с теми же ETag/Last-Modified и 304, что у conditional()"""
+    state = await sync_to_async(row_state)(model, pk)
+    if state is None:
+        return await view(request, *args, **kwargs)
+    return await _condition(request, state, pk)(view)(request, *args, **kwargs)
@@ -0,0 +1,323 @@
+"""Счётчики для дашбордов: численность организаций и подразделений, использование должностей
+
+Значения хранятся в отдельных таблицах (OrganizationCounters, DivisionCounters, PositionCounters) и не меняют
+версий самих объектов. Они обновляются в транзакции изменения: сигналы (signals.py), массовая загрузка, импорт
+снимков и фоновое удаление сообщают через touch(), что затронуто, и эти строки пересчитываются по индексам
+связей. Численность организации — различные сотрудники с должностями её подразделений — ведётся через
+таблицу OrganizationMember и меняется на разницу вставленных и удалённых строк членства.
+
+Перед пересчётом строки счётчиков блокируются в одном порядке (должности, подразделения, организации, по
+возрастанию id): параллельные записи не теряют изменений и не блокируют друг друга по кругу. Внутри collect()
+(запросы на запись, см. writes.atomic_write) затронутое копится и пересчитывается один раз в конце, вне его —
+сразу. Расхождения после правок в обход приложения исправляет manage.py rebuild_counters.
+
+Там же, под блокировками строк должностей, пересобирается индекс эффективных прав (access.py) затронутых
+сотрудников и прав: записи, связывающие сотрудника и право через одну должность, выполняются по очереди, и
+вторая видит связи первой (иначе каждая не видит незакоммиченной связи другой, и пара теряется).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection, transaction
+
+from . import access
+from .models import Organization, Division, Position, Employee, Permission, OrganizationCounters, \
+    DivisionCounters, PositionCounters, OrganizationMember
+
+BATCH_SIZE = 2000
+
+COUNTERS = {
+    Organization: OrganizationCounters,
+    Division: DivisionCounters,
+    Position: PositionCounters,
+}
+
+_pending = ContextVar("counters_pending", default=None)
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def _links(model):
+    return _table(model.positions.through)
+
+
+def _grouped(table, key, value="count(*)", join=""):
+    """Подсчёт по группам для _recount: (id, значение) для id из параметра-массива"""
+    return f"SELECT {key}, {value} FROM {table} {join} WHERE {key} = ANY(%s) GROUP BY {key}"
+
+
+def _division_counts():
+    return {
+        "position_count": _grouped(_links(Division), "division_id"),
+        "headcount": _grouped(f"{_links(Division)} dp", "dp.division_id", value="count(DISTINCT ep.employee_id)",
+                              join=f"JOIN {_links(Employee)} ep ON ep.position_id = dp.position_id"),
+    }
+
+
+def _position_counts():
+    return {
+        "employee_count": _grouped(_links(Employee), "position_id"),
+        "permission_count": _grouped(_links(Permission), "position_id"),
+        "division_count": _grouped(_links(Division), "position_id"),
+    }
+
+
+def _organization_counts(headcount=False):
+    counts = {"division_count": _grouped(_table(Division), "organization_id")}
+    if headcount:
+        counts["headcount"] = _grouped(_table(OrganizationMember), "organization_id")
+    return counts
+
+
+def _lock(cursor, model, ids):
+    """Блокировка строк счётчиков по возрастанию id (ids уже отсортированы)"""
+    counters = COUNTERS[model]
+    key = counters._meta.pk.column
+    cursor.execute(f"SELECT {key} FROM {_table(counters)} WHERE {key} = ANY(%s) ORDER BY {key} FOR UPDATE", [ids])
+
+
+def _recount(cursor, model, ids, counts):
+    """Пересчёт столбцов counts ({столбец: _grouped(...)}) у строк ids; возвращает число изменённых строк"""
+    counters = COUNTERS[model]
+    key = counters._meta.pk.column
+    values = [f"coalesce(n{i}.value, 0)" for i in range(len(counts))]
+    joins = " ".join(f"LEFT JOIN ({sql}) AS n{i}(id, value) ON n{i}.id = k.id" for i, sql in enumerate(counts.values()))
+    changed = 0
+    for chunk in _chunks(sorted(ids)):
+        _lock(cursor, model, chunk)
+        cursor.execute(
+            f"UPDATE {_table(counters)} c SET {', '.join(f'{column} = n.{column}' for column in counts)} "
+            f"FROM (SELECT k.id, {', '.join(f'{value} AS {column}' for value, column in zip(values, counts))} "
+            f"FROM unnest(%s::bigint[]) AS k(id) {joins}) n "
+            f"WHERE c.{key} = n.id AND ({', '.join(f'c.{column}' for column in counts)}) "
+            f"IS DISTINCT FROM ({', '.join(f'n.{column}' for column in counts)})",
+            [chunk] * (len(counts) + 1),
+        )
+        changed += cursor.rowcount
+    return changed
+
+
+def _ids(cursor, sql, ids):
+    found = set()
+    for chunk in _chunks(ids):
+        cursor.execute(sql, [chunk])
+        found.update(pk for pk, in cursor.fetchall())
+    return found
+
+
+def _memberships():
+    """Пары (организация, сотрудник) по текущим связям; параметры — id сотрудников и id организаций"""
+    return (f"SELECT DISTINCT d.organization_id, ep.employee_id FROM {_links(Employee)} ep "
+            f"JOIN {_links(Division)} dp ON dp.position_id = ep.position_id "
+            f"JOIN {_table(Division)} d ON d.id = dp.division_id "
+            f"WHERE ep.employee_id = ANY(%s) AND d.organization_id = ANY(%s)")
+
+
+def _update_members(cursor, employee_ids, organization_ids=(), holders=()):
+    """Членство сотрудников по их текущим должностям и численность затронутых организаций
+
+    У employee_ids членство проверяется во всех организациях, где они состоят или должны состоять, у holders —
+    только в organization_ids (сменились подразделения этих организаций). Строки счётчиков организаций
+    блокируются заранее; организации, куда сотрудников переводит чужая незавершённая транзакция, здесь не
+    видны — их обновит она сама. Возвращает число вставленных и удалённых строк членства.
+    """
+    members = _table(OrganizationMember)
+    scope = set(organization_ids)
+    for chunk in _chunks(employee_ids):
+        cursor.execute(f"SELECT organization_id FROM {members} WHERE employee_id = ANY(%s) UNION "
+                       f"SELECT d.organization_id FROM {_links(Employee)} ep "
+                       f"JOIN {_links(Division)} dp ON dp.position_id = ep.position_id "
+                       f"JOIN {_table(Division)} d ON d.id = dp.division_id WHERE ep.employee_id = ANY(%s)",
+                       [chunk, chunk])
+        scope.update(pk for pk, in cursor.fetchall())
+    if not scope:
+        return 0
+    for chunk in _chunks(sorted(scope)):
+        _lock(cursor, Organization, chunk)
+
+    delta, changed = {}, 0
+    for employees, organizations in ((employee_ids, scope), (set(holders) - set(employee_ids), organization_ids)):
+        organizations = sorted(organizations)
+        for chunk in _chunks(sorted(employees)):
+            cursor.execute(f"INSERT INTO {members} (organization_id, employee_id) {_memberships()} "
+                           f"ON CONFLICT DO NOTHING RETURNING organization_id", [chunk, organizations])
+            for pk, in cursor.fetchall():
+                delta[pk] = delta.get(pk, 0) + 1
+                changed += 1
+            # NOT EXISTS, а не NOT IN: его PostgreSQL выполняет как anti join, а NOT IN с подзапросом, не
+            # поместившимся в work_mem, перебирает подзапрос для каждой строки членства. Условие на
+            # сотрудников повторено внутри, иначе anti join соединяет связи всех сотрудников
+            cursor.execute(f"DELETE FROM {members} m WHERE m.employee_id = ANY(%s) AND m.organization_id = ANY(%s) "
+                           f"AND NOT EXISTS (SELECT 1 FROM {_links(Employee)} ep "
+                           f"JOIN {_links(Division)} dp ON dp.position_id = ep.position_id "
+                           f"JOIN {_table(Division)} d ON d.id = dp.division_id "
+                           f"WHERE ep.employee_id = ANY(%s) AND ep.employee_id = m.employee_id "
+                           f"AND d.organization_id = m.organization_id) "
+                           f"RETURNING m.organization_id", [chunk, organizations, chunk])
+            for pk, in cursor.fetchall():
+                delta[pk] = delta.get(pk, 0) - 1
+                changed += 1
+    delta = {pk: value for pk, value in delta.items() if value}
+    if delta:
+        cursor.execute(f"UPDATE {_table(OrganizationCounters)} c SET headcount = c.headcount + d.delta "
+                       f"FROM unnest(%s::bigint[], %s::int[]) AS d(id, delta) WHERE c.organization_id = d.id",
+                       [list(delta), list(delta.values())])
+    return changed
+
+
+class Pending(object):
+    """Затронутое изменениями: что пересчитать"""
+
+    def __init__(self):
+        # Должности: их собственные счётчики
+        self.positions = set()
+        # Должности, у которых сменились сотрудники: численность подразделений с этими должностями
+        self.staffed = set()
+        # Должности, у которых сменились подразделения: членство их сотрудников в организациях этих
+        # подразделений (divisions) или явно переданных (organizations, например для удалённых подразделений)
+        self.placed = set()
+        self.employees = set()
+        # Сотрудники и права, у которых сменились должности: их эффективные права (access.py); удалённых объектов
+        # здесь нет — их строки индекса удалил каскад
+        self.grantees = set()
+        self.permissions = set()
+        self.divisions = set()
+        self.organizations = set()
+
+    def __bool__(self):
+        return any(self.__dict__.values())
+
+
+def refresh(pending):
+    """Пересчёт затронутого в текущей транзакции"""
+    if not pending:
+        return
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        _recount(cursor, Position, pending.positions | pending.staffed | pending.placed, _position_counts())
+        access.refresh_employees(pending.grantees)
+        access.refresh_permissions(pending.permissions)
+        divisions = pending.divisions | _ids(
+            cursor, f"SELECT DISTINCT division_id FROM {_links(Division)} WHERE position_id = ANY(%s)", pending.staffed)
+        _recount(cursor, Division, divisions, _division_counts())
+        holders, organizations = set(), set(pending.organizations)
+        if pending.placed:
+            holders = _ids(cursor, f"SELECT DISTINCT employee_id FROM {_links(Employee)} WHERE position_id = ANY(%s)",
+                           pending.placed)
+            organizations |= _ids(cursor, f"SELECT DISTINCT organization_id FROM {_table(Division)} "
+                                          f"WHERE id = ANY(%s)", pending.divisions)
+        _update_members(cursor, pending.employees, organizations, holders)
+        _recount(cursor, Organization, pending.organizations, _organization_counts())
+
+
+def touch(positions=(), staffed=(), placed=(), employees=(), grantees=(), permissions=(), divisions=(),
+          organizations=()):
+    """Отметка затронутого (аргументы — как атрибуты Pending); вне collect() пересчитывается сразу"""
+    pending = _pending.get()
+    immediate = pending is None
+    if immediate:
+        pending = Pending()
+    pending.positions.update(positions)
+    pending.staffed.update(staffed)
+    pending.placed.update(placed)
+    pending.employees.update(employees)
+    pending.grantees.update(grantees)
+    pending.permissions.update(permissions)
+    pending.divisions.update(divisions)
+    pending.organizations.update(organizations)
+    if immediate:
+        refresh(pending)
+
+
+def positions_changed(model, ids, position_ids, deleted=False):
+    """Связи объектов model (ids) с должностями position_ids добавлены или удалены (deleted — вместе с объектами)"""
+    granted = () if deleted else ids
+    if model is Employee:
+        touch(employees=ids, grantees=granted, staffed=position_ids)
+    elif model is Division:
+        touch(divisions=ids, positions=position_ids, placed=position_ids)
+    else:
+        touch(positions=position_ids, permissions=granted)
+
+
+@contextmanager
+def collect():
+    """Затронутое внутри блока пересчитывается один раз при выходе из него; вызывается внутри транзакции"""
+    if _pending.get() is not None:
+        yield
+        return
+    pending = Pending()
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+    # Запрос мог поймать ошибку и вернуть 400: транзакция всё равно будет откачена
+    if not transaction.get_rollback():
+        refresh(pending)
+
+
+def add_members(organization_id):
+    """Членство в организации, загруженной целиком в этой транзакции (импорт снимка), и её численность
+
+    Должности и сотрудники организации тоже новые: других строк членства у них нет, и сверка по сотрудникам
+    (_update_members) не нужна — строки вставляются одним INSERT ... SELECT.
+    """
+    with connection.cursor() as cursor:
+        _lock(cursor, Organization, [organization_id])
+        cursor.execute(f"INSERT INTO {_table(OrganizationMember)} (organization_id, employee_id) "
+                       f"SELECT DISTINCT d.organization_id, ep.employee_id FROM {_links(Employee)} ep "
+                       f"JOIN {_links(Division)} dp ON dp.position_id = ep.position_id "
+                       f"JOIN {_table(Division)} d ON d.id = dp.division_id WHERE d.organization_id = %s "
+                       f"ON CONFLICT DO NOTHING", [organization_id])
+        cursor.execute(f"UPDATE {_table(OrganizationCounters)} SET headcount = headcount + %s "
+                       f"WHERE organization_id = %s", [cursor.rowcount, organization_id])
+
+
+def create(model, ids):
+    """Строки счётчиков для объектов, созданных в обход сигналов (bulk_create, COPY)"""
+    counters = COUNTERS[model]
+    with connection.cursor() as cursor:
+        for chunk in _chunks(ids):
+            cursor.execute(f"INSERT INTO {_table(counters)} ({counters._meta.pk.column}) "
+                           f"SELECT unnest(%s::bigint[]) ON CONFLICT DO NOTHING", [chunk])
+
+
+def _keys(model):
+    """id всех объектов model пачками по BATCH_SIZE"""
+    last = 0
+    while True:
+        ids = list(model.objects.filter(pk__gt=last).order_by("pk").values_list("pk", flat=True)[:BATCH_SIZE])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def rebuild():
+    """Пересчёт всех счётчиков пачками, каждая в своей транзакции; возвращает {что: исправлено строк}"""
+    drift = {}
+    for model, counters in COUNTERS.items():
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {_table(counters)} ({counters._meta.pk.column}) "
+                           f"SELECT id FROM {_table(model)} ON CONFLICT DO NOTHING")
+            drift[model._meta.db_table] = cursor.rowcount
+    for model, counts in ((Position, _position_counts()), (Division, _division_counts())):
+        for ids in _keys(model):
+            with transaction.atomic(), connection.cursor() as cursor:
+                drift[model._meta.db_table] += _recount(cursor, model, ids, counts)
+    drift["members"] = 0
+    for ids in _keys(Employee):
+        with transaction.atomic(), connection.cursor() as cursor:
+            drift["members"] += _update_members(cursor, ids)
+    for ids in _keys(Organization):
+        with transaction.atomic(), connection.cursor() as cursor:
+            drift[Organization._meta.db_table] += _recount(cursor, Organization, ids, _organization_counts(True))
+    return drift
@@ -0,0 +1,181 @@
+"""Подсказки по сотрудникам (/api/employees/search/?q=): по ФИО, должностям и подразделениям
+
+Поиск идёт по индексам PostgreSQL (models.py), отдельной копии данных в памяти процессов нет. Индексы выражений
+над ФИО и названиями обновляются вместе со строками; единственное, что пишет приложение, — лексемы должностей
+сотрудника (Employee.position_tokens, refresh_positions) при каждом изменении его связей. Уровни совпадения (rank):
+
+3 — ФИО («имя фамилия» или «фамилия имя») начинается с запроса: проход по B-tree индексу name_key в порядке
+    ключа до limit строк, без выборки и сортировки всех совпадений;
+2 — каждое слово запроса — начало слова имени или фамилии (GIN-индекс полнотекстового поиска);
+1 — остальные слова — начала слов в названиях должностей сотрудника или подразделений с этими должностями:
+    слова переводятся в id должностей, и все условия проверяет один GIN-индекс directory_document.
+
+Уровень 3 упорядочен по совпавшей строке, 2 и 1 — по фамилии и имени. Следующий уровень запрашивается, только
+если предыдущих не хватило до limit: обычный ввод ФИО обходится одним запросом к сотрудникам.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import connection
+from django.db.models import BooleanField, Func, Value
+from marshmallow import ValidationError
+
+from . import cache
+from .models import Division, Employee, Position, SEARCH_CONFIG, directory_document, name_key
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+MAX_QUERY_LENGTH = 100
+# Больше слов в запросе не учитываются: каждое слово уровня 1 — отдельный поиск должностей
+MAX_TOKENS = 5
+# Слово, под которое подходит больше должностей или подразделений, на уровне 1 не проверяется
+MAX_MATCHES = 200
+# Совпадений уровней 2 и 1 сортируется не больше стольких, см. _first
+SORT_LIMIT = 1000
+# Лексема должности в position_tokens: слова запроса — только буквы и цифры и не могут с ней совпасть
+POSITION_LEXEME = "_p"
+BATCH_SIZE = 2000
+
+
+def parse_query(params):
+    """(строка для поиска по началу ФИО, слова, limit) из ?q=&limit="""
+    errors = {}
+    phrase = " ".join(params.get("q", "").lower().split())
+    if not phrase:
+        errors["q"] = ["Search query is required."]
+    elif len(phrase) > MAX_QUERY_LENGTH:
+        errors["q"] = [f"Search query must be at most {MAX_QUERY_LENGTH} characters."]
+    limit = params.get("limit") or DEFAULT_LIMIT
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_LIMIT:
+        errors["limit"] = [f"Limit must be between 1 and {MAX_LIMIT}."]
+    if errors:
+        raise ValidationError(errors)
+    return phrase, re.findall(r"[^\W_]+", phrase)[:MAX_TOKENS], limit
+
+
+def _prefix(tokens):
+    """Все слова — начала слов документа; слова состоят только из букв и цифр, экранировать нечего"""
+    return SearchQuery(" & ".join(f"{token}:*" for token in tokens), config=SEARCH_CONFIG, search_type="raw")
+
+
+def _by_full_name(phrase, limit):
+    """Уровень 3: [(ключ, id, имя, фамилия)] по обоим порядкам ФИО, каждый — упорядоченным проходом индекса"""
+    found = None
+    for first, second in (("first_name", "last_name"), ("last_name", "first_name")):
+        matches = (Employee.objects.annotate(key=name_key(first, second)).filter(key__startswith=phrase)
+                   .order_by("key", "pk").values_list("key", "pk", "first_name", "last_name")[:limit])
+        found = matches if found is None else found.union(matches, all=True)
+    rows, seen = [], set()
+    for row in sorted(found):
+        if row[1] not in seen:
+            seen.add(row[1])
+            rows.append(row[1:])
+    return rows[:limit]
+
+
+def _first(matches, exclude, limit):
+    """Первые limit из matches по фамилии и имени
+
+    Сортируются не больше SORT_LIMIT совпадений, выбранных без порядка по GIN-индексу: при редких
+    совпадениях — точно, при частых — первые найденные, запрос всё равно будут уточнять. Подзапрос с LIMIT не
+    даёт PostgreSQL пройти индекс (фамилия, имя) с limit: при совпадениях в конце алфавита это вся таблица.
+    """
+    sql, params = (matches.exclude(pk__in=exclude).values_list("pk", "first_name", "last_name")[:SORT_LIMIT]
+                   .query.sql_with_params())
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM ({sql}) matches ORDER BY last_name, first_name, id LIMIT %s", [*params, limit])
+        return cursor.fetchall()
+
+
+def _by_name_words(tokens, exclude, limit):
+    """Уровень 2: все слова запроса — в имени или фамилии"""
+    return _first(Employee.objects.alias(names=SearchVector("first_name", "last_name", config=SEARCH_CONFIG))
+                  .filter(names=_prefix(tokens)), exclude, limit)
+
+
+def _positions(token):
+    """id должностей, в названии которых или в названии одного из их подразделений есть слово на token
+
+    None — слову соответствует больше MAX_MATCHES должностей или подразделений: оно почти никого не отсекает.
+    Ввод по буквам повторяет одни и те же слова: ответ кэшируется до любой записи в должности или подразделения.
+    """
+    return cache.cached_value(f"directory:{token}", ("positions", "divisions"), lambda: _find_positions(token))
+
+
+def _find_positions(token):
+    query = _prefix([token])
+    divisions = list(Division.objects.alias(words=SearchVector("name", config=SEARCH_CONFIG))
+                     .filter(words=query).values_list("pk", flat=True)[:MAX_MATCHES + 1])
+    if len(divisions) > MAX_MATCHES:
+        return None
+    # Подразделения — отдельным запросом: со списком id связи читаются по индексу, а не хешем всей таблицы
+    by_name = (Position.objects.alias(words=SearchVector("name", config=SEARCH_CONFIG))
+               .filter(words=query).values_list("pk"))
+    by_division = Division.positions.through.objects.filter(division_id__in=divisions).values_list("position_id")
+    positions = [pk for pk, in by_name.union(by_division)[:MAX_MATCHES + 1]]
+    return None if len(positions) > MAX_MATCHES else positions
+
+
+def _matches(query):
+    """directory_document @@ query: запрос приводится к tsquery как есть, to_tsquery разбил бы лексемы должностей"""
+    return Func(directory_document(), Func(Value(query), template="%(expressions)s::tsquery"),
+                template="%(expressions)s", arg_joiner=" @@ ", output_field=BooleanField())
+
+
+def _by_positions(tokens, exclude, limit):
+    """Уровень 1: каждое слово — в ФИО, в должности или в подразделении с должностью сотрудника"""
+    conditions = []
+    for token in tokens:
+        positions = _positions(token)
+        if positions is not None:
+            conditions.append(" | ".join([f"'{token}':*", *(f"'{POSITION_LEXEME}{pk}'" for pk in positions)]))
+    if not conditions:
+        return []
+    query = " & ".join(f"({condition})" for condition in conditions)
+    return _first(Employee.objects.filter(_matches(query)), exclude, limit)
+
+
+def _positions_of(employee_ids):
+    """{сотрудник: [{"id", "name"} должностей]} одним запросом"""
+    positions = {}
+    links = (Employee.positions.through.objects.filter(employee_id__in=employee_ids)
+             .order_by("position__name", "position_id").values_list("employee_id", "position_id", "position__name"))
+    for employee_id, position_id, name in links:
+        positions.setdefault(employee_id, []).append({"id": position_id, "name": name})
+    return positions
+
+
+def search(phrase, tokens, limit):
+    """До limit сотрудников по уровням совпадения: [{"id", "first_name", "last_name", "rank", "positions"}]"""
+    found = [(3, row) for row in _by_full_name(phrase, limit)]
+    for rank, tier in ((2, _by_name_words), (1, _by_positions)):
+        if len(found) >= limit or not tokens:
+            break
+        found += [(rank, row) for row in tier(tokens, [row[0] for _, row in found], limit - len(found))]
+
+    positions = _positions_of([row[0] for _, row in found])
+    return [{"id": pk, "first_name": first_name, "last_name": last_name, "rank": rank, "positions": positions.get(pk, [])}
+            for rank, (pk, first_name, last_name) in found]
+
+
+def position_tokens(position_ids):
+    """Значение Employee.position_tokens (текст tsvector) для должностей position_ids — для вставки через COPY"""
+    return " ".join(f"'{POSITION_LEXEME}{pk}'" for pk in sorted(set(position_ids)))
+
+
+def refresh_positions(employee_ids):
+    """Лексемы должностей сотрудников по их текущим связям (Employee.position_tokens)"""
+    employee_ids = list(employee_ids)
+    table = connection.ops.quote_name(Employee._meta.db_table)
+    links = connection.ops.quote_name(Employee.positions.through._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(employee_ids), BATCH_SIZE):
+            cursor.execute(
+                f"UPDATE {table} e SET position_tokens = array_to_tsvector(ARRAY("
+                f"SELECT %s || l.position_id FROM {links} l WHERE l.employee_id = e.id)) WHERE e.id = ANY(%s)",
+                [POSITION_LEXEME, employee_ids[start:start + BATCH_SIZE]],
+            )
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import Change
+
+DEFAULTS = {
+    "POLL_INTERVAL": 0.5,
+    "MAX_WAIT": 30,
+}
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, "CHANGE_FEED", {}))
+
+
+def visible(since):
+    """События после seq=since
+
+    Журнал пишется под блокировкой до коммита (tracking.lock_log), seq выдаются в порядке коммитов: незакоммиченная
+    запись не может получить seq меньше уже видимого, и курсор по seq не пропускает событий, сколько бы ни шла
+    транзакция.
+    """
+    return Change.objects.filter(seq__gt=since).order_by("seq")
+
+
+def last_seq():
+    """seq последнего записанного события (с него начинают новые подписки, webhooks.py)"""
+    return Change.objects.aggregate(last=Max("seq"))["last"] or 0
+
+
+def read(since, limit):
+    """До limit событий после since, без ожидания
+
+    Long-poll есть только у aread(): синхронное ожидание держало бы поток воркера и соединение с базой.
+    """
+    return list(visible(since)[:limit])
+
+
+async def aread(since, limit, wait=0):
+    """До limit событий после since; если их нет, ждёт новые до wait секунд (long-poll), не занимая поток"""
+    config = get_config()
+    deadline = time.monotonic() + min(wait, config["MAX_WAIT"])
+    while True:
+        events = [event async for event in visible(since)[:limit]]
+        if events or time.monotonic() >= deadline:
+            return events
+        await asyncio.sleep(config["POLL_INTERVAL"])
@@ -0,0 +1,104 @@
+from functools import reduce
+from operator import or_
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db.models import Q
+from marshmallow import ValidationError
+
+from .models import Organization, Division, Position, Employee, Permission, SEARCH_CONFIG
+
+
+def _integer(value):
+    return int(value)
+
+
+def _nullable_integer(value):
+    """"null" — поле не задано (например, корневые подразделения: ?parent_id=null)"""
+    return None if value == "null" else int(value)
+
+
+def _text(value):
+    return value
+
+
+# Параметр запроса → (lookup'ы, объединяемые через ИЛИ, разбор значения)
+FILTERS = {
+    Organization: {
+        "name__icontains": (("name__icontains",), _text),
+    },
+    Division: {
+        "organization_id": (("organization_id",), _integer),
+        "parent_id": (("parent_id",), _nullable_integer),
+        "position_id": (("positions",), _integer),
+        "name__icontains": (("name__icontains",), _text),
+    },
+    Position: {
+        "name__icontains": (("name__icontains",), _text),
+    },
+    Employee: {
+        "position_id": (("positions",), _integer),
+        "name__icontains": (("first_name__icontains", "last_name__icontains"), _text),
+    },
+    Permission: {
+        "position_id": (("positions",), _integer),
+        "name__icontains": (("name__icontains",), _text),
+    },
+}
+
+# Поля, допустимые в ?ordering= (через запятую, "-" — по убыванию)
+ORDERING = {
+    Organization: ("name",),
+    Division: ("name", "depth"),
+    Position: ("name",),
+    Employee: ("last_name", "first_name"),
+    Permission: ("name",),
+}
+
+# Поля полнотекстового ?search=; выражение совпадает с GIN-индексом модели
+SEARCH = {
+    Employee: ("first_name", "last_name"),
+    Permission: ("name", "description"),
+}
+
+
+def parse_ordering(model, value):
+    ordering = tuple(name.strip() for name in (value or "").split(",") if name.strip())
+    allowed = ORDERING.get(model, ())
+    unknown = [name for name in ordering if name.lstrip("-") not in allowed and name.lstrip("-") != "id"]
+    if unknown:
+        raise ValidationError({"ordering": [f"Cannot order by {name}." for name in unknown]})
+    # id всегда замыкает сортировку (см. pagination.ordered)
+    return tuple(name for name in ordering if name.lstrip("-") != "id")
+
+
+def filter_queryset(queryset, params):
+    """(выборка, сортировка) по параметрам ?<фильтр>=, ?search=, ?ordering= для ресурса queryset.model"""
+    model = queryset.model
+    errors = {}
+    for param, (lookups, parse) in FILTERS.get(model, {}).items():
+        if param not in params:
+            continue
+        try:
+            value = parse(params[param])
+        except ValueError:
+            errors[param] = ["Must be an integer."]
+            continue
+        if value is None:
+            queryset = queryset.filter(**{f"{lookups[0]}__isnull": True})
+        else:
+            queryset = queryset.filter(reduce(or_, (Q(**{lookup: value}) for lookup in lookups)))
+
+    search = params.get("search", "").strip()
+    if search and model in SEARCH:
+        queryset = queryset.alias(search=SearchVector(*SEARCH[model], config=SEARCH_CONFIG)).filter(
+            search=SearchQuery(search, config=SEARCH_CONFIG, search_type="websearch"))
+    elif search:
+        errors["search"] = ["Full-text search is not available for this resource."]
+
+    try:
+        ordering = parse_ordering(model, params.get("ordering"))
+    except ValidationError as e:
+        errors.update(e.messages)
+    if errors:
+        raise ValidationError(errors)
+    return queryset, ordering
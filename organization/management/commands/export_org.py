@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from organization.models import Organization
+from organization.snapshot import export_snapshot
+
+
+class Command(BaseCommand):
+    help = "Выгрузка организации со всеми подразделениями, должностями, сотрудниками и правами (gzip NDJSON)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("organization_id", type=int)
+        parser.add_argument("-o", "--output", help="Файл снимка, по умолчанию stdout")
+
+    def handle(self, organization_id, output=None, **options):
+        if not Organization.objects.filter(pk=organization_id).exists():
+            raise CommandError(f"Organization {organization_id} does not exist.")
+        target = open(output, "wb") if output else sys.stdout.buffer
+        try:
+            for data in export_snapshot(organization_id):
+                target.write(data)
+        finally:
+            if output:
+                target.close()
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from marshmallow import ValidationError
+
+from organization.snapshot import import_snapshot
+
+
+class Command(BaseCommand):
+    help = "Загрузка снимка организации (export_org) одной транзакцией с новыми id"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Файл снимка, '-' — stdin")
+        parser.add_argument("--name", help="Новое имя организации (имя должно быть уникальным)")
+
+    def handle(self, input, name=None, **options):
+        source = sys.stdin.buffer if input == "-" else open(input, "rb")
+        try:
+            result = import_snapshot(source, name=name)
+        except ValidationError as e:
+            raise CommandError(e.messages)
+        except IntegrityError:
+            raise CommandError("Organization with this name already exists, pass --name.")
+        finally:
+            if input != "-":
+                source.close()
+        counts = ", ".join(f"{table}: {count}" for table, count in result["counts"].items())
+        self.stdout.write(f"Imported organization {result['organization_id']} ({counts})")
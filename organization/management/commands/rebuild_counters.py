@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from organization import counters
+
+
+class Command(BaseCommand):
+    help = "Пересчёт счётчиков (counters.py) по текущим данным: исправляет расхождения после правок в обход приложения"
+
+    def handle(self, **options):
+        started = time.perf_counter()
+        drift = counters.rebuild()
+        for table, fixed in drift.items():
+            self.stdout.write(f"{table}: {fixed} fixed")
+        self.stdout.write(f"Rebuilt counters in {time.perf_counter() - started:.1f}s, {sum(drift.values())} fixed")
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from organization import purge
+
+
+class Command(BaseCommand):
+    help = "Выполнение ожидающих и брошенных заданий фонового удаления (purge.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--watch", action="store_true", help="Не завершаться, проверять новые задания")
+        parser.add_argument("--interval", type=float, default=5, help="Пауза между проверками с --watch, секунды")
+
+    def handle(self, watch, interval, **options):
+        while True:
+            for job_id in purge.pending():
+                if purge.run(job_id):
+                    self.stdout.write(f"Purge job {job_id} finished")
+            if not watch:
+                return
+            time.sleep(interval)
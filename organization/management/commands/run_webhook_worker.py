@@ -0,0 +1,19 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from organization import webhooks
+
+
+class Command(BaseCommand):
+    help = "Доставка журнала изменений подписчикам webhooks (webhooks.py); можно запускать несколько процессов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Доставить накопившиеся события и завершиться, не ждать новых")
+
+    def handle(self, once, **options):
+        try:
+            asyncio.run(webhooks.run(once=once))
+        except KeyboardInterrupt:
+            pass
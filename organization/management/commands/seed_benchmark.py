@@ -0,0 +1,121 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from organization import access, counters, directory
+from organization.models import Organization, Division, Position, Employee, Permission, EffectivePermission, \
+    OrganizationCounters, DivisionCounters, PositionCounters, OrganizationMember
+
+BATCH_SIZE = 5000
+
+# Масштабы: организации, подразделения на организацию, должности, сотрудники, права
+SCALES = {
+    "small": dict(organizations=2, divisions=200, positions=50, employees=2000, permissions=100),
+    "medium": dict(organizations=5, divisions=2000, positions=500, employees=50000, permissions=1000),
+    "large": dict(organizations=20, divisions=5000, positions=2000, employees=400000, permissions=5000),
+}
+
+FIRST_NAMES = ("Ada", "Alan", "Grace", "Edsger", "Barbara", "Donald", "Margaret", "Ken", "Frances", "John",
+               "Radia", "Dennis", "Katherine", "Niklaus", "Sophie", "Tony", "Hedy", "Linus", "Anita", "Guido")
+LAST_NAMES = ("Lovelace", "Turing", "Hopper", "Dijkstra", "Liskov", "Knuth", "Hamilton", "Thompson", "Allen",
+              "McCarthy", "Perlman", "Ritchie", "Johnson", "Wirth", "Wilson", "Hoare", "Lamarr", "Torvalds",
+              "Borg", "Rossum")
+
+
+def batched(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Command(BaseCommand):
+    help = "Синтетическая оргструктура для бенчмарков: деревья подразделений, должности, сотрудники и права"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", choices=SCALES, default="small")
+        for name in SCALES["small"]:
+            parser.add_argument(f"--{name}", type=int, help="Переопределяет значение масштаба")
+        parser.add_argument("--branching", type=float, default=4,
+                            help="Среднее число дочерних подразделений: меньше — глубже дерево")
+        parser.add_argument("--roots", type=int, default=3, help="Корневых подразделений в организации")
+        parser.add_argument("--seed", type=int, default=0, help="Зерно генератора (воспроизводимые данные)")
+
+    def handle(self, scale, branching, roots, seed, **options):
+        sizes = {name: options[name] if options[name] is not None else value
+                 for name, value in SCALES[scale].items()}
+        self.random = random.Random(seed)
+        started = time.perf_counter()
+        with transaction.atomic():
+            positions = self.seed_positions(sizes["positions"])
+            prefix = f"Benchmark {seed}-{Organization.objects.count()}"
+            for i in range(sizes["organizations"]):
+                organization = Organization.objects.create(name=f"{prefix} org {i}", description="Synthetic data")
+                self.seed_divisions(organization, sizes["divisions"], roots, branching, positions)
+            self.seed_permissions(sizes["permissions"], positions)
+            self.seed_employees(sizes["employees"], positions)
+            # Статистика планировщика по только что загруженным строкам (видны и внутри этой транзакции):
+            # без неё пересчёт счётчиков соединяет таблицы сотни тысяч строк как пустые
+            self.analyze(Organization, Division, Position, Employee, Permission, EffectivePermission)
+            # bulk_create не отправляет сигналы: счётчики пересчитываются целиком
+            counters.rebuild()
+            self.analyze(OrganizationCounters, DivisionCounters, PositionCounters, OrganizationMember)
+        self.stdout.write(f"Seeded {sizes} in {time.perf_counter() - started:.1f}s")
+
+    def analyze(self, *models):
+        if connection.vendor != "postgresql":
+            return
+        tables = [model._meta.db_table for model in models]
+        tables += [model.positions.through._meta.db_table for model in models
+                   if model in (Division, Employee, Permission)]
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE " + ", ".join(tables))
+
+    def fan_out(self, positions, weights):
+        """Случайные должности с реалистичным распределением их числа (weights — веса 1, 2, ... должностей)"""
+        count = self.random.choices(range(1, len(weights) + 1), weights)[0]
+        return self.random.sample(positions, min(count, len(positions)))
+
+    def link(self, model, objs, weights, positions):
+        field = model._meta.get_field("positions")
+        through = field.remote_field.through
+        source, target = f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"
+        through.objects.bulk_create(
+            [through(**{source: obj.pk, target: position.pk})
+             for obj in objs for position in self.fan_out(positions, weights)],
+            batch_size=BATCH_SIZE,
+        )
+
+    def seed_positions(self, count):
+        return Position.objects.bulk_create([Position(name=f"Position {i}") for i in range(count)],
+                                            batch_size=BATCH_SIZE)
+
+    def seed_divisions(self, organization, count, roots, branching, positions):
+        """Дерево по уровням: каждый уровень в branching раз шире предыдущего, родители случайные"""
+        level = Division.objects.bulk_create(
+            [Division(name=f"Division {i}", organization=organization) for i in range(min(roots, count))])
+        created = list(level)
+        while len(created) < count:
+            size = min(count - len(created), max(1, round(len(level) * branching)))
+            level = Division.objects.bulk_create(
+                [Division(name=f"Division {len(created) + i}", organization=organization,
+                          parent=self.random.choice(level)) for i in range(size)],
+                batch_size=BATCH_SIZE)
+            created += level
+        Division.rebuild_paths(Division.objects.filter(organization=organization))
+        self.link(Division, created, (40, 30, 15, 10, 5), positions)
+
+    def seed_permissions(self, count, positions):
+        for chunk in batched(range(count)):
+            permissions = Permission.objects.bulk_create(
+                [Permission(name=f"permission.{i}", description=f"Grants access number {i}") for i in chunk])
+            self.link(Permission, permissions, (30, 25, 15, 10, 8, 5, 4, 3), positions)
+
+    def seed_employees(self, count, positions):
+        for chunk in batched(range(count)):
+            employees = Employee.objects.bulk_create(
+                [Employee(first_name=self.random.choice(FIRST_NAMES),
+                          last_name=f"{self.random.choice(LAST_NAMES)}-{i}") for i in chunk])
+            self.link(Employee, employees, (80, 15, 5), positions)
+            access.add_employees([employee.pk for employee in employees])
+            directory.refresh_positions([employee.pk for employee in employees])
@@ -0,0 +1,199 @@
+"""Метрики запросов: время, запросы к БД, сериализация и размер ответа по имени URL
+
+MetricsMiddleware считает их для каждого запроса, отдаёт в заголовке Server-Timing и копит гистограммы
+процесса, которые /metrics выдаёт в формате Prometheus (у каждого воркера gunicorn свои). Медленные
+запросы (SLOW_REQUEST_MS) пишутся в лог organization.metrics вместе со списком SQL.
+"""
+import logging
+import random
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+
+DEFAULTS = {
+    "ENABLED": True,
+    "SERVER_TIMING": True,
+    # Порог медленного запроса в мс, None — сэмплер выключен
+    "SLOW_REQUEST_MS": None,
+    # Доля медленных запросов, которые попадают в лог
+    "SLOW_SAMPLE_RATE": 1.0,
+    # Сколько SQL медленного запроса сохраняется (память на запрос при включённом сэмплере)
+    "MAX_LOGGED_QUERIES": 200,
+}
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+logger = logging.getLogger("organization.metrics")
+
+# Счётчики текущего запроса; контекст наследуют и потоки sync_to_async
+_current = ContextVar("request_metrics", default=None)
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, "ORGANIZATION_METRICS", {}))
+
+
+class RequestStats(object):
+    __slots__ = ("started", "queries", "db_time", "serialize_time", "serializing", "sql")
+
+    def __init__(self, keep_sql):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serializing = False
+        self.sql = [] if keep_sql else None
+
+
+class Histogram(object):
+    def __init__(self, name, description, buckets):
+        self.name, self.description, self.buckets = name, description, buckets
+        self.samples = {}  # метки → [счётчики корзин..., +Inf], сумма
+
+    def observe(self, labels, value):
+        counts, total = self.samples.get(labels) or ([0] * (len(self.buckets) + 1), 0)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.samples[labels] = (counts, total + value)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in sorted(self.samples.items()):
+            prefix = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix},le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{{{prefix}}} {total}"
+            yield f"{self.name}_count{{{prefix}}} {cumulative}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_lock = threading.Lock()
+DURATION = Histogram("organization_request_duration_seconds", "Request wall time.", SECONDS)
+DB_TIME = Histogram("organization_request_db_seconds", "Time spent in database queries.", SECONDS)
+DB_QUERIES = Histogram("organization_request_db_queries", "Database queries per request.", QUERIES)
+SERIALIZE_TIME = Histogram("organization_request_serialize_seconds",
+                           "Time spent in schema dump/load, excluding queries.", SECONDS)
+RESPONSE_SIZE = Histogram("organization_response_size_bytes", "Response body size.", BYTES)
+HISTOGRAMS = (DURATION, DB_TIME, DB_QUERIES, SERIALIZE_TIME, RESPONSE_SIZE)
+
+
+def reset():
+    """Сброс накопленных гистограмм (тесты)"""
+    with _lock:
+        for histogram in HISTOGRAMS:
+            histogram.samples.clear()
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Обёртка connection.execute_wrapper: время и число запросов текущего HTTP-запроса"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = perf_counter() - start
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.sql is not None and len(stats.sql) < get_config()["MAX_LOGGED_QUERIES"]:
+            stats.sql.append((elapsed, sql))
+
+
+def install(sender, connection, **kwargs):
+    """Сигнал connection_created: обёртка ставится на каждое соединение один раз"""
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+@contextmanager
+def serialization():
+    """Учёт времени сериализации; вложенные вызовы (Nested) и запросы к БД внутри не считаются дважды"""
+    stats = _current.get()
+    if stats is None or stats.serializing:
+        yield
+        return
+    stats.serializing = True
+    start, db_time = perf_counter(), stats.db_time
+    try:
+        yield
+    finally:
+        stats.serializing = False
+        stats.serialize_time += perf_counter() - start - (stats.db_time - db_time)
+
+
+def _finish(request, response, stats, config):
+    elapsed = perf_counter() - stats.started
+    match = request.resolver_match
+    labels = (("view", match.view_name if match else "unmatched"), ("method", request.method))
+    with _lock:
+        DURATION.observe(labels, elapsed)
+        DB_TIME.observe(labels, stats.db_time)
+        DB_QUERIES.observe(labels, stats.queries)
+        SERIALIZE_TIME.observe(labels, stats.serialize_time)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(labels, len(response.content))
+
+    if config["SERVER_TIMING"]:
+        response["Server-Timing"] = (
+            f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+            f"serialize;dur={stats.serialize_time * 1000:.2f}, total;dur={elapsed * 1000:.2f}"
+        )
+
+    if stats.sql is not None and elapsed * 1000 >= config["SLOW_REQUEST_MS"] \
+            and random.random() < config["SLOW_SAMPLE_RATE"]:
+        queries = "\n".join(f"  {duration * 1000:.2f} ms  {sql}" for duration, sql in stats.sql)
+        logger.warning("Slow request %s %s: %.1f ms, %d queries (%.1f ms)\n%s", request.method,
+                       request.get_full_path(), elapsed * 1000, stats.queries, stats.db_time * 1000, queries)
+    return response
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            config = get_config()
+            if not config["ENABLED"]:
+                return await get_response(request)
+            stats = RequestStats(config["SLOW_REQUEST_MS"] is not None)
+            token = _current.set(stats)
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            return _finish(request, response, stats, config)
+    else:
+        def middleware(request):
+            config = get_config()
+            if not config["ENABLED"]:
+                return get_response(request)
+            stats = RequestStats(config["SLOW_REQUEST_MS"] is not None)
+            token = _current.set(stats)
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            return _finish(request, response, stats, config)
+
+    return middleware
+
+
+def metrics_view(request):
+    """Гистограммы процесса в текстовом формате Prometheus"""
+    with _lock:
+        lines = [line for histogram in HISTOGRAMS for line in histogram.render()]
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Division = apps.get_model('organization', 'Division')
+    parents = dict(Division.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def resolve(pk):
+        chain = []
+        while pk is not None and pk not in paths and pk not in chain:
+            chain.append(pk)
+            pk = parents[pk]
+        path, depth = paths.get(pk, ('/', -1))
+        for pk in reversed(chain):
+            path, depth = f'{path}{pk}/', depth + 1
+            paths[pk] = (path, depth)
+
+    divisions = []
+    for pk in parents:
+        resolve(pk)
+        divisions.append(Division(pk=pk, path=paths[pk][0], depth=paths[pk][1]))
+    Division.objects.bulk_update(divisions, ['path', 'depth'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='division',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='division',
+            name='path',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AlterField(
+            model_name='employee',
+            name='positions',
+            field=models.ManyToManyField(blank=True, related_name='employees', to='organization.position'),
+        ),
+        migrations.AlterField(
+            model_name='permission',
+            name='positions',
+            field=models.ManyToManyField(blank=True, related_name='permissions', to='organization.position'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='division',
+            index=models.Index(fields=['path'], name='division_path_idx', opclasses=['text_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_effective_permissions(apps, schema_editor):
+    Employee = apps.get_model('organization', 'Employee')
+    EffectivePermission = apps.get_model('organization', 'EffectivePermission')
+    pairs = (Employee.positions.through.objects.filter(position__permissions__isnull=False)
+             .values_list('employee_id', 'position__permissions').distinct())
+    EffectivePermission.objects.bulk_create(
+        [EffectivePermission(employee_id=e, permission_id=p) for e, p in pairs.iterator(chunk_size=2000)],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0002_division_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePermission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_permissions', to='organization.employee')),
+                ('permission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_grants', to='organization.permission')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('employee', 'permission'), name='effective_permission_unique')],
+            },
+        ),
+        migrations.RunPython(fill_effective_permissions, migrations.RunPython.noop),
+    ]
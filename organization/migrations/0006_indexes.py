@@ -0,0 +1,69 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+# Индексы для поиска подстроки (LIKE/ILIKE '%abc%') — только PostgreSQL с расширением pg_trgm
+TRIGRAM_INDEXES = [
+    ('employee_last_name_trgm_idx', 'organization_employee', 'last_name'),
+    ('employee_first_name_trgm_idx', 'organization_employee', 'first_name'),
+    ('position_name_trgm_idx', 'organization_position', 'name'),
+    ('permission_name_trgm_idx', 'organization_permission', 'name'),
+]
+
+
+def trigram_available(schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if not trigram_available(schema_editor):
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0005_change_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='division',
+            index=models.Index(fields=['organization', 'parent'], name='division_org_parent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['last_name', 'first_name'], name='employee_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['last_name'], name='employee_last_name_like_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['first_name'], name='employee_first_name_like_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='permission',
+            index=models.Index(fields=['name'], name='permission_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(fields=['name'], name='position_name_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.3 on 2026-10-18 18:36
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# ?name__icontains= компилируется в UPPER(col::text) LIKE UPPER('%...%'): триграммные индексы из 0006
+# заменяются индексами по тому же выражению (только PostgreSQL с pg_trgm)
+TRIGRAM_INDEXES = [
+    ('employee_last_name_trgm_idx', 'organization_employee', 'last_name'),
+    ('employee_first_name_trgm_idx', 'organization_employee', 'first_name'),
+    ('position_name_trgm_idx', 'organization_position', 'name'),
+    ('permission_name_trgm_idx', 'organization_permission', 'name'),
+    ('division_name_trgm_idx', 'organization_division', 'name'),
+    ('organization_name_trgm_idx', 'organization_organization', 'name'),
+]
+
+
+def trigram_available(schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def upper_trigram_indexes(apps, schema_editor):
+    if not trigram_available(schema_editor):
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+        schema_editor.execute(f'CREATE INDEX {name} ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)')
+
+
+def plain_trigram_indexes(apps, schema_editor):
+    if not trigram_available(schema_editor):
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+        if table not in ('organization_division', 'organization_organization'):
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} USING gin ({column} gin_trgm_ops)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0006_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employee',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('first_name', 'last_name', config='simple'), name='employee_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='permission',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('name', 'description', config='simple'), name='permission_search_idx'),
+        ),
+        migrations.RunPython(upper_trigram_indexes, plain_trigram_indexes),
+    ]
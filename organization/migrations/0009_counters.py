@@ -0,0 +1,85 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    def table(name):
+        return schema_editor.quote_name(apps.get_model('organization', name)._meta.db_table)
+
+    def links(name):
+        return schema_editor.quote_name(apps.get_model('organization', name).positions.through._meta.db_table)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table('PositionCounters')} (position_id, employee_count, permission_count, division_count) "
+            f"SELECT p.id, (SELECT count(*) FROM {links('Employee')} l WHERE l.position_id = p.id), "
+            f"(SELECT count(*) FROM {links('Permission')} l WHERE l.position_id = p.id), "
+            f"(SELECT count(*) FROM {links('Division')} l WHERE l.position_id = p.id) FROM {table('Position')} p"
+        )
+        cursor.execute(
+            f"INSERT INTO {table('DivisionCounters')} (division_id, position_count, headcount) "
+            f"SELECT d.id, (SELECT count(*) FROM {links('Division')} dp WHERE dp.division_id = d.id), "
+            f"(SELECT count(DISTINCT ep.employee_id) FROM {links('Division')} dp JOIN {links('Employee')} ep "
+            f"ON ep.position_id = dp.position_id WHERE dp.division_id = d.id) FROM {table('Division')} d"
+        )
+        cursor.execute(
+            f"INSERT INTO {table('OrganizationMember')} (organization_id, employee_id) "
+            f"SELECT DISTINCT d.organization_id, ep.employee_id FROM {links('Employee')} ep "
+            f"JOIN {links('Division')} dp ON dp.position_id = ep.position_id "
+            f"JOIN {table('Division')} d ON d.id = dp.division_id"
+        )
+        cursor.execute(
+            f"INSERT INTO {table('OrganizationCounters')} (organization_id, division_count, headcount) "
+            f"SELECT o.id, (SELECT count(*) FROM {table('Division')} d WHERE d.organization_id = o.id), "
+            f"(SELECT count(*) FROM {table('OrganizationMember')} m WHERE m.organization_id = o.id) "
+            f"FROM {table('Organization')} o"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0008_purge_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DivisionCounters',
+            fields=[
+                ('division', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='organization.division')),
+                ('position_count', models.PositiveIntegerField(db_default=0, default=0)),
+                ('headcount', models.PositiveIntegerField(db_default=0, default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrganizationCounters',
+            fields=[
+                ('organization', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='organization.organization')),
+                ('division_count', models.PositiveIntegerField(db_default=0, default=0)),
+                ('headcount', models.PositiveIntegerField(db_default=0, default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PositionCounters',
+            fields=[
+                ('position', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='organization.position')),
+                ('employee_count', models.PositiveIntegerField(db_default=0, default=0)),
+                ('permission_count', models.PositiveIntegerField(db_default=0, default=0)),
+                ('division_count', models.PositiveIntegerField(db_default=0, default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrganizationMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='memberships', to='organization.employee')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='organization.organization')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('organization', 'employee'), name='organization_member_unique')],
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
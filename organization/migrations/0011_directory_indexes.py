@@ -0,0 +1,55 @@
+# Generated by Django 5.1.15 on 2026-10-18 22:22
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def fill_position_tokens(apps, schema_editor):
+    # Лексемы должностей, как их пишет directory.refresh_positions
+    Employee = apps.get_model('organization', 'Employee')
+    table = schema_editor.quote_name(Employee._meta.db_table)
+    links = schema_editor.quote_name(Employee.positions.through._meta.db_table)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} e SET position_tokens = array_to_tsvector(ARRAY("
+            f"SELECT '_p' || l.position_id FROM {links} l WHERE l.employee_id = e.id)) "
+            f"WHERE EXISTS (SELECT 1 FROM {links} l WHERE l.employee_id = e.id)"
+        )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organization', '0010_webhooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='position_tokens',
+            field=django.contrib.postgres.search.SearchVectorField(db_default=models.Value(''), editable=False),
+        ),
+        migrations.RunPython(fill_position_tokens, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='division',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('name', config='simple'), name='division_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(django.db.models.functions.comparison.Collate(django.db.models.functions.text.Lower(django.db.models.functions.text.Concat('first_name', models.Value(' '), 'last_name')), 'C'), name='employee_first_last_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(django.db.models.functions.comparison.Collate(django.db.models.functions.text.Lower(django.db.models.functions.text.Concat('last_name', models.Value(' '), 'first_name')), 'C'), name='employee_last_first_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=django.contrib.postgres.indexes.GinIndex(models.Func(django.contrib.postgres.search.SearchVector('first_name', 'last_name', config='simple'), models.F('position_tokens'), arg_joiner=' || ', output_field=django.contrib.postgres.search.SearchVectorField(), template='(%(expressions)s)'), name='employee_directory_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='position',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('name', config='simple'), name='position_search_idx'),
+        ),
+    ]
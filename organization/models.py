@@ -1,9 +1,38 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
+from django.db.models import F, Func, Value
+from django.db.models.functions import Collate, Concat, Lower, Substr
 from marshmallow import ValidationError
 
+# Конфигурация полнотекстового поиска: без стемминга, имена и названия на разных языках
+SEARCH_CONFIG = 'simple'
+
+
+def name_key(first, second):
+    """ФИО для поиска по началу строки (directory.py): нижний регистр, побайтовое сравнение — индекс по выражению
+    годится и для LIKE 'abc%', и для сортировки"""
+    return Collate(Lower(Concat(first, Value(' '), second)), 'C')
+
+
+def directory_document():
+    """Слова имени и фамилии вместе с лексемами должностей (Employee.position_tokens): одно обращение к GIN-индексу
+    проверяет все слова подсказки (directory.py)"""
+    return Func(SearchVector('first_name', 'last_name', config=SEARCH_CONFIG), F('position_tokens'),
+                template='(%(expressions)s)', arg_joiner=' || ', output_field=SearchVectorField())
+
+
+class VersionedModel(models.Model):
+    """Версия строки и время изменения для ETag/Last-Modified, см. tracking.py"""
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveBigIntegerField(default=1)
+
+    class Meta:
+        abstract = True
+
 
 # Create your models here.
-class Organization(models.Model):
+class Organization(VersionedModel):
     """Модель организаии"""
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField(null=True, blank=True)
@@ -12,15 +41,22 @@ class Organization(models.Model):
         return self.name
 
 
-class Position(models.Model):
+class Position(VersionedModel):
     """Модель должности"""
     name = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='position_name_idx', opclasses=['varchar_pattern_ops']),
+            # Слова названия для поиска сотрудников по должности (directory.py)
+            GinIndex(SearchVector('name', config=SEARCH_CONFIG), name='position_search_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
-class Division(models.Model):
+class Division(VersionedModel):
     """Модель подразделения"""
     name = models.CharField(max_length=255)
     parent = models.ForeignKey(
@@ -43,6 +79,107 @@ class Division(models.Model):
         blank=True
     )
 
+    # Материализованный путь от корня: "/1/5/23/", depth — число предков
+    path = models.TextField(default='', editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], name='division_path_idx', opclasses=['text_pattern_ops']),
+            # Дочерние подразделения внутри организации: organization_id = ? AND parent_id = ? (или IS NULL)
+            models.Index(fields=['organization', 'parent'], name='division_org_parent_idx'),
+            # Пачки фонового удаления от листьев к корню: organization_id = ? ORDER BY depth DESC, id (purge.py)
+            models.Index(fields=['organization', '-depth', 'id'], name='division_org_depth_idx'),
+            # Слова названия для поиска сотрудников по подразделению (directory.py)
+            GinIndex(SearchVector('name', config=SEARCH_CONFIG), name='division_search_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Организация на момент загрузки: при её смене пересчитываются счётчики обеих (counters.py)
+        instance._loaded_organization_id = instance.__dict__.get('organization_id')
+        return instance
+
+    def ancestor_ids(self):
+        """id предков от корня к непосредственному родителю"""
+        return [int(pk) for pk in self.path.strip('/').split('/')[:-1]]
+
+    def descendants(self):
+        """Все подразделения поддерева (без самого подразделения), один запрос по индексу пути"""
+        return Division.objects.filter(path__startswith=self.path).exclude(pk=self.pk)
+
+    def update_path(self):
+        """Пересчёт пути после сохранения; при смене родителя переносит всё поддерево"""
+        old_path, old_depth = self.path, self.depth
+        if self.parent_id:
+            parent = Division.objects.only('path', 'depth').get(pk=self.parent_id)
+            if old_path and parent.path.startswith(old_path):
+                raise ValidationError({"parent_id": "Division cannot be moved under itself."})
+            self.path, self.depth = f'{parent.path}{self.pk}/', parent.depth + 1
+        else:
+            self.path, self.depth = f'/{self.pk}/', 0
+
+        if (self.path, self.depth) == (old_path, old_depth):
+            return
+        Division.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+        if old_path:
+            Division.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (self.depth - old_depth),
+            )
+
+    @classmethod
+    def rebuild_paths(cls, queryset=None):
+        """Полный пересчёт путей выборки (после массовой загрузки или для сверки)
+
+        Цепочка parent, замкнутая в цикл, — ValidationError: путь для таких подразделений не определён.
+        """
+        queryset = cls.objects.all() if queryset is None else queryset
+        divisions = {division.pk: division for division in queryset.only('parent_id', 'path', 'depth')}
+        # Пути родителей вне выборки берутся как есть, одним запросом
+        parents = {division.parent_id for division in divisions.values()} - set(divisions) - {None}
+        paths = {pk: (path, depth) for pk, path, depth in
+                 cls.objects.filter(pk__in=parents).values_list('pk', 'path', 'depth')} if parents else {}
+
+        def resolve(pk):
+            chain = []
+            # Поднимаемся до корня или до уже посчитанного предка
+            while pk is not None and pk not in paths:
+                if pk in chain:
+                    raise ValidationError({"parent_id": "Division cannot be moved under itself."})
+                chain.append(pk)
+                division = divisions.get(pk)
+                if division is None:
+                    outside = cls.objects.only('path', 'depth').get(pk=chain.pop())
+                    paths[pk] = (outside.path, outside.depth)
+                    break
+                pk = division.parent_id
+            path, depth = paths.get(pk, ('/', -1))
+            for pk in reversed(chain):
+                path, depth = f'{path}{pk}/', depth + 1
+                paths[pk] = (path, depth)
+
+        changed = []
+        for division in divisions.values():
+            resolve(division.pk)
+            path, depth = paths[division.pk]
+            if (division.path, division.depth) != (path, depth):
+                division.path, division.depth = path, depth
+                changed.append(division)
+        cls.objects.bulk_update(changed, ['path', 'depth'], batch_size=2000)
+        return len(changed)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # Дочерние подразделения становятся корневыми (SET_NULL), их поддеревья переносятся в корень
+            if self.path:
+                self.descendants().update(
+                    path=Concat(Value('/'), Substr('path', len(self.path) + 1)),
+                    depth=F('depth') - (self.depth + 1),
+                )
+            return super().delete(*args, **kwargs)
+
     def clean(self):
         # Проверка на самоссылку
         if self.parent and self.parent.id == self.id:
@@ -52,7 +189,7 @@ class Division(models.Model):
     def __str__(self):
         return self.name
 
-class Employee(models.Model):
+class Employee(VersionedModel):
     """Модель сотрудника"""
     first_name = models.CharField(max_length=255)
     last_name = models.CharField(max_length=255)
@@ -61,11 +198,28 @@ class Employee(models.Model):
         related_name='employees',
         blank=True
     )
+    # Лексемы текущих должностей; пишет только directory.refresh_positions при каждом изменении связей
+    position_tokens = SearchVectorField(db_default=Value(''), editable=False)
+
+    class Meta:
+        indexes = [
+            # Равенство и сортировка по ФИО
+            models.Index(fields=['last_name', 'first_name'], name='employee_name_idx'),
+            # Поиск по началу строки (LIKE 'abc%') не зависит от правил сортировки базы
+            models.Index(fields=['last_name'], name='employee_last_name_like_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['first_name'], name='employee_first_name_like_idx', opclasses=['varchar_pattern_ops']),
+            # Полнотекстовый ?search= (filters.SEARCH строит то же выражение)
+            GinIndex(SearchVector('first_name', 'last_name', config=SEARCH_CONFIG), name='employee_search_idx'),
+            # Подсказки /api/employees/search/: «имя фамилия» и «фамилия имя» с начала строки
+            models.Index(name_key('first_name', 'last_name'), name='employee_first_last_idx'),
+            models.Index(name_key('last_name', 'first_name'), name='employee_last_first_idx'),
+            GinIndex(directory_document(), name='employee_directory_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
-class Permission(models.Model):
+class Permission(VersionedModel):
     """Модель прав"""
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
@@ -75,5 +229,127 @@ class Permission(models.Model):
         blank=True
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='permission_name_idx', opclasses=['varchar_pattern_ops']),
+            GinIndex(SearchVector('name', 'description', config=SEARCH_CONFIG), name='permission_search_idx'),
+        ]
+
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+class EffectivePermission(models.Model):
+    """Денормализованный индекс сотрудник → право (через должности), см. access.py"""
+    employee = models.ForeignKey(
+        Employee,
+        on_delete=models.CASCADE,
+        related_name='effective_permissions'
+    )
+    permission = models.ForeignKey(
+        Permission,
+        on_delete=models.CASCADE,
+        related_name='effective_grants'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['employee', 'permission'], name='effective_permission_unique'),
+        ]
+
+
+class Change(models.Model):
+    """Журнал изменений для инкрементальной синхронизации (/api/changes/), только добавление"""
+    CREATED, UPDATED, DELETED = 'created', 'updated', 'deleted'
+
+    seq = models.BigAutoField(primary_key=True)
+    resource = models.CharField(max_length=32)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=16)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ListVersion(models.Model):
+    """Версия списков ресурса (ETag списков, conditional.py): повышается каждой записью, затронувшей ресурс"""
+    resource = models.CharField(max_length=32, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+
+class OrganizationCounters(models.Model):
+    """Счётчики организации для дашбордов, см. counters.py"""
+    organization = models.OneToOneField(Organization, primary_key=True, on_delete=models.CASCADE,
+                                        related_name='counters')
+    division_count = models.PositiveIntegerField(default=0, db_default=0)
+    # Различные сотрудники с должностями подразделений организации (строки OrganizationMember)
+    headcount = models.PositiveIntegerField(default=0, db_default=0)
+
+
+class DivisionCounters(models.Model):
+    division = models.OneToOneField(Division, primary_key=True, on_delete=models.CASCADE, related_name='counters')
+    position_count = models.PositiveIntegerField(default=0, db_default=0)
+    # Различные сотрудники с должностями подразделения
+    headcount = models.PositiveIntegerField(default=0, db_default=0)
+
+
+class PositionCounters(models.Model):
+    position = models.OneToOneField(Position, primary_key=True, on_delete=models.CASCADE, related_name='counters')
+    employee_count = models.PositiveIntegerField(default=0, db_default=0)
+    permission_count = models.PositiveIntegerField(default=0, db_default=0)
+    division_count = models.PositiveIntegerField(default=0, db_default=0)
+
+
+class OrganizationMember(models.Model):
+    """Сотрудник, у которого есть должность в каком-либо подразделении организации (для численности)"""
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='members')
+    # Строки удалённого сотрудника удаляет пересчёт счётчиков (с уменьшением численности), а не collector
+    employee = models.ForeignKey(Employee, on_delete=models.DO_NOTHING, related_name='memberships')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'employee'], name='organization_member_unique'),
+        ]
+
+
+class PurgeJob(models.Model):
+    """Фоновое удаление организации или поддерева подразделений, см. purge.py"""
+    ORGANIZATION, DIVISION = 'organization', 'division'
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+    ACTIVE = (PENDING, RUNNING)
+
+    kind = models.CharField(max_length=16)
+    target_id = models.BigIntegerField()
+    status = models.CharField(max_length=16, default=PENDING)
+    # Подразделений к удалению на момент постановки и уже удалено
+    total = models.PositiveBigIntegerField(default=0)
+    deleted = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Обновляется после каждой пачки: по нему находятся брошенные задания
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Не больше одного незавершённого задания на объект
+            models.UniqueConstraint(fields=['kind', 'target_id'], condition=models.Q(status__in=('pending', 'running')),
+                                    name='purge_job_active_unique'),
+        ]
+
+
+class WebhookSubscription(models.Model):
+    """Подписка на журнал изменений: события доставляются POST-запросами пачками, см. webhooks.py"""
+    url = models.URLField(max_length=2000)
+    # Ресурсы из tracking.RESOURCES, пустой список — все
+    resources = models.JSONField(default=list, blank=True)
+    # Ключ подписи тела (HMAC-SHA256 в заголовке X-Webhook-Signature), пустой — без подписи
+    secret = models.CharField(max_length=255, blank=True, default='')
+    active = models.BooleanField(default=True)
+    # seq последнего доставленного (или пропущенного как неподходящего) события
+    cursor = models.BigIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    # Доставку ведёт воркер, захвативший подписку до этого момента
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
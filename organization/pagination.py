@@ -0,0 +1,125 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from marshmallow import ValidationError
+
+from .batch import parse_ids, resolve
+from .serializers import dump_rows, dumps, iter_dumped, json_response
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+STREAM_CHUNK_SIZE = 2000
+
+
+def encode_cursor(last_id, ordering=(), key=()):
+    """Непрозрачный курсор на следующую страницу: id последней записи и, при сортировке, её значения полей"""
+    payload = {"id": last_id}
+    if ordering:
+        payload.update(order=list(ordering), key=list(key))
+    raw = json.dumps(payload).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, ordering=()):
+    """Разбор курсора: (id последней выданной записи, значения полей сортировки) или None"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        last_id, key = payload["id"], payload.get("key", [])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValidationError({"after": "Invalid cursor."})
+    if not isinstance(last_id, int):
+        raise ValidationError({"after": "Invalid cursor."})
+    if payload.get("order", []) != list(ordering) or len(key) != len(ordering):
+        raise ValidationError({"after": "Cursor does not match ordering."})
+    return last_id, key
+
+
+def ordered(queryset, ordering=(), after=None):
+    """Выборка в порядке ordering (id — последним ключом, в направлении последнего поля), после курсора after"""
+    fields = [(name.lstrip("-"), name.startswith("-")) for name in ordering]
+    fields.append(("id", fields[-1][1] if fields else False))
+    queryset = queryset.order_by(*(f"-{name}" if descending else name for name, descending in fields))
+    if after is None:
+        return queryset
+    last_id, key = after
+    values = [*key, last_id]
+    # (a, b, id) > (x, y, z) для любых направлений: a > x ИЛИ (a = x И b > y) ИЛИ ...
+    condition = Q()
+    for i, (name, descending) in enumerate(fields):
+        equal = {prefix: value for (prefix, _), value in zip(fields[:i], values)}
+        condition |= Q(**equal, **{f"{name}__{'lt' if descending else 'gt'}": values[i]})
+    return queryset.filter(condition)
+
+
+def next_cursor(queryset, ordering, last_id):
+    key = ()
+    if ordering:
+        names = [name.lstrip("-") for name in ordering]
+        key = queryset.model._default_manager.filter(pk=last_id).values_list(*names).get()
+    return encode_cursor(last_id, ordering, key)
+
+
+def parse_limit(limit):
+    if limit is None or limit == "":
+        return DEFAULT_LIMIT
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValidationError({"limit": "Limit must be an integer."})
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValidationError({"limit": f"Limit must be between 1 and {MAX_LIMIT}."})
+    return limit
+
+
+def stream_queryset(queryset, schema, ndjson=False, chunk_size=STREAM_CHUNK_SIZE):
+    """Генератор JSON-массива (или NDJSON), сериализующий выборку по частям"""
+    if not ndjson:
+        yield b"["
+    first = True
+    for rows in iter_dumped(queryset, schema, chunk_size):
+        if ndjson:
+            yield b"".join(dumps(row) + b"\n" for row in rows)
+        else:
+            yield (b"" if first else b",") + b",".join(dumps(row) for row in rows)
+        first = False
+    if not ndjson:
+        yield b"]"
+
+
+def paginate(request, queryset, schema, ordering=()):
+    """Ответ списка: keyset-пагинация в порядке ordering и id (?after=&limit=) или поток (?stream=1|ndjson)
+
+    ?ids=1,2,3 — вместо страницы объекты с этими id по ключу id, ненайденные — 404 (см. batch.py).
+    """
+    if "ids" in request.GET:
+        try:
+            ids = parse_ids(request.GET["ids"])
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        return json_response({"results": resolve(queryset, schema, ids)})
+
+    try:
+        after = decode_cursor(request.GET.get("after"), ordering)
+        limit = parse_limit(request.GET.get("limit"))
+    except ValidationError as e:
+        return JsonResponse(e.messages, status=400)
+
+    queryset = ordered(queryset, ordering, after)
+
+    stream = request.GET.get("stream")
+    if stream and stream != "0":
+        ndjson = stream == "ndjson"
+        return StreamingHttpResponse(
+            stream_queryset(queryset, schema, ndjson=ndjson),
+            content_type="application/x-ndjson" if ndjson else "application/json",
+        )
+
+    page = dump_rows(queryset[:limit + 1], schema)
+    cursor = next_cursor(queryset, ordering, page[limit - 1][0]) if len(page) > limit else None
+    return json_response({"results": [data for _, data in page[:limit]], "next": cursor})
@@ -0,0 +1,175 @@
+"""Фоновое удаление организаций и поддеревьев подразделений
+
+Collector Django при удалении организации загружает в память все её подразделения и держит блокировки
+до конца одной большой транзакции. Здесь подразделения удаляются пачками по ключу (depth DESC, id), от
+листьев к корню, каждая пачка — короткая транзакция из нескольких запросов на множество строк: связи
+с должностями, перенос дочерних подразделений других организаций в корень (SET_NULL) и сами строки.
+Организация удаляется последней, когда подразделений уже нет.
+
+Задание (PurgeJob) создаётся в транзакции запроса, а выполняется после коммита в фоновом потоке процесса
+или командой run_purge_jobs. Прерванное задание безопасно выполнить заново: удалённые строки уже не выбираются.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import cache, counters, tracking
+from .models import Organization, Division, DivisionCounters, OrganizationMember, Change, PurgeJob
+
+DEFAULTS = {
+    "BATCH_SIZE": 1000,
+    # Запуск задания в потоке процесса после коммита; False — задания выполняет только manage.py run_purge_jobs
+    "THREAD": True,
+    # Задание в статусе running, не обновлявшееся столько секунд, считается брошенным и берётся заново
+    "STALE_AFTER": 300,
+}
+
+logger = logging.getLogger("organization.purge")
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, "ORGANIZATION_PURGE", {}))
+
+
+def _scope(kind, target_id):
+    """Подразделения к удалению или None, если удалять уже нечего (корня поддерева нет)"""
+    if kind == PurgeJob.ORGANIZATION:
+        return Division.objects.filter(organization_id=target_id)
+    root = Division.objects.filter(pk=target_id).values_list("path", flat=True).first()
+    if root is None:
+        return None
+    if not root:
+        # Путь не посчитан (строка создана в обход схемы): пустой префикс совпал бы со всеми подразделениями
+        return Division.objects.filter(pk=target_id)
+    return Division.objects.filter(path__startswith=root)
+
+
+def schedule(kind, target_id):
+    """Задание на удаление объекта (или уже поставленное); вызывается в транзакции запроса"""
+    job = PurgeJob.objects.filter(kind=kind, target_id=target_id, status__in=PurgeJob.ACTIVE).first()
+    if job is not None:
+        return job
+    scope = _scope(kind, target_id)
+    job = PurgeJob.objects.create(kind=kind, target_id=target_id, total=scope.count() if scope is not None else 0)
+    if get_config()["THREAD"]:
+        transaction.on_commit(lambda: start(job.pk))
+    return job
+
+
+def start(job_id):
+    threading.Thread(target=_run_in_thread, args=(job_id,), name=f"purge-{job_id}", daemon=True).start()
+
+
+def _run_in_thread(job_id):
+    try:
+        run(job_id)
+    finally:
+        # Соединения потока больше не понадобятся
+        connections.close_all()
+
+
+def _delete_divisions(ids, members=True):
+    """Одна пачка: связи, SET_NULL для подразделений вне пачки, журнал изменений и сами строки
+
+    members=False — не пересчитывать членство и численность организаций (удаляется вся организация).
+    """
+    links = Division.positions.through.objects.filter(division_id__in=ids)
+    position_ids = list(links.values_list("position_id", flat=True).distinct())
+    organization_ids = list(Division.objects.filter(pk__in=ids).values_list("organization_id", flat=True).distinct())
+    links.delete()
+    DivisionCounters.objects.filter(division_id__in=ids).delete()
+    # Потомки из удаляемого набора либо в этой пачке, либо удалены предыдущими (они глубже); остальные —
+    # подразделения других организаций, они становятся корневыми вместе со своими поддеревьями
+    for child in Division.objects.filter(parent_id__in=ids).exclude(pk__in=ids):
+        child.parent = None
+        child.save(update_fields=["parent", "updated_at"])
+        child.update_path()
+        tracking.changed("divisions", [child.pk])
+    tracking.log("divisions", ids, Change.DELETED)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {connection.ops.quote_name(Division._meta.db_table)} WHERE id = ANY(%s)", [ids])
+    cache.invalidate("divisions", ids)
+    tracking.lists_changed(["divisions"])
+    if members:
+        counters.touch(positions=position_ids, placed=position_ids, organizations=organization_ids)
+    else:
+        counters.touch(positions=position_ids)
+
+
+def batches(job, batch_size=None):
+    """Удаляет подразделения задания пачками, каждая в своей транзакции; отдаёт размер каждой пачки"""
+    batch_size = batch_size or get_config()["BATCH_SIZE"]
+    scope = _scope(job.kind, job.target_id)
+    if scope is None:
+        return
+    last = None
+    while True:
+        with transaction.atomic(), tracking.collect(), counters.collect():
+            page = scope.order_by("-depth", "id")
+            if last is not None:
+                depth, pk = last
+                page = page.filter(Q(depth__lt=depth) | Q(depth=depth, id__gt=pk))
+            rows = list(page.values_list("depth", "id")[:batch_size])
+            if not rows:
+                return
+            _delete_divisions([pk for _, pk in rows], members=job.kind != PurgeJob.ORGANIZATION)
+            job.deleted += len(rows)
+            PurgeJob.objects.filter(pk=job.pk).update(deleted=job.deleted, updated_at=timezone.now())
+        last = rows[-1]
+        yield len(rows)
+
+
+def _delete_members(organization_id, batch_size=None):
+    """Строки членства организации пачками (при удалении организации одной транзакцией их были бы миллионы)"""
+    batch_size = batch_size or get_config()["BATCH_SIZE"]
+    members = OrganizationMember.objects.filter(organization_id=organization_id)
+    while True:
+        with transaction.atomic():
+            ids = list(members.values_list("id", flat=True)[:batch_size])
+            if not ids:
+                return
+            OrganizationMember.objects.filter(pk__in=ids).delete()
+
+
+def claim(job_id):
+    """Перевод задания в running; False, если его уже выполняет другой поток или процесс"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=get_config()["STALE_AFTER"])
+    available = Q(status=PurgeJob.PENDING) | Q(status=PurgeJob.RUNNING, updated_at__lt=stale)
+    return PurgeJob.objects.filter(available, pk=job_id).update(
+        status=PurgeJob.RUNNING, started_at=now, updated_at=now) == 1
+
+
+def run(job_id):
+    """Выполнение задания целиком; False, если оно уже выполняется или завершено"""
+    if not claim(job_id):
+        return False
+    job = PurgeJob.objects.get(pk=job_id)
+    try:
+        for _ in batches(job):
+            pass
+        if job.kind == PurgeJob.ORGANIZATION:
+            _delete_members(job.target_id)
+            with transaction.atomic(), tracking.collect():
+                tracking.changed("organizations", [job.target_id], Change.DELETED)
+                # Подразделений уже нет (кроме созданных во время удаления), collector удаляет одну строку
+                Organization.objects.filter(pk=job.target_id).delete()
+        job.status = PurgeJob.DONE
+    except Exception as e:
+        logger.exception("Purge job %s failed", job_id)
+        job.status, job.error = PurgeJob.FAILED, str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at", "updated_at"])
+    return True
+
+
+def pending():
+    """id заданий, которые можно взять: ожидающие и брошенные"""
+    stale = timezone.now() - timedelta(seconds=get_config()["STALE_AFTER"])
+    return list(PurgeJob.objects.filter(Q(status=PurgeJob.PENDING) | Q(status=PurgeJob.RUNNING, updated_at__lt=stale))
+                .order_by("id").values_list("id", flat=True))
@@ -1,9 +1,255 @@
-from marshmallow import Schema, ValidationError, fields, validate, validates
+import threading
+from operator import attrgetter
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.utils import timezone
+from marshmallow import Schema, ValidationError, fields, validate
 from marshmallow.decorators import post_load
 
-from .models import Organization, Division, Position, Employee, Permission
+from . import feed, metrics, tracking
+from .bulk import check_references
+from .writes import ObjectDeleted, PreconditionFailed
+from .models import Organization, Division, Position, Employee, Permission, Change, PurgeJob, \
+    WebhookSubscription
+
+# Глубина, до которой вложенные схемы (в т.ч. цепочка parent) подгружаются заранее
+RELATED_DEPTH = 5
+
+
+def related_lookups(schema, depth=RELATED_DEPTH):
+    """Пути select_related/prefetch_related, выведенные из вложенных полей схемы
+
+    Nested-поля дают select_related, RelatedList (M2M) и всё, что под ним, —
+    prefetch_related. Рекурсивные вложения (Nested('self')) разворачиваются
+    не глубже depth уровней.
+    """
+    select, prefetch = [], []
+
+    def walk(schema, prefix, level, prefetched):
+        for name, field in schema.dump_fields.items():
+            if not isinstance(field, fields.Nested):
+                continue
+            nested = field.schema
+            recursive = isinstance(nested, type(schema))
+            if recursive and level >= depth:
+                continue
+            path = prefix + (field.attribute or name)
+            many = prefetched or field.many
+            (prefetch if many else select).append(path)
+            walk(nested, path + "__", level + 1 if recursive else level, many)
+
+    walk(schema, "", 0, False)
+    return select, prefetch
+
+
+def column_lookups(schema, depth=RELATED_DEPTH):
+    """Столбцы для .only(): поля модели, которые выводит schema, с учётом вложенных схем
+
+    Вместе с вложенным полем берётся его внешний ключ, первичные ключи — всегда
+    (по ним работают пагинация и prefetch_related). Поля схемы без столбца
+    в модели (M2M, fields.Method и т.п.) пропускаются.
+    """
+    columns = []
+
+    def walk(schema, prefix, level):
+        model = schema.Meta.model
+        columns.append(prefix + model._meta.pk.name)
+        for name, field in schema.dump_fields.items():
+            attribute = field.attribute or name
+            try:
+                model_field = model._meta.get_field(attribute)
+            except FieldDoesNotExist:
+                continue
+            if not model_field.concrete or model_field.many_to_many:
+                continue
+            columns.append(prefix + model_field.name)
+            if isinstance(field, fields.Nested):
+                recursive = isinstance(field.schema, type(schema))
+                if not (recursive and level >= depth):
+                    walk(field.schema, prefix + model_field.name + "__", level + 1 if recursive else level)
+
+    walk(schema, "", 0)
+    return columns
+
+
+def with_related(queryset, schema, depth=RELATED_DEPTH):
+    """QuerySet, отдающий для schema.dump все нужные данные (и только их) за фиксированное число запросов"""
+    select, prefetch = related_lookups(schema, depth)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if hasattr(schema.Meta, "model"):
+        queryset = queryset.only(*column_lookups(schema, depth))
+    return queryset
+
+
+def reload_related(instance, schema):
+    """Только что записанный объект, перечитанный через with_related — для ответа на создание
+
+    У объекта из load() связи не загружены, и dump читал бы их по одной. Если schema не выводит
+    вложенных объектов, перечитывать нечего и instance возвращается как есть.
+    """
+    if not any(related_lookups(schema)):
+        return instance
+    return with_related(type(instance).objects.all(), schema).get(pk=instance.pk)
+
+
+def _names(value):
+    return list(dict.fromkeys(name.strip() for name in (value or "").split(",") if name.strip()))
+
+
+def _unknown_fields(schema, names):
+    unknown = []
+    for name in names:
+        current = schema
+        for part in name.split("."):
+            field = current.dump_fields.get(part) if current is not None else None
+            if field is None:
+                unknown.append(name)
+                break
+            current = field.schema if isinstance(field, fields.Nested) else None
+    return unknown
+
+
+def requested_schema(schema_class, params, **kwargs):
+    """Схема под форму ответа, запрошенную в строке запроса
+
+    ?fields=id,name,organization.name — выводимые поля (вложенные через точку);
+    ?expand=organization,parent — вложенные объекты целиком в дополнение к fields;
+    ?depth=N — глубина цепочки parent (0..RELATED_DEPTH). Без параметров — полная схема.
+    """
+    schema = schema_class(**kwargs)
+    only, expand = _names(params.get("fields")), _names(params.get("expand"))
+    errors = {}
+    nested = [name for name, field in schema.dump_fields.items() if isinstance(field, fields.Nested)]
+    if unknown := _unknown_fields(schema, only):
+        errors["fields"] = [f"Unknown field: {name}." for name in unknown]
+    if unknown := [name for name in expand if name not in nested]:
+        errors["expand"] = [f"Unknown relation: {name}." for name in unknown]
+
+    depth = params.get("depth")
+    if depth not in (None, ""):
+        try:
+            depth = int(depth)
+        except ValueError:
+            depth = -1
+        if not 0 <= depth <= RELATED_DEPTH:
+            errors["depth"] = [f"Depth must be between 0 and {RELATED_DEPTH}."]
+    if errors:
+        raise ValidationError(errors)
+
+    if only:
+        kwargs["only"] = list(dict.fromkeys(only + expand))
+    if isinstance(depth, int):
+        shown = {name.split(".")[0] for name in kwargs.get("only", schema.dump_fields)}
+        recursive = [name for name in nested if schema.dump_fields[name].nested == "self" and name in shown]
+        kwargs["exclude"] = tuple(kwargs.get("exclude", ())) + tuple(".".join([name] * (depth + 1))
+                                                                      for name in recursive)
+    return schema_class(**kwargs) if "only" in kwargs or "exclude" in kwargs else schema
+
+
+def check_single(data):
+    """Ссылки одного объекта (organization, parent, positions) — одним запросом, как при массовой загрузке"""
+    errors = {}
+    check_references({0: data}, errors)
+    if errors:
+        raise ValidationError(errors[0])
+
+
+def save(model, pk, data, context):
+    """(объект, создан ли) по контексту схемы
+
+    create — только вставка (POST), занятые id или уникальные поля дают IntegrityError. condition — lookups
+    условия записи (If-Match, If-Unmodified-Since, см. conditional.py): оно проверяется в самом UPDATE, который
+    пишет переданные поля и повышает версию. Параллельная запись той же версии ждёт блокировку строки, а после её
+    коммита не находит строку и получает 412 вместо потерянного обновления, а если строку удалили —
+    ObjectDeleted (404). Объект ответа и сигналов — загруженный view (instance из контекста) с записанными полями.
+    """
+    if pk is None or context.get("create"):
+        return model.objects.create(id=pk, **data), True
+    condition = context.get("condition")
+    if condition is None:
+        return model.objects.update_or_create(id=pk, defaults=data)
+
+    instance = context.get("instance") or model.objects.get(pk=pk)
+    now = timezone.now()
+    if not model.objects.filter(pk=pk, **condition).update(version=F("version") + 1, updated_at=now, **data):
+        if model.objects.filter(pk=pk).exists():
+            raise PreconditionFailed
+        raise ObjectDeleted
+    # Версия уже повышена: tracking.changed в этой транзакции её не трогает, и она известна conditional_write
+    tracking.written(tracking.resource_name(model), [pk])
+    for name, value in dict(data, updated_at=now).items():
+        setattr(instance, name, value)
+    # update() не шлёт сигналов, а по post_save пересчитываются счётчики (signals.py)
+    post_save.send(sender=model, instance=instance, created=False, update_fields=frozenset(data), raw=False,
+                   using=instance._state.db)
+    return instance, False
+
+
+def set_positions(instance, positions_ids, created, context):
+    """Должности объекта: PATCH без positions_ids их не трогает, PUT без них — очищает"""
+    if created:
+        instance.positions.add(*(positions_ids or []))
+    elif positions_ids is not None or not context.get("patch"):
+        instance.positions.set(positions_ids or [])
+
+
+class TimedSchema(Schema):
+    """Время dump/load попадает в метрики запроса (metrics.py)"""
+
+    def dump(self, obj, *, many=None):
+        with metrics.serialization():
+            return super().dump(obj, many=many)
+
+    def load(self, data, *, many=None, partial=None, unknown=None):
+        with metrics.serialization():
+            return super().load(data, many=many, partial=partial, unknown=unknown)
+
+
+class RelatedList(fields.Nested):
+    """Объекты M2M-связи по возрастанию id: obj.<attribute>.all(), подгруженные prefetch_related
+
+    Порядок задаётся здесь, а не order_by: иначе подгруженные объекты читались бы заново; тот же порядок
+    у serializers.Plan.fetch_related.
+    """
+
+    def __init__(self, nested, **kwargs):
+        super().__init__(nested, many=True, dump_only=True, **kwargs)
+
+    def _serialize(self, nested_obj, attr, obj, **kwargs):
+        if nested_obj is not None:
+            nested_obj = sorted(nested_obj.all(), key=attrgetter("pk"))
+        return super()._serialize(nested_obj, attr, obj, **kwargs)
+
+
+class CycleSafeNested(fields.Nested):
+    """Ссылка на объект того же вида (parent): объект, который уже выводится выше по цепочке, — None
+
+    Замкнутая в цикл цепочка parent иначе выводилась бы бесконечно; обрыв тот же, что у serializers.Loader.dump.
+    """
+    _local = threading.local()
+
+    def _serialize(self, nested_obj, attr, obj, **kwargs):
+        if nested_obj is None:
+            return super()._serialize(nested_obj, attr, obj, **kwargs)
+        active = self._local.__dict__.setdefault("active", set())
+        owner, key = (type(obj), obj.pk), (type(nested_obj), nested_obj.pk)
+        if key == owner or key in active:
+            return None
+        added = {owner, key} - active
+        active |= added
+        try:
+            return super()._serialize(nested_obj, attr, obj, **kwargs)
+        finally:
+            active -= added
 
-class OrganizationSchema(Schema):
+
+class OrganizationSchema(TimedSchema):
     class Meta(object):
         model = Organization
 
@@ -13,12 +259,16 @@ class OrganizationSchema(Schema):
 
     @post_load
     def update_or_create(self, data, *args, **kwargs):
+        if self.context.get("bulk"):
+            return data
         organization_id = data.pop("id", None)
-        organization, _ = Organization.objects.update_or_create(id=organization_id, defaults=data)
+        with transaction.atomic(savepoint=False):
+            organization, created = save(Organization, organization_id, data, self.context)
+            tracking.changed("organizations", [organization.pk], Change.CREATED if created else Change.UPDATED)
         return organization
 
 
-class DivisionSchema(Schema):
+class DivisionSchema(TimedSchema):
     class Meta(object):
         model = Division
 
@@ -26,120 +276,90 @@ class DivisionSchema(Schema):
     name = fields.String(validate=validate.Length(max=255))
     organization = fields.Nested(OrganizationSchema, dump_only=True)
     organization_id = fields.Integer(required=True, load_only=True)
-    parent = fields.Nested('self', allow_none=True)
+    parent = CycleSafeNested('self', allow_none=True)
     parent_id = fields.Integer(load_only=True)
-    positions = fields.Method("get_positions")
+    positions = RelatedList("PositionSchema")
     positions_ids = fields.List(fields.Integer(), required=False, load_only=True)
 
-    def get_positions(self, obj):
-        return PositionSchema(many=True).dump(obj.positions.all())
-
-    @validates("parent_id")
-    def validate_parent_id(self, parent_id=None):
-        if parent_id:
-            try:
-                self.parent = Division.objects.get(id=parent_id)
-            except Division.DoesNotExist:
-                raise ValidationError("Invalid parent id.")
-
-    @validates("organization_id")
-    def validate_organization_id(self, organization_id):
-        try:
-            self.organization = Organization.objects.get(id=organization_id)
-        except Organization.DoesNotExist:
-            raise ValidationError("Invalid organization id.")
-
     @post_load
     def update_or_create(self, data, *args, **kwargs):
+        if self.context.get("bulk"):
+            return data
+        check_single(data)
         division_id = data.pop("id", None)
         positions_ids = data.pop("positions_ids", None)
 
-        if positions_ids is not None:
-            positions = Position.objects.filter(id__in=positions_ids)
-            if positions.count() != len(positions_ids):
-                raise ValidationError(
-                    {"positions_ids": "Some provided Position IDs do not exist."}
-                )
-        else:
-            positions = []
-
-        division, _ = Division.objects.update_or_create(
-            id=division_id, defaults=data
-        )
-        division.positions.set(positions)
+        with transaction.atomic(savepoint=False):
+            division, created = save(Division, division_id, data, self.context)
+            set_positions(division, positions_ids, created, self.context)
+            division.update_path()
+            tracking.changed("divisions", [division.pk], Change.CREATED if created else Change.UPDATED)
 
         return division
 
-class EmployeeSchema(Schema):
+class DivisionNodeSchema(TimedSchema):
+    """Узел иерархии подразделений: без вложенных organization/parent, для поддеревьев и путей"""
+    class Meta(object):
+        model = Division
+
+    id = fields.Integer()
+    name = fields.String()
+    parent_id = fields.Integer(allow_none=True)
+    depth = fields.Integer()
+
+
+class EmployeeSchema(TimedSchema):
     class Meta(object):
         model = Employee
 
     id = fields.Integer()
     first_name = fields.String(validate=validate.Length(max=255))
     last_name = fields.String(validate=validate.Length(max=255))
-    positions = fields.Method("get_positions")
+    positions = RelatedList("PositionSchema")
     positions_ids = fields.List(fields.Integer(), required=False, load_only=True)
 
-    def get_positions(self, obj):
-        return PositionSchema(many=True).dump(obj.positions.all())
-
     @post_load
     def update_or_create(self, data, *args, **kwargs):
+        if self.context.get("bulk"):
+            return data
+        check_single(data)
         employee_id = data.pop("id", None)
         positions_ids = data.pop("positions_ids", None)
 
-        if positions_ids is not None:
-            positions = Position.objects.filter(id__in=positions_ids)
-            if positions.count() != len(positions_ids):
-                raise ValidationError(
-                    {"positions_ids": "Some provided Position IDs do not exist."}
-                )
-        else:
-            positions = []
-
-        employee, _ = Employee.objects.update_or_create(
-            id=employee_id, defaults=data
-        )
-        employee.positions.set(positions)
+        with transaction.atomic(savepoint=False):
+            employee, created = save(Employee, employee_id, data, self.context)
+            set_positions(employee, positions_ids, created, self.context)
+            tracking.changed("employees", [employee.pk], Change.CREATED if created else Change.UPDATED)
 
         return employee
 
 
-class PermissionSchema(Schema):
+class PermissionSchema(TimedSchema):
     class Meta(object):
         model = Permission
 
     id = fields.Integer()
     name = fields.String(validate=validate.Length(max=255))
     description = fields.String()
-    positions = fields.Method("get_positions")
+    positions = RelatedList("PositionSchema")
     positions_ids = fields.List(fields.Integer(), required=False, load_only=True)
 
-    def get_positions(self, obj):
-        return PositionSchema(many=True).dump(obj.positions.all())
-
     @post_load
     def update_or_create(self, data, *args, **kwargs):
+        if self.context.get("bulk"):
+            return data
+        check_single(data)
         permission_id = data.pop("id", None)
         positions_ids = data.pop("positions_ids", None)
 
-        if positions_ids is not None:
-            positions = Position.objects.filter(id__in=positions_ids)
-            if positions.count() != len(positions_ids):
-                raise ValidationError(
-                    {"positions_ids": "Some provided Position IDs do not exist."}
-                )
-        else:
-            positions = []
-
-        permission, _ = Permission.objects.update_or_create(
-            id=permission_id, defaults=data
-        )
-        permission.positions.set(positions)
+        with transaction.atomic(savepoint=False):
+            permission, created = save(Permission, permission_id, data, self.context)
+            set_positions(permission, positions_ids, created, self.context)
+            tracking.changed("permissions", [permission.pk], Change.CREATED if created else Change.UPDATED)
 
         return permission
 
-class PositionSchema(Schema):
+class PositionSchema(TimedSchema):
     class Meta(object):
         model = Position
 
@@ -148,10 +368,71 @@ class PositionSchema(Schema):
 
     @post_load
     def update_or_create(self, data, *args, **kwargs):
+        if self.context.get("bulk"):
+            return data
         position_id = data.pop("id", None)
 
-        position, _ = Position.objects.update_or_create(
-            id=position_id, defaults=data
-        )
+        with transaction.atomic(savepoint=False):
+            position, created = save(Position, position_id, data, self.context)
+            tracking.changed("positions", [position.pk], Change.CREATED if created else Change.UPDATED)
+
+        return position
+
+
+class PermissionCheckSchema(TimedSchema):
+    employee_id = fields.Integer(required=True)
+    permission_id = fields.Integer(required=True)
+
+
+class BatchLookupSchema(TimedSchema):
+    type = fields.String(required=True, validate=validate.OneOf(list(tracking.RESOURCES)))
+    id = fields.Integer(required=True)
+
+
+class ChangeSchema(TimedSchema):
+    class Meta(object):
+        model = Change
+
+    seq = fields.Integer()
+    resource = fields.String()
+    object_id = fields.Integer()
+    action = fields.String()
+    created_at = fields.DateTime()
+
+
+class PurgeJobSchema(TimedSchema):
+    class Meta(object):
+        model = PurgeJob
 
-        return position
\ No newline at end of file
+    id = fields.Integer()
+    kind = fields.String()
+    target_id = fields.Integer()
+    status = fields.String()
+    total = fields.Integer()
+    deleted = fields.Integer()
+    error = fields.String()
+    created_at = fields.DateTime()
+    started_at = fields.DateTime()
+    finished_at = fields.DateTime()
+
+
+class WebhookSubscriptionSchema(TimedSchema):
+    class Meta(object):
+        model = WebhookSubscription
+
+    id = fields.Integer(dump_only=True)
+    url = fields.Url(required=True, schemes={"http", "https"}, require_tld=False, validate=validate.Length(max=2000))
+    resources = fields.List(fields.String(validate=validate.OneOf(list(tracking.RESOURCES))))
+    secret = fields.String(load_only=True, validate=validate.Length(max=255))
+    active = fields.Boolean()
+    cursor = fields.Integer(dump_only=True)
+    failures = fields.Integer(dump_only=True)
+    next_attempt_at = fields.DateTime(dump_only=True)
+    last_error = fields.String(dump_only=True)
+    created_at = fields.DateTime(dump_only=True)
+    delivered_at = fields.DateTime(dump_only=True)
+
+    @post_load
+    def create(self, data, *args, **kwargs):
+        # Новая подписка получает события, записанные после её создания
+        return WebhookSubscription.objects.create(cursor=feed.last_seq(), **data)
@@ -1,6 +1,33 @@
 import json
+import threading
+from operator import itemgetter
+
+from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
-from django.http import JsonResponse
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.http import HttpResponse, JsonResponse
+from marshmallow import fields
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULTS = {
+    # Списки читаются через values() и скомпилированные схемы вместо marshmallow
+    "FAST": True,
+    # orjson вместо json: компактнее и быстрее, но байты ответа отличаются (разделители, не-ASCII)
+    "ORJSON": False,
+}
+
+BATCH_SIZE = 2000
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, "ORGANIZATION_SERIALIZER", {}))
 
 
 def serialize_object(obj):
@@ -10,4 +37,243 @@ def serialize_object(obj):
 
 def serialize_queryset(queryset):
     """Сериализация QuerySet"""
-    return list(queryset.values())
\ No newline at end of file
+    return list(queryset.values())
+
+
+def dumps(data):
+    """Байты JSON: как у JsonResponse или, если включено, orjson"""
+    with metrics.serialization():
+        if orjson is not None and get_config()["ORJSON"]:
+            return orjson.dumps(data)
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+def json_response(data, status=200):
+    with metrics.serialization():
+        if orjson is not None and get_config()["ORJSON"]:
+            return HttpResponse(orjson.dumps(data), content_type="application/json", status=status)
+        return JsonResponse(data, status=status, safe=False)
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _converter(field, model_field):
+    """Преобразование значения столбца как в field._serialize; None — значение подходит как есть,
+    False — поле не компилируется"""
+    if model_field.is_relation:
+        model_field = model_field.target_field
+    kind = type(field)
+    if kind is fields.Integer and not field.as_string:
+        return None if isinstance(model_field, models.IntegerField) else int
+    if kind is fields.String:
+        return None if isinstance(model_field, (models.CharField, models.TextField)) else str
+    if kind is fields.DateTime and field.format in (None, "iso") and isinstance(model_field, models.DateTimeField):
+        return _isoformat
+    return False
+
+
+VALUE, CONVERT, NESTED, RELATED = range(4)
+
+
+class Plan(object):
+    """Скомпилированная схема: столбцы для values() и шаги сборки словаря из строки"""
+
+    def __init__(self, model):
+        self.model = model
+        self.pk = model._meta.pk.attname
+        self.columns = [self.pk]
+        self.steps = []
+        self.supported = True
+
+    def compile(self, schema):
+        for name, field in schema.dump_fields.items():
+            key = field.data_key or name
+            try:
+                model_field = self.model._meta.get_field(field.attribute or name)
+            except FieldDoesNotExist:
+                self.supported = False
+                return
+            if isinstance(field, fields.Nested):
+                nested = compile_schema(field.schema)
+                if nested is None or field.many != model_field.many_to_many:
+                    self.supported = False
+                    return
+                if field.many:
+                    self.steps.append((key, RELATED, self.pk, (model_field, nested)))
+                else:
+                    self.columns.append(model_field.attname)
+                    self.steps.append((key, NESTED, model_field.attname, nested))
+                continue
+            convert = _converter(field, model_field)
+            if convert is False:
+                self.supported = False
+                return
+            column = model_field.attname if model_field.is_relation else model_field.name
+            if column not in self.columns:
+                self.columns.append(column)
+            self.steps.append((key, VALUE if convert is None else CONVERT, column, convert))
+        self.columns = list(dict.fromkeys(self.columns))
+
+    def fetch(self, ids):
+        queryset = self.model._default_manager.values(*self.columns)
+        for start in range(0, len(ids), BATCH_SIZE):
+            yield from queryset.filter(pk__in=ids[start:start + BATCH_SIZE])
+
+    def fetch_related(self, field, owner_ids):
+        """Строки M2M-связи вместе с id владельца — тот же запрос с JOIN, что у prefetch_related, по возрастанию id
+        (как у schemas.RelatedList)"""
+        owner = field.related_query_name()
+        for start in range(0, len(owner_ids), BATCH_SIZE):
+            # filter до values: иначе values() добавит к связи второй JOIN
+            queryset = self.model._default_manager.filter(**{f"{owner}__in": owner_ids[start:start + BATCH_SIZE]})
+            yield from queryset.values(owner, *self.columns).order_by(self.pk)
+
+
+_plans = {}
+_lock = threading.RLock()
+
+
+def _schema_key(schema):
+    only = None if schema.only is None else tuple(sorted(schema.only))
+    return type(schema), only, tuple(sorted(schema.exclude))
+
+
+def compile_schema(schema):
+    """План для schema (кэшируется по классу и only/exclude) или None, если схему не скомпилировать"""
+    key = _schema_key(schema)
+    plan = _plans.get(key)
+    if plan is None:
+        model = getattr(schema.Meta, "model", None)
+        if model is None:
+            return None
+        with _lock:
+            plan = _plans.get(key)
+            if plan is None:
+                # План регистрируется до компиляции: на него ссылаются рекурсивные Nested('self')
+                plan = _plans[key] = Plan(model)
+                plan.compile(schema)
+    return plan if plan.supported else None
+
+
+class Loader(object):
+    """Строки одного ответа по планам: вложенные объекты дочитываются пачками по id"""
+
+    def __init__(self):
+        self.rows = {}
+        self.links = {}
+        self.dumped = {}
+        # Объекты, которые сейчас выводятся: повторный заход в них — цикл в данных (parent), см. dump
+        self.active = set()
+        self.cycles = 0
+
+    def add(self, plan, rows):
+        known = self.rows.setdefault(plan, {})
+        new = []
+        for row in rows:
+            if row[plan.pk] not in known:
+                known[row[plan.pk]] = row
+                new.append(row)
+        if not new:
+            return
+        for key, kind, column, extra in plan.steps:
+            if kind == NESTED:
+                loaded = self.rows.get(extra, {})
+                wanted = list({row[column] for row in new if row[column] is not None} - loaded.keys())
+                if wanted:
+                    self.add(extra, extra.fetch(wanted))
+            elif kind == RELATED:
+                field, nested = extra
+                links = self.links.setdefault((plan, key), {})
+                for row in new:
+                    links[row[plan.pk]] = []
+                owner = field.related_query_name()
+                related = []
+                for row in nested.fetch_related(field, [row[plan.pk] for row in new]):
+                    links[row.pop(owner)].append(row[nested.pk])
+                    related.append(row)
+                self.add(nested, related)
+
+    def dump(self, plan, pk):
+        """Данные объекта; вложенный объект, уже выводимый выше по цепочке, — None, как у CycleSafeNested
+
+        Данные, в которых цикл оборван, не кэшируются: в другом месте ответа он оборвётся на другом объекте.
+        """
+        data = self.dumped.get((plan, pk))
+        if data is not None:
+            return data
+        if (plan, pk) in self.active:
+            self.cycles += 1
+            return None
+        self.active.add((plan, pk))
+        cycles = self.cycles
+        try:
+            data = self._dump(plan, pk)
+        finally:
+            self.active.discard((plan, pk))
+        if self.cycles == cycles:
+            self.dumped[(plan, pk)] = data
+        return data
+
+    def _dump(self, plan, pk):
+        row = self.rows[plan][pk]
+        data = {}
+        for key, kind, column, extra in plan.steps:
+            value = row[column]
+            if kind == VALUE:
+                data[key] = value
+            elif value is None:
+                data[key] = None
+            elif kind == CONVERT:
+                data[key] = extra(value)
+            elif kind == NESTED:
+                data[key] = self.dump(extra, value)
+            else:
+                data[key] = [self.dump(extra[1], related) for related in self.links[(plan, key)][value]]
+        return data
+
+
+def _values(queryset, plan):
+    return queryset.select_related(None).prefetch_related(None).values(*plan.columns)
+
+
+def dump_rows(queryset, schema, loader=None):
+    """[(pk, данные)] выборки — то же, что schema.dump(queryset, many=True), но через values()
+
+    Общий loader нескольких выборок не дочитывает повторно уже загруженные вложенные объекты.
+    """
+    plan = compile_schema(schema) if get_config()["FAST"] else None
+    if plan is None:
+        objs = list(queryset)
+        return list(zip((obj.pk for obj in objs), schema.dump(objs, many=True)))
+    with metrics.serialization():
+        rows = list(_values(queryset, plan))
+        loader = loader or Loader()
+        loader.add(plan, rows)
+        return [(row[plan.pk], loader.dump(plan, row[plan.pk])) for row in rows]
+
+
+def iter_dumped(queryset, schema, chunk_size=BATCH_SIZE):
+    """Сериализованные объекты выборки частями по chunk_size (для потоковой выдачи)"""
+    plan = compile_schema(schema) if get_config()["FAST"] else None
+    rows = queryset.iterator(chunk_size=chunk_size) if plan is None else \
+        _values(queryset, plan).iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _dump_chunk(chunk, schema, plan)
+            chunk = []
+    if chunk:
+        yield _dump_chunk(chunk, schema, plan)
+
+
+def _dump_chunk(chunk, schema, plan):
+    if plan is None:
+        return schema.dump(chunk, many=True)
+    # Свой Loader на каждую часть: память не растёт с размером выборки
+    with metrics.serialization():
+        loader = Loader()
+        loader.add(plan, chunk)
+        return [loader.dump(plan, pk) for pk in map(itemgetter(plan.pk), chunk)]
@@ -0,0 +1,97 @@
+from django.db.models.signals import m2m_changed, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import counters, directory, tracking
+from .models import Organization, Division, Employee, Permission, Position
+
+CHANGES = ("post_add", "post_remove", "post_clear", "pre_clear")
+
+
+def _sides(instance, reverse, pk_set, action, related):
+    """(id объектов, id должностей) изменившихся связей; related — обратная связь должности с объектами"""
+    if action == "pre_clear":
+        # после clear() pk_set не передаётся, запоминаем другую сторону заранее
+        instance._cleared_ids = list(getattr(instance, related if reverse else "positions")
+                                     .values_list("pk", flat=True))
+        return [], []
+    linked = instance._cleared_ids if action == "post_clear" else list(pk_set)
+    return (linked, [instance.pk]) if reverse else ([instance.pk], linked)
+
+
+@receiver(m2m_changed, sender=Employee.positions.through)
+def employee_positions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in CHANGES:
+        employee_ids, position_ids = _sides(instance, reverse, pk_set, action, "employees")
+        directory.refresh_positions(employee_ids)
+        counters.positions_changed(Employee, employee_ids, position_ids)
+        if reverse:
+            tracking.changed("employees", employee_ids)
+
+
+@receiver(m2m_changed, sender=Permission.positions.through)
+def permission_positions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in CHANGES:
+        permission_ids, position_ids = _sides(instance, reverse, pk_set, action, "permissions")
+        counters.positions_changed(Permission, permission_ids, position_ids)
+        if reverse:
+            tracking.changed("permissions", permission_ids)
+
+
+@receiver(m2m_changed, sender=Division.positions.through)
+def division_positions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in CHANGES:
+        division_ids, position_ids = _sides(instance, reverse, pk_set, action, "divisons")
+        counters.positions_changed(Division, division_ids, position_ids)
+        # Прямые изменения (division.positions.set) версионирует DivisionSchema, здесь — со стороны должности
+        if reverse:
+            tracking.changed("divisions", division_ids)
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_save, sender=Position)
+def counted_created(sender, instance, created, **kwargs):
+    if created:
+        counters.create(sender, [instance.pk])
+
+
+@receiver(post_save, sender=Division)
+def division_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.create(Division, [instance.pk])
+        counters.touch(organizations=[instance.organization_id])
+        return
+    previous = getattr(instance, "_loaded_organization_id", instance.organization_id)
+    if previous != instance.organization_id:
+        # Сотрудники должностей подразделения переходят в другую организацию
+        counters.touch(placed=instance.positions.values_list("pk", flat=True),
+                       organizations=[previous, instance.organization_id])
+        instance._loaded_organization_id = instance.organization_id
+
+
+@receiver(pre_delete, sender=Position)
+def position_pre_delete(sender, instance, **kwargs):
+    instance._employee_ids = list(instance.employees.values_list("pk", flat=True))
+    instance._division_ids = list(instance.divisons.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Position)
+def position_post_delete(sender, instance, **kwargs):
+    directory.refresh_positions(instance._employee_ids)
+    counters.touch(employees=instance._employee_ids, grantees=instance._employee_ids, divisions=instance._division_ids)
+
+
+@receiver(pre_delete, sender=Division)
+@receiver(pre_delete, sender=Employee)
+@receiver(pre_delete, sender=Permission)
+def linked_pre_delete(sender, instance, **kwargs):
+    # Связи с должностями удаляет collector, для счётчиков запоминаем их заранее
+    instance._position_ids = list(instance.positions.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Division)
+@receiver(post_delete, sender=Employee)
+@receiver(post_delete, sender=Permission)
+def linked_post_delete(sender, instance, **kwargs):
+    counters.positions_changed(sender, [instance.pk], instance._position_ids, deleted=True)
+    if sender is Division:
+        counters.touch(organizations=[instance.organization_id])
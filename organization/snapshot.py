@@ -0,0 +1,268 @@
+"""Снимок организации целиком: gzip NDJSON, по разделу на таблицу
+
+Формат: первая строка раздела — заголовок {"snapshot": 1, "table": ..., "columns": [...]}, за ним строки
+таблицы массивами значений в порядке columns (имена столбцов не повторяются в каждой строке). Разделы
+идут в порядке SECTIONS, подразделения — по глубине, так что родитель всегда раньше потомков.
+Подразделение с родителем из другой организации при загрузке становится корневым.
+
+В снимок входят организация, её подразделения, должности этих подразделений, сотрудники и права,
+у которых есть хотя бы одна из этих должностей (связи с должностями вне снимка не выгружаются).
+"""
+import gzip
+import json
+import zlib
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import connection, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from marshmallow import ValidationError
+
+from . import access, cache, counters, directory, tracking
+from .models import Organization, Division, Position, Employee, Permission, Change
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 5000
+COMPRESS_LEVEL = 6
+
+SECTIONS = {
+    "organizations": ("id", "name", "description"),
+    "positions": ("id", "name"),
+    "permissions": ("id", "name", "description", "positions"),
+    "divisions": ("id", "name", "parent_id", "depth", "positions"),
+    "employees": ("id", "first_name", "last_name", "positions"),
+}
+
+
+def _line(row):
+    if orjson is not None:
+        return orjson.dumps(row) + b"\n"
+    return json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _holders(model, scope, using):
+    """Объекты model с должностями из scope и списком этих должностей"""
+    return (model.objects.using(using).filter(positions__in=scope)
+            .annotate(position_ids=ArrayAgg("positions", ordering="positions"))
+            .order_by("id"))
+
+
+def _querysets(organization_id, using):
+    scope = Position.objects.using(using).filter(divisons__organization_id=organization_id).values("pk")
+    linked = Q(positions__isnull=False)
+    divisions = (Division.objects.using(using).filter(organization_id=organization_id)
+                 .annotate(position_ids=ArrayAgg("positions", filter=linked, ordering="positions", default=[]))
+                 .order_by("depth", "id"))
+    organizations = Organization.objects.using(using).filter(pk=organization_id)
+    return {
+        "organizations": organizations.values_list("id", "name", "description"),
+        "positions": Position.objects.using(using).filter(pk__in=scope).order_by("id").values_list("id", "name"),
+        "permissions": _holders(Permission, scope, using).values_list("id", "name", "description", "position_ids"),
+        "divisions": divisions.values_list("id", "name", "parent_id", "depth", "position_ids"),
+        "employees": _holders(Employee, scope, using).values_list("id", "first_name", "last_name", "position_ids"),
+    }
+
+
+def export_chunks(organization_id, chunk_size=CHUNK_SIZE):
+    """Строки снимка пачками по chunk_size (байты NDJSON); выборки читаются серверными курсорами
+
+    Все разделы читаются в одной транзакции REPEATABLE READ, то есть из одного согласованного состояния.
+    """
+    using = router.db_for_read(Organization)
+    database = connections[using]
+    isolate = database.vendor == "postgresql" and not database.in_atomic_block
+    with transaction.atomic(using=using):
+        if isolate:
+            with database.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        for table, queryset in _querysets(organization_id, using).items():
+            lines = [_line({"snapshot": FORMAT_VERSION, "table": table, "columns": SECTIONS[table]})]
+            for row in queryset.iterator(chunk_size=chunk_size):
+                lines.append(_line(row))
+                if len(lines) >= chunk_size:
+                    yield b"".join(lines)
+                    lines = []
+            if lines:
+                yield b"".join(lines)
+
+
+def export_snapshot(organization_id, chunk_size=CHUNK_SIZE):
+    """Поток байтов gzip-снимка организации (для StreamingHttpResponse или записи в файл)"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # +16: формат gzip
+    for chunk in export_chunks(organization_id, chunk_size):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _read_sections(stream):
+    """(таблица, пачки строк) из gzip NDJSON; проверяет заголовки и порядок разделов"""
+    lines = gzip.GzipFile(fileobj=stream, mode="rb")
+    order = list(SECTIONS)
+    table, rows = None, []
+
+    def error(message):
+        return ValidationError({"error": message})
+
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                item = _loads(line)
+            except ValueError:
+                raise error(f"Line {number}: malformed JSON.")
+            if isinstance(item, dict):
+                if item.get("snapshot") != FORMAT_VERSION:
+                    raise error(f"Line {number}: unsupported snapshot version.")
+                if item.get("table") not in order or tuple(item.get("columns", ())) != SECTIONS[item["table"]]:
+                    raise error(f"Line {number}: unknown section.")
+                if table is not None and order.index(item["table"]) <= order.index(table):
+                    raise error(f"Line {number}: sections are out of order.")
+                if rows:
+                    yield table, rows
+                table, rows = item["table"], []
+            elif isinstance(item, list) and table is not None and len(item) == len(SECTIONS[table]):
+                rows.append(item)
+                if len(rows) >= CHUNK_SIZE:
+                    yield table, rows
+                    rows = []
+            else:
+                raise error(f"Line {number}: unexpected row.")
+    except (OSError, EOFError, zlib.error):
+        raise error("Malformed gzip payload.")
+    if rows:
+        yield table, rows
+
+
+def _allocate_ids(model, count):
+    """count новых id из последовательности таблицы одним запросом"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                       [model._meta.db_table, count])
+        return [pk for pk, in cursor.fetchall()]
+
+
+def _copy(model, columns, rows):
+    """Вставка строк через COPY (rows — кортежи значений столбцов columns)"""
+    if not rows:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ", ".join(connection.ops.quote_name(column) for column in columns)
+    with connection.cursor() as cursor:
+        with cursor.copy(f"COPY {table} ({names}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def _copy_positions(model, links, positions):
+    """Связи (новый id объекта, старые id должностей) → строки M2M-таблицы model.positions"""
+    field = model._meta.get_field("positions")
+    through = field.remote_field.through
+    _copy(through, (f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"),
+          [(pk, positions[old]) for pk, olds in links for old in olds if old in positions])
+
+
+def _loaded(table):
+    """Таблицы, в которые COPY пишет раздел table: сама таблица и её связи с должностями"""
+    model = tracking.RESOURCES[table]
+    return [model, model.positions.through] if table != "positions" else [model]
+
+
+def _analyze(models):
+    with connection.cursor() as cursor:
+        for model in dict.fromkeys(models):
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+
+
+def import_snapshot(stream, name=None):
+    """Загрузка снимка из бинарного потока gzip NDJSON одной транзакцией, только PostgreSQL (COPY)
+
+    Все объекты получают новые id (старые из снимка переназначаются), name переименовывает организацию.
+    Возвращает {"organization_id": ..., "counts": {таблица: число строк}}.
+    """
+    now = timezone.now()
+    counts = dict.fromkeys(SECTIONS, 0)
+    organization = None
+    positions = {}  # старый id → новый
+    divisions = {}  # старый id → (новый id, путь)
+    events = []  # (таблица, новые id)
+
+    with transaction.atomic():
+        with tracking.collect():
+            for table, rows in _read_sections(stream):
+                if table == "organizations":
+                    if organization is not None or len(rows) != 1:
+                        raise ValidationError({"error": "Snapshot must contain exactly one organization."})
+                    _, original_name, description = rows[0]
+                    organization = Organization.objects.create(name=name or original_name, description=description)
+                    tracking.changed("organizations", [organization.pk], Change.CREATED)
+                    counts[table] = 1
+                    continue
+                if organization is None:
+                    raise ValidationError({"error": "Snapshot must start with the organization."})
+
+                model = tracking.RESOURCES[table]
+                ids = _allocate_ids(model, len(rows))
+                if table == "positions":
+                    positions.update((row[0], pk) for row, pk in zip(rows, ids))
+                    _copy(model, ("id", "updated_at", "version", "name"),
+                          [(pk, now, 1, row[1]) for row, pk in zip(rows, ids)])
+                    counters.create(model, ids)
+                elif table == "permissions":
+                    _copy(model, ("id", "updated_at", "version", "name", "description"),
+                          [(pk, now, 1, row[1], row[2]) for row, pk in zip(rows, ids)])
+                    _copy_positions(model, [(pk, row[3]) for row, pk in zip(rows, ids)], positions)
+                elif table == "divisions":
+                    values = []
+                    for (old, division_name, parent, _, _), pk in zip(rows, ids):
+                        # Родитель из другой организации в снимок не входит: такое подразделение становится корневым
+                        parent_id, parent_path = divisions.get(parent, (None, "/"))
+                        path = f"{parent_path}{pk}/"
+                        divisions[old] = (pk, path)
+                        values.append((pk, now, 1, division_name, parent_id, organization.pk, path,
+                                       path.count("/") - 2))
+                    _copy(model, ("id", "updated_at", "version", "name", "parent_id", "organization_id",
+                                  "path", "depth"), values)
+                    counters.create(model, ids)
+                    _copy_positions(model, [(pk, row[4]) for row, pk in zip(rows, ids)], positions)
+                else:
+                    # Лексемы должностей (directory.py) пишутся вместе со строкой, без UPDATE после вставки
+                    _copy(model, ("id", "updated_at", "version", "first_name", "last_name", "position_tokens"),
+                          [(pk, now, 1, row[1], row[2],
+                            directory.position_tokens(positions[old] for old in row[3] if old in positions))
+                           for row, pk in zip(rows, ids)])
+                    _copy_positions(model, [(pk, row[3]) for row, pk in zip(rows, ids)], positions)
+
+                events.append((table, ids))
+                counts[table] += len(rows)
+
+            if organization is None:
+                raise ValidationError({"error": "Snapshot must start with the organization."})
+            # Статистика планировщика не видит строк, загруженных в этой транзакции: без неё запросы по связям
+            # ниже выбирают вложенные циклы по «пустым» таблицам
+            _analyze([model for table, _ in events for model in _loaded(table)])
+            # Связи уже загружены: индексы прав, счётчики и членство считаются один раз по всей организации
+            employees = [pk for table, ids in events if table == "employees" for pk in ids]
+            access.add_employees(employees)
+            counters.touch(positions=positions.values(), divisions=[pk for pk, _ in divisions.values()],
+                           organizations=[organization.pk])
+            counters.add_members(organization.pk)
+            for resource in SECTIONS:
+                cache.invalidate(resource)
+            tracking.lists_changed(SECTIONS)
+        # События разделов — после события организации, под блокировкой журнала и одним COPY в конце транзакции
+        tracking.lock_log()
+        logged = timezone.now()
+        _copy(Change, ("resource", "object_id", "action", "created_at"),
+              [(table, pk, Change.CREATED, logged) for table, ids in events for pk in ids])
+    return {"organization_id": organization.pk, "counts": counts}
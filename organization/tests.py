@@ -1,3 +1,1454 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+import warnings
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import CacheKeyWarning
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from marshmallow import ValidationError
+
+from . import access, bulk, cache, counters, feed, metrics, purge, serializers, tracking, webhooks
+from .models import Organization, Division, Position, Employee, Permission, Change, PurgeJob, \
+    OrganizationCounters, OrganizationMember, WebhookSubscription
+from .pagination import encode_cursor
+from .schemas import DivisionSchema, EmployeeSchema, OrganizationSchema, PermissionSchema, ChangeSchema
+from .writes import ObjectDeleted, PreconditionFailed
+
+
+class QueryCountMixin(object):
+    """Проверка, что число запросов эндпоинта не растёт вместе с числом строк"""
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url, seed, sizes=(1, 10, 30)):
+        counts = []
+        for size in sizes:
+            seed(size)
+            counts.append(self.count_queries(url))
+        self.assertEqual(len(set(counts)), 1, f"Query count grows with rows for {url}: {counts}")
+
+
+@override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+class ListQueryCountTest(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name="Acme")
+        self.positions = [Position.objects.create(name=f"Position {i}") for i in range(3)]
+
+    def seed_divisions(self, size):
+        for i in range(size):
+            parent = Division.objects.create(name=f"Parent {i}", organization=self.organization)
+            parent.positions.set(self.positions)
+            child = Division.objects.create(name=f"Child {i}", organization=self.organization, parent=parent)
+            child.positions.set(self.positions)
+
+    def seed_employees(self, size):
+        for i in range(size):
+            employee = Employee.objects.create(first_name=f"First {i}", last_name=f"Last {i}")
+            employee.positions.set(self.positions)
+
+    def seed_permissions(self, size):
+        for i in range(size):
+            permission = Permission.objects.create(name=f"Permission {i}")
+            permission.positions.set(self.positions)
+
+    def test_divisions(self):
+        self.assertConstantQueries("/api/divisions/", self.seed_divisions)
+
+    def test_employees(self):
+        self.assertConstantQueries("/api/employees/", self.seed_employees)
+
+    def test_permissions(self):
+        self.assertConstantQueries("/api/permissions/", self.seed_permissions)
+
+    def test_division_detail(self):
+        self.seed_divisions(1)
+        child = Division.objects.filter(parent__isnull=False).get()
+        queries = self.count_queries(f"/api/divisions/{child.id}/")
+        self.seed_divisions(10)
+        self.assertEqual(self.count_queries(f"/api/divisions/{child.id}/"), queries)
+
+
+@override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+class PaginationTest(TestCase):
+    def setUp(self):
+        # Одинаковые фамилии: порядок внутри них задаёт только id
+        self.employees = [Employee.objects.create(first_name=f"First {i}", last_name=f"Last {i % 3}")
+                          for i in range(7)]
+
+    def pages(self, url):
+        results, after = [], ""
+        while True:
+            response = self.client.get(url + after)
+            self.assertEqual(response.status_code, 200, response.content)
+            page = response.json()
+            results.append([item["id"] for item in page["results"]])
+            if not page["next"]:
+                return results
+            after = "&after=" + page["next"]
+
+    def test_pages_by_id(self):
+        ids = [employee.id for employee in self.employees]
+        self.assertEqual(self.pages("/api/employees/?limit=3"), [ids[:3], ids[3:6], ids[6:]])
+        self.assertEqual(self.pages("/api/employees/?limit=7"), [ids])
+
+    def test_ties_on_non_unique_key(self):
+        expected = [employee.id for employee in sorted(self.employees, key=lambda e: (e.last_name, e.id))]
+        for limit in (1, 2, 4):
+            with self.subTest(limit=limit):
+                pages = self.pages(f"/api/employees/?limit={limit}&ordering=last_name")
+                self.assertEqual(sum(pages, []), expected)
+        descending = sorted(self.employees, key=lambda e: (e.last_name, e.id), reverse=True)
+        self.assertEqual(sum(self.pages("/api/employees/?limit=2&ordering=-last_name"), []),
+                         [employee.id for employee in descending])
+
+    def test_invalid_cursors(self):
+        cursor = self.client.get("/api/employees/?limit=2&ordering=last_name").json()["next"]
+        for after in ("garbage!", "e30", encode_cursor("1"), encode_cursor(1, ["last_name"], []), cursor[:-2]):
+            with self.subTest(after=after):
+                self.assertEqual(self.client.get(f"/api/employees/?after={after}&ordering=last_name").status_code, 400)
+        # Курсор другой сортировки, в том числе сменившейся между страницами
+        for url in ("/api/employees/?after={}", "/api/employees/?after={}&ordering=-last_name",
+                    "/api/employees/?after={}&ordering=last_name,first_name"):
+            with self.subTest(url=url):
+                response = self.client.get(url.format(cursor))
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"after": "Cursor does not match ordering."})
+        plain = self.client.get("/api/employees/?limit=2").json()["next"]
+        self.assertEqual(self.client.get(f"/api/employees/?after={plain}&ordering=last_name").status_code, 400)
+        self.assertEqual(self.client.get("/api/employees/?limit=0").status_code, 400)
+
+    def test_streaming_body(self):
+        expected = self.client.get("/api/employees/?limit=1000").json()["results"]
+        response = self.client.get("/api/employees/?stream=1")
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), expected)
+
+        response = self.client.get("/api/employees/?stream=ndjson&ordering=last_name")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         sorted(expected, key=lambda item: (item["last_name"], item["id"])))
+
+    def test_streaming_empty(self):
+        Employee.objects.all().delete()
+        self.assertEqual(b"".join(self.client.get("/api/employees/?stream=1").streaming_content), b"[]")
+        self.assertEqual(b"".join(self.client.get("/api/employees/?stream=ndjson").streaming_content), b"")
+
+
+@override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+class BatchReadTest(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name="Acme")
+        self.positions = [Position.objects.create(name=f"Position {i}") for i in range(3)]
+        self.employees = []
+        for i in range(20):
+            employee = Employee.objects.create(first_name=f"First {i}", last_name=f"Last {i}")
+            employee.positions.set(self.positions[:i % 3 + 1])
+            self.employees.append(employee)
+
+    def test_ids_keyed_with_missing(self):
+        first = self.employees[0]
+        response = self.client.get(f"/api/employees/?ids={first.id},0,{first.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], {
+            str(first.id): {"status": 200, "data": EmployeeSchema().dump(first)},
+            "0": {"status": 404, "error": "No employee matches the given query"},
+        })
+        # Фильтры списка действуют и на ids
+        response = self.client.get(f"/api/employees/?ids={first.id}&position_id={self.positions[2].id}")
+        self.assertEqual(response.json()["results"][str(first.id)]["status"], 404)
+        self.assertEqual(self.client.get("/api/employees/?ids=1,x").status_code, 400)
+
+    def test_ids_constant_queries(self):
+        counts = []
+        for size in (1, 20):
+            ids = ",".join(str(employee.id) for employee in self.employees[:size])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f"/api/employees/?ids={ids}")
+            self.assertEqual(len(response.json()["results"]), size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_mixed_batch(self):
+        division = Division.objects.create(name="Root", organization=self.organization)
+        division.positions.set(self.positions[:1])
+        lookups = [{"type": "divisions", "id": division.id}, {"type": "organizations", "id": self.organization.id},
+                   {"type": "employees", "id": self.employees[1].id}, {"type": "positions", "id": 0}]
+        with self.assertNumQueries(6):
+            response = self.client.post("/api/batch/", lookups, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(results["divisions"][str(division.id)]["data"], DivisionSchema().dump(division))
+        self.assertEqual(results["organizations"][str(self.organization.id)]["data"],
+                         OrganizationSchema().dump(self.organization))
+        self.assertEqual(results["employees"][str(self.employees[1].id)]["data"]["last_name"], "Last 1")
+        self.assertEqual(results["positions"], {"0": {"status": 404, "error": "No position matches the given query"}})
+        response = self.client.post("/api/batch/", [{"type": "users", "id": 1}], content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkUpsertTest(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name="Acme")
+        self.position = Position.objects.create(name="Engineer")
+
+    def post(self, url, data, content_type="application/json"):
+        return self.client.post(url, data, content_type=content_type)
+
+    def test_create_and_update_employees(self):
+        payload = [{"first_name": f"First {i}", "last_name": "Last", "positions_ids": [self.position.id]}
+                   for i in range(50)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post("/api/employees/bulk/", payload)
+        self.assertEqual(response.json()["created"], 50)
+        # Число запросов не зависит от размера пачки (включая пересчёт счётчиков, counters.py)
+        self.assertLess(len(queries), 25)
+        self.assertEqual(Employee.positions.through.objects.count(), 50)
+
+        employee_id = response.json()["results"][0]["id"]
+        ndjson = '{"id": %d, "first_name": "Renamed", "positions_ids": []}\n' % employee_id
+        response = self.post("/api/employees/bulk/", ndjson, content_type="application/x-ndjson")
+        self.assertEqual(response.json()["results"], [{"index": 0, "status": "updated", "id": employee_id}])
+        employee = Employee.objects.get(pk=employee_id)
+        self.assertEqual((employee.first_name, employee.last_name), ("Renamed", "Last"))
+        self.assertFalse(employee.positions.exists())
+
+    def test_per_item_errors(self):
+        payload = [
+            {"name": "Root", "organization_id": self.organization.id},
+            {"name": "Orphan", "organization_id": self.organization.id, "parent_id": 999},
+            {"name": "Nowhere", "organization_id": 999},
+        ]
+        results = self.post("/api/divisions/bulk/", payload).json()["results"]
+        self.assertEqual([result["status"] for result in results], ["created", "error", "error"])
+        self.assertEqual(results[1]["errors"], {"parent_id": ["Invalid parent id."]})
+        self.assertEqual(Division.objects.count(), 1)
+
+    def test_rejects_parent_cycles(self):
+        def row(pk, parent_id=None):
+            data = {"id": pk, "name": str(pk), "organization_id": self.organization.id}
+            return data if parent_id is None else dict(data, parent_id=parent_id)
+
+        self.post("/api/divisions/bulk/", [row(1001), row(1002, 1001), row(1003, 1002)])
+        moved_under_itself = {"parent_id": ["Division cannot be moved under itself."]}
+        # Через сохранённый путь (A -> C -> B -> A) и через строки самой пачки (A -> D -> A)
+        for payload in ([row(1001, 1003)], [row(1001, 1004), row(1004, 1001)]):
+            with self.subTest(payload=payload):
+                results = self.post("/api/divisions/bulk/", payload).json()["results"]
+                self.assertEqual([result["errors"] for result in results], [moved_under_itself] * len(payload))
+        # Потомок новой строки, отбракованной из-за цикла, тоже не записывается
+        results = self.post("/api/divisions/bulk/", [row(1004, 1005), row(1005, 1004), row(1006, 1005)]).json()
+        self.assertEqual(results["results"][2]["errors"], {"parent_id": ["Invalid parent id."]})
+        self.assertIsNone(Division.objects.get(pk=1001).parent_id)
+        self.assertFalse(Division.objects.filter(pk=1004).exists())
+        self.assertEqual(self.client.get("/api/divisions/1003/").json()["parent"]["parent"]["id"], 1001)
+
+        # Перестановка в одной пачке: C переходит под A, B — под C
+        results = self.post("/api/divisions/bulk/", [row(1002, 1003), row(1003, 1001)]).json()["results"]
+        self.assertEqual([result["status"] for result in results], ["updated", "updated"])
+        self.assertEqual(Division.objects.get(pk=1002).path, "/1001/1003/1002/")
+
+    def test_move_updates_subtree_paths_in_the_batch(self):
+        rows = [{"id": 3001, "name": "A"}, {"id": 3002, "name": "B", "parent_id": 3001},
+                {"id": 3003, "name": "C", "parent_id": 3002}, {"id": 3004, "name": "D"}]
+        self.post("/api/divisions/bulk/", [dict(row, organization_id=self.organization.id) for row in rows])
+        self.assertEqual(Division.objects.get(pk=3003).path, "/3001/3002/3003/")
+
+        # Пути пересчитывает сама пачка, в своей транзакции: поддерево B переезжает вместе с ней
+        with transaction.atomic():
+            row = {"id": 3002, "name": "B", "organization_id": self.organization.id, "parent_id": 3004}
+            bulk.write_batch(Division, [(0, row)], {3002})
+            self.assertEqual(Division.objects.get(pk=3003).path, "/3004/3002/3003/")
+        self.assertEqual(Division.objects.get(pk=3003).depth, 2)
+        self.assertEqual(Division.rebuild_paths(), 0)
+
+    def test_conflicting_batch_gives_item_errors(self):
+        # Должность удалена между проверкой ссылок и записью: пачка откатывается, элементы получают ошибку
+        payload = [{"first_name": "Ann", "last_name": "Lee", "positions_ids": [self.position.id]},
+                   {"first_name": "Bob", "last_name": "Lee", "positions_ids": [self.position.id + 1000]}]
+        with mock.patch.object(bulk, "check_references"):
+            response = self.post("/api/employees/bulk/", payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["error"], 2)
+        self.assertEqual(response.json()["results"][0]["errors"], {"error": [bulk.BATCH_CONFLICT]})
+        self.assertFalse(Employee.objects.exists())
+
+    def test_children_of_rejected_rows_are_rejected(self):
+        payload = [{"id": 2001, "name": "Lost", "organization_id": 999},
+                   {"id": 2002, "name": "Child", "organization_id": self.organization.id, "parent_id": 2001},
+                   {"id": 2003, "name": "Grandchild", "organization_id": self.organization.id, "parent_id": 2002}]
+        results = self.post("/api/divisions/bulk/", payload).json()["results"]
+        self.assertEqual([result["status"] for result in results], ["error"] * 3)
+        self.assertEqual(results[2]["errors"], {"parent_id": ["Invalid parent id."]})
+        self.assertFalse(Division.objects.exists())
+
+
+class DivisionHierarchyTest(TestCase):
+    def setUp(self):
+        organization = Organization.objects.create(name="Acme")
+        self.chain = []
+        for i in range(60):
+            data = {"name": f"Level {i}", "organization_id": organization.id}
+            if self.chain:
+                data["parent_id"] = self.chain[-1]
+            response = self.client.post("/api/divisions/", data, content_type="application/json")
+            self.chain.append(response.json()["id"])
+
+    def test_subtree_and_ancestors(self):
+        with CaptureQueriesContext(connection) as queries:
+            ancestors = self.client.get(f"/api/divisions/{self.chain[-1]}/ancestors/").json()
+        self.assertEqual([division["id"] for division in ancestors], self.chain[:-1])
+        self.assertEqual(len(queries), 2)
+
+        subtree = self.client.get(f"/api/divisions/{self.chain[0]}/subtree/?limit=1000").json()["results"]
+        self.assertEqual([division["id"] for division in subtree], self.chain[1:])
+
+    def test_move_and_delete_keep_paths(self):
+        root, middle = self.chain[0], self.chain[30]
+        self.client.put(f"/api/divisions/{middle}/", {"parent_id": root}, content_type="application/json")
+        self.assertEqual(Division.objects.get(pk=self.chain[-1]).depth, 30)
+
+        Division.objects.get(pk=middle).delete()
+        self.assertEqual(Division.objects.get(pk=self.chain[-1]).depth, 28)
+        self.assertEqual(Division.rebuild_paths(), 0)
+
+    @override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+    def test_parent_cycle_in_data(self):
+        # Цикл, записанный в обход проверок: пути не пересчитываются, ответы обрывают цепочку parent
+        first, second = self.chain[:2]
+        Division.objects.filter(pk=first).update(parent_id=second)
+        with self.assertRaises(ValidationError):
+            Division.rebuild_paths()
+        self.assertEqual(Division.objects.get(pk=first).path, f"/{first}/")
+
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(ORGANIZATION_SERIALIZER={"FAST": fast}):
+                response = self.client.get(f"/api/divisions/?ids={first},{second}")
+                self.assertEqual(response.status_code, 200)
+                results = {pk: item["data"] for pk, item in response.json()["results"].items()}
+                self.assertEqual(results[str(first)]["parent"]["id"], second)
+                self.assertIsNone(results[str(first)]["parent"]["parent"])
+                self.assertIsNone(results[str(second)]["parent"]["parent"])
+                self.assertEqual(self.client.get("/api/divisions/?limit=1000").status_code, 200)
+                detail = self.client.get(f"/api/divisions/{second}/").json()
+                self.assertEqual((detail["parent"]["id"], detail["parent"]["parent"]), (first, None))
+
+
+class OrganizationTreeTest(TestCase):
+    def setUp(self):
+        self.acme = Organization.objects.create(name="Acme")
+        self.engineer = engineer = Position.objects.create(name="Engineer")
+        for first_name in ("Ada", "Alan"):
+            Employee.objects.create(first_name=first_name, last_name="X").positions.set([engineer])
+        self.root = Division.objects.create(name="Root", organization=self.acme)
+        self.child = Division.objects.create(name="Child", organization=self.acme, parent=self.root)
+        Division.objects.create(name="Leaf", organization=self.acme, parent=self.child).positions.set([engineer])
+        Division.objects.create(name="Other root", organization=self.acme)
+        Division.rebuild_paths()
+
+    def tree(self, query=""):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/organizations/{self.acme.id}/tree/{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertLessEqual(len(queries), 6)
+        return response.json()["divisions"]
+
+    def test_nested_tree(self):
+        root, other = self.tree()
+        self.assertEqual((root["name"], other["name"], other["children"]), ("Root", "Other root", []))
+        leaf = root["children"][0]["children"][0]
+        self.assertEqual((leaf["name"], leaf["positions"]),
+                         ("Leaf", [{"id": self.engineer.id, "name": "Engineer", "employee_count": 2}]))
+
+    def test_root_and_max_depth_load_lazily(self):
+        root, other = self.tree("?max_depth=0")
+        self.assertEqual((root["children"], other["children"]), (None, []))
+        (child,) = self.tree(f"?root={self.child.id}&max_depth=1")
+        self.assertEqual([node["name"] for node in child["children"]], ["Leaf"])
+        self.assertEqual(self.client.get(f"/api/organizations/{self.acme.id}/tree/?max_depth=-1").status_code, 400)
+
+
+class EffectivePermissionTest(TestCase):
+    def setUp(self):
+        self.engineer = Position.objects.create(name="Engineer")
+        self.manager = Position.objects.create(name="Manager")
+        self.employee = Employee.objects.create(first_name="Ada", last_name="Lovelace")
+        self.read = Permission.objects.create(name="read")
+        self.write = Permission.objects.create(name="write")
+        self.read.positions.set([self.engineer, self.manager])
+        self.write.positions.set([self.manager])
+
+    def granted(self):
+        return [permission["name"] for permission in
+                self.client.get(f"/api/employees/{self.employee.id}/permissions/").json()]
+
+    def test_index_follows_position_changes(self):
+        self.assertEqual(self.granted(), [])
+        self.employee.positions.add(self.engineer)
+        self.assertEqual(self.granted(), ["read"])
+        self.manager.employees.add(self.employee)
+        self.assertEqual(self.granted(), ["read", "write"])
+        self.write.positions.clear()
+        self.assertEqual(self.granted(), ["read"])
+        self.engineer.delete()
+        self.manager.employees.clear()
+        self.assertEqual(self.granted(), [])
+
+    def test_batch_check(self):
+        self.employee.positions.set([self.engineer])
+        checks = [{"employee_id": self.employee.id, "permission_id": self.read.id},
+                  {"employee_id": self.employee.id, "permission_id": self.write.id}]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/permissions/check/", checks, content_type="application/json")
+        self.assertEqual([result["allowed"] for result in response.json()], [True, False])
+        self.assertEqual(len(queries), 1)
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.acme, self.other = Organization.objects.create(name="Acme"), Organization.objects.create(name="Other")
+        self.engineer, self.manager = Position.objects.create(name="Engineer"), Position.objects.create(name="Manager")
+
+    def write(self, method, url, data=""):
+        response = getattr(self.client, method)(url, data, content_type="application/json")
+        self.assertLess(response.status_code, 300, response.content)
+        return response.json()
+
+    def stats(self, resource, pk, *fields):
+        data = self.client.get(f"/api/{resource}/{pk}/stats/").json()
+        return [data[field] for field in fields]
+
+    def test_counters_follow_writes(self):
+        root = self.write("post", "/api/divisions/", {"name": "Root", "organization_id": self.acme.id,
+                                                     "positions_ids": [self.engineer.id]})["id"]
+        child = self.write("post", "/api/divisions/", {"name": "Child", "organization_id": self.acme.id,
+                                                      "positions_ids": [self.engineer.id, self.manager.id]})["id"]
+        ada = self.write("post", "/api/employees/", {"first_name": "Ada", "last_name": "Lovelace",
+                                                    "positions_ids": [self.engineer.id]})["id"]
+        alan = self.write("post", "/api/employees/", {"first_name": "Alan", "last_name": "Turing",
+                                                     "positions_ids": [self.engineer.id, self.manager.id]})["id"]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.stats("organizations", self.acme.id, "division_count", "headcount"), [2, 2])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.stats("divisions", child, "position_count", "headcount"), [2, 2])
+        self.assertEqual(self.stats("positions", self.engineer.id, "employee_count", "division_count"), [2, 2])
+
+        self.write("put", f"/api/employees/{alan}/", {"positions_ids": []})
+        self.assertEqual(self.stats("organizations", self.acme.id, "headcount"), [1])
+        self.assertEqual(self.stats("divisions", child, "headcount"), [1])
+
+        self.write("put", f"/api/divisions/{child}/", {"organization_id": self.other.id,
+                                                       "positions_ids": [self.engineer.id]})
+        self.assertEqual(self.stats("organizations", self.acme.id, "division_count", "headcount"), [1, 1])
+        self.assertEqual(self.stats("organizations", self.other.id, "division_count", "headcount"), [1, 1])
+
+        self.write("delete", f"/api/employees/{ada}/")
+        self.assertEqual(self.stats("organizations", self.other.id, "headcount"), [0])
+        self.engineer.delete()
+        self.assertEqual(self.stats("divisions", root, "position_count", "headcount"), [0, 0])
+        self.assertEqual(self.client.get(f"/api/positions/{self.engineer.id}/stats/").status_code, 404)
+
+    def test_bulk_rows_with_explicit_ids_get_counters(self):
+        self.write("post", "/api/positions/bulk/", [{"id": 5000, "name": "Designer"}, {"name": "Tester"}])
+        self.write("post", "/api/divisions/bulk/", [{"id": 6000, "name": "Design", "organization_id": self.acme.id,
+                                                     "positions_ids": [5000]}])
+        self.assertEqual(self.stats("positions", 5000, "division_count"), [1])
+        self.assertEqual(self.stats("positions", Position.objects.get(name="Tester").id, "division_count"), [0])
+        self.assertEqual(self.stats("divisions", 6000, "position_count"), [1])
+        self.assertEqual(self.stats("organizations", self.acme.id, "division_count"), [1])
+        self.assertFalse(any(counters.rebuild().values()))
+
+    def test_rebuild_reports_drift(self):
+        division = Division.objects.create(name="Root", organization=self.acme)
+        division.positions.set([self.engineer])
+        Employee.objects.create(first_name="Ada", last_name="Lovelace").positions.set([self.engineer])
+        OrganizationCounters.objects.filter(pk=self.acme.id).update(headcount=5)
+        OrganizationMember.objects.all().delete()
+
+        out = StringIO()
+        call_command("rebuild_counters", stdout=out)
+        self.assertIn(", 2 fixed", out.getvalue())
+        self.assertEqual(self.stats("organizations", self.acme.id, "headcount"), [1])
+        self.assertFalse(any(counters.rebuild().values()))
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        organization = Organization.objects.create(name="Acme")
+        self.position = Position.objects.create(name="Engineer")
+        self.root = Division.objects.create(name="Root", organization=organization)
+        self.root.positions.set([self.position])
+        self.child = Division.objects.create(name="Child", organization=organization, parent=self.root)
+        Division.rebuild_paths()
+        self.employee = Employee.objects.create(first_name="Ada", last_name="Lovelace")
+        self.employee.positions.set([self.position])
+
+    def put(self, url, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put(url, data, content_type="application/json")
+
+    def test_hit_skips_serialization(self):
+        first = self.client.get(f"/api/divisions/{self.child.id}/")
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(f"/api/divisions/{self.child.id}/")
+        # остаётся только проверка версии строки для ETag
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(first.content, second.content)
+
+    def test_position_rename_evicts_embedding_responses(self):
+        urls = [f"/api/divisions/{self.child.id}/", "/api/employees/", f"/api/employees/{self.employee.id}/"]
+        for url in urls:
+            self.client.get(url)
+        self.put(f"/api/positions/{self.position.id}/", {"name": "Senior Engineer"})
+
+        child = self.client.get(urls[0]).json()
+        self.assertEqual(child["parent"]["positions"], [{"id": self.position.id, "name": "Senior Engineer"}])
+        self.assertEqual(self.client.get(urls[1]).json()["results"][0]["positions"][0]["name"], "Senior Engineer")
+        self.assertEqual(self.client.get(urls[2]).json()["positions"][0]["name"], "Senior Engineer")
+
+    def test_keys_fit_memcached(self):
+        url = "/api/employees/?name__icontains=" + "a%20" * 200
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", CacheKeyWarning)
+            for _ in range(2):
+                self.assertEqual(self.client.get(url).status_code, 200)
+                self.assertEqual(self.client.get("/api/employees/").status_code, 200)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.position = Position.objects.create(name="Engineer")
+        self.employee = Employee.objects.create(first_name="Ada", last_name="Lovelace")
+        self.employee.positions.set([self.position])
+
+    def test_not_modified(self):
+        # Объект — версия строки, список — версия списков ресурса: по запросу по ключу, без агрегатов по таблице
+        for url in (f"/api/employees/{self.employee.id}/", "/api/employees/"):
+            etag = self.client.get(url)["ETag"]
+            # ETag не зависит от кэша процесса: другой воркер отдаст тот же
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(queries), 1)
+
+    def test_list_etag_follows_writes(self):
+        etag = self.client.get("/api/employees/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/employees/", {"first_name": "Grace", "last_name": "Hopper"},
+                             content_type="application/json")
+        response = self.client.get("/api/employees/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/employees/{self.employee.id}/")
+        self.assertEqual(self.client.get("/api/employees/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_embedded_change_refreshes_etag(self):
+        urls = (f"/api/employees/{self.employee.id}/", "/api/employees/")
+        etags = [self.client.get(url)["ETag"] for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f"/api/positions/{self.position.id}/", {"name": "Senior Engineer"},
+                            content_type="application/json")
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+class FieldSelectionTest(TestCase):
+    def setUp(self):
+        organization = Organization.objects.create(name="Acme", description="Corp")
+        self.root = Division.objects.create(name="Root", organization=organization)
+        self.child = Division.objects.create(name="Child", organization=organization, parent=self.root)
+        self.grandchild = Division.objects.create(name="Grandchild", organization=organization, parent=self.child)
+
+    def test_sparse_fields_skip_relations(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/divisions/?fields=id,name")
+        self.assertEqual(response.json()["results"][0], {"id": self.root.id, "name": "Root"})
+        sql = " ".join(query["sql"] for query in queries if "organization_division" in query["sql"])
+        self.assertNotIn("organization_organization", sql)
+        self.assertNotIn("positions", sql)
+        self.assertNotIn('"path"', sql)
+
+    def test_nested_fields_expand_and_depth(self):
+        url = f"/api/divisions/{self.grandchild.id}/"
+        data = self.client.get(url + "?fields=id,organization.name&expand=parent&depth=1").json()
+        self.assertEqual(data["organization"], {"name": "Acme"})
+        self.assertEqual(data["parent"]["name"], "Child")
+        self.assertNotIn("parent", data["parent"])
+
+    def test_unknown_fields_rejected(self):
+        response = self.client.get("/api/divisions/?fields=id,bogus&expand=name&depth=9")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {"fields", "expand", "depth"})
+
+
+@override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+class FastSerializationParityTest(TestCase):
+    urls = (
+        "/api/organizations/", "/api/divisions/", "/api/positions/", "/api/employees/", "/api/permissions/",
+        "/api/divisions/?limit=2", "/api/divisions/?fields=name,parent.name,positions.id",
+        "/api/divisions/?fields=id&expand=parent,organization&depth=1", "/api/divisions/?stream=1",
+        "/api/employees/?stream=ndjson", "/api/changes/?stream=1",
+    )
+
+    def setUp(self):
+        organization = Organization.objects.create(name="Рога и копыта", description=None)
+        positions = [Position.objects.create(name=name) for name in ("Инженер", "Engineer \"2\"")]
+        parent = None
+        for depth in range(7):
+            parent = Division.objects.create(name=f"Уровень {depth}", organization=organization, parent=parent)
+            parent.positions.set(positions[:depth % 3])
+        Division.rebuild_paths()
+        self.client.get(f"/api/divisions/{parent.id}/subtree/")
+        for i in range(3):
+            employee = Employee.objects.create(first_name=f"Иван {i}", last_name="O'Neil")
+            employee.positions.set(positions)
+            Permission.objects.create(name=f"perm {i}", description="").positions.set(positions[1:])
+        self.client.post("/api/positions/", {"name": "Tracked"}, content_type="application/json")
+        self.urls += (f"/api/divisions/{Division.objects.get(depth=0).id}/subtree/",
+                      f"/api/employees/{employee.id}/permissions/")
+
+    def content(self, url, fast):
+        with override_settings(ORGANIZATION_SERIALIZER={"FAST": fast}):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content) if response.streaming else response.content
+
+    def test_byte_identical_to_marshmallow(self):
+        for schema_class in (DivisionSchema, EmployeeSchema, PermissionSchema, ChangeSchema):
+            self.assertIsNotNone(serializers.compile_schema(schema_class()))
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.content(url, True), self.content(url, False))
+
+    def test_orjson_is_equivalent(self):
+        with override_settings(ORGANIZATION_SERIALIZER={"ORJSON": True}):
+            fast = self.client.get("/api/divisions/").content
+        self.assertEqual(json.loads(fast), json.loads(self.content("/api/divisions/", False)))
+
+
+class AtomicWriteTest(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(name="Acme")
+        self.position = Position.objects.create(name="Engineer")
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type="application/json")
+
+    def test_conflicts_are_409(self):
+        self.assertEqual(self.post("/api/organizations/", {"name": "Acme"}).status_code, 409)
+        response = self.post("/api/organizations/", {"id": self.organization.id, "name": "Other"})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Organization.objects.get().name, "Acme")
+
+    def test_failed_write_leaves_no_partial_state(self):
+        root = self.post("/api/divisions/", {"name": "Root", "organization_id": self.organization.id,
+                                             "positions_ids": [self.position.id]}).json()
+        child = self.post("/api/divisions/", {"name": "Child", "organization_id": self.organization.id,
+                                              "parent_id": root["id"]}).json()
+        response = self.client.put(f"/api/divisions/{root['id']}/", {"name": "Moved", "parent_id": child["id"]},
+                                   content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        root = Division.objects.get(pk=root["id"])
+        self.assertEqual((root.name, root.parent_id, list(root.positions.all())), ("Root", None, [self.position]))
+
+    def test_create_returns_the_object(self):
+        parent = Division.objects.create(name="Root", organization=self.organization)
+        parent.update_path()
+        parent.positions.set([self.position])
+        # Ответ читается одним запросом с related, как у GET объекта, а не связями по одной
+        for url, data, expected in (("/api/divisions/", {"name": "Child", "organization_id": self.organization.id,
+                                                         "parent_id": parent.id, "positions_ids": [self.position.id]},
+                                     25),
+                                    ("/api/positions/", {"name": "Designer"}, 11)):
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    created = self.post(url, data)
+                self.assertEqual(len([query for query in queries if "SAVEPOINT" not in query["sql"]]), expected)
+                self.assertEqual(created.status_code, 201)
+                self.assertEqual(created.json(), self.client.get(f"{url}{created.json()['id']}/").json())
+
+    def test_unrelated_missing_object_is_not_404(self):
+        # 404 — только для объекта, удалённого до условной записи (ObjectDeleted), а не для любого DoesNotExist
+        with mock.patch.object(Division, "update_path", side_effect=Division.DoesNotExist), \
+                self.assertRaises(Division.DoesNotExist):
+            self.post("/api/divisions/", {"name": "Root", "organization_id": self.organization.id})
+        self.assertFalse(Division.objects.exists())
+
+    def test_references_resolved_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post("/api/employees/", {"first_name": "Ada", "last_name": "Lovelace",
+                                                     "positions_ids": [self.position.id, 0]})
+        self.assertEqual(response.json(), {"positions_ids": ["Some provided Position IDs do not exist."]})
+        self.assertEqual(len([query for query in queries if "SAVEPOINT" not in query["sql"]]), 1)
+
+
+class OptimisticWriteTest(TestCase):
+    def setUp(self):
+        self.position = Position.objects.create(name="Engineer")
+        self.employee = self.client.post("/api/employees/", {"first_name": "Ada", "last_name": "Lovelace",
+                                                             "positions_ids": [self.position.id]},
+                                         content_type="application/json").json()
+        self.url = f"/api/employees/{self.employee['id']}/"
+
+    def write(self, method, data, etag=None):
+        headers = {"HTTP_IF_MATCH": etag} if etag else {}
+        return getattr(self.client, method)(self.url, data, content_type="application/json", **headers)
+
+    def test_stale_etag_is_412(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.write("patch", {"first_name": "Augusta"}, etag)
+        self.assertEqual(response.status_code, 200)
+        # Ответ несёт ETag новой версии: следующая запись обходится без GET
+        self.assertEqual(response["ETag"], self.client.get(self.url)["ETag"])
+        self.assertEqual(self.write("patch", {"first_name": "Countess"}, etag).status_code, 412)
+        self.assertEqual(self.write("patch", {"first_name": "Countess"}, response["ETag"]).status_code, 200)
+        self.assertEqual(Employee.objects.get().first_name, "Countess")
+
+    def test_patch_keeps_omitted_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.write("patch", {"last_name": "King"}, self.client.get(self.url)["ETag"])
+        update = next(query["sql"] for query in queries if query["sql"].startswith("UPDATE \"organization_employee\""))
+        self.assertIn('"version" IN (', update.split("WHERE")[1])
+        self.assertNotIn("first_name", update)
+        employee = Employee.objects.get()
+        self.assertEqual((employee.first_name, employee.last_name, list(employee.positions.all())),
+                         ("Ada", "King", [self.position]))
+        # PUT, как и раньше, заменяет связи целиком
+        self.write("put", {"last_name": "Lovelace"})
+        self.assertFalse(employee.positions.exists())
+
+    def test_conditional_write_reads_no_version(self):
+        version = Employee.objects.get().version
+        self.assertEqual(self.client.get(self.url)["ETag"], f'"{self.employee["id"]}:{version}"')
+        other = Position.objects.create(name="Manager")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.write("put", {"last_name": "King", "positions_ids": [other.id]},
+                                  f'"{self.employee["id"]}:{version}"')
+        self.assertEqual(response.status_code, 200)
+        # Версия не читается ни до UPDATE, ни после: ETag ответа — записанная версия, хотя связи тоже менялись
+        self.assertFalse([query for query in queries
+                          if query["sql"].startswith('SELECT "organization_employee"."version"')])
+        self.assertEqual(response["ETag"], f'"{self.employee["id"]}:{version + 1}"')
+        self.assertEqual(response["ETag"], self.client.get(self.url)["ETag"])
+        self.assertEqual(self.write("patch", {"last_name": "Lovelace"}, f"W/{response['ETag']}").status_code, 412)
+
+    def test_if_unmodified_since(self):
+        last_modified = self.client.get(self.url)["Last-Modified"]
+        response = self.client.patch(self.url, {"last_name": "King"}, content_type="application/json",
+                                     HTTP_IF_UNMODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], self.client.get(self.url)["ETag"])
+        Employee.objects.update(updated_at=timezone.now() + timedelta(seconds=5))
+        response = self.client.patch(self.url, {"last_name": "Lovelace"}, content_type="application/json",
+                                     HTTP_IF_UNMODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 412)
+
+    def test_etag_ignores_query_string(self):
+        etag = self.client.get(f"{self.url}?fields=id")["ETag"]
+        self.assertEqual(etag, self.client.get(self.url)["ETag"])
+        response = self.client.patch(f"{self.url}?fields=first_name", {"first_name": "Augusta"},
+                                     content_type="application/json", HTTP_IF_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()), (200, {"first_name": "Augusta"}))
+        # Ответ — объект, загруженный view, с записанными полями и новыми связями
+        response = self.write("patch", {"first_name": "Countess", "positions_ids": []}, response["ETag"])
+        self.assertEqual((response.json()["first_name"], response.json()["positions"]), ("Countess", []))
+
+    def test_missed_update_tells_deleted_from_changed(self):
+        employee = Employee.objects.get()
+        context = {"condition": {"version__in": [employee.version - 1]}, "patch": True, "instance": employee}
+        with CaptureQueriesContext(connection) as queries, self.assertRaises(PreconditionFailed), \
+                transaction.atomic():
+            EmployeeSchema(context=context).load({"id": employee.id, "first_name": "Augusta"}, partial=True)
+        # Без чтения объекта: UPDATE по версии и, раз он ничего не записал, проверка, есть ли строка
+        self.assertEqual(len([query for query in queries if "SAVEPOINT" not in query["sql"]]), 2)
+        Employee.objects.all().delete()
+        with self.assertRaises(ObjectDeleted), transaction.atomic():
+            EmployeeSchema(context=dict(context, condition={"version__in": [employee.version]})).load(
+                {"id": employee.id, "first_name": "Augusta"}, partial=True)
+
+@skipUnless(connection.vendor == "postgresql", "needs concurrent transactions")
+class ConcurrentWriteTest(TransactionTestCase):
+    threads = 8
+
+    def run_concurrently(self, request):
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+
+        def write(i):
+            client = Client()
+            barrier.wait()
+            statuses.append(request(client, i).status_code)
+            connections.close_all()
+
+        workers = [threading.Thread(target=write, args=(i,)) for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return sorted(statuses)
+
+    def test_racing_creates(self):
+        statuses = self.run_concurrently(lambda client, i: client.post(
+            "/api/organizations/", {"name": "Acme"}, content_type="application/json"))
+        self.assertEqual(statuses, [201] + [409] * (self.threads - 1))
+        organization = Organization.objects.get()
+
+        positions = [Position.objects.create(name=f"Position {i}").id for i in range(3)]
+        statuses = self.run_concurrently(lambda client, i: client.post(
+            "/api/divisions/", {"name": f"Division {i}", "organization_id": organization.id,
+                                "positions_ids": positions}, content_type="application/json"))
+        self.assertEqual(statuses, [201] * self.threads)
+        self.assertEqual(Division.positions.through.objects.count(), self.threads * len(positions))
+        self.assertEqual(Change.objects.filter(resource="divisions").count(), self.threads)
+        self.assertEqual(OrganizationCounters.objects.get().division_count, self.threads)
+        self.assertFalse(any(counters.rebuild().values()))
+
+    def test_racing_permission_rebuilds(self):
+        position = Position.objects.create(name="Engineer")
+        employee = Employee.objects.create(first_name="Ada", last_name="Lovelace")
+        permission = Permission.objects.create(name="deploy")
+
+        def write(client, i):
+            # Запись сотрудника и запись права пересобирают одну и ту же пару (сотрудник, право)
+            url = f"/api/employees/{employee.id}/" if i % 2 else f"/api/permissions/{permission.id}/"
+            return client.patch(url, {"positions_ids": [position.id]}, content_type="application/json")
+
+        self.assertEqual(self.run_concurrently(write), [200] * self.threads)
+        self.assertEqual(list(access.EffectivePermission.objects.values_list("employee_id", "permission_id")),
+                         [(employee.id, permission.id)])
+
+    def test_no_lost_updates(self):
+        organization = Organization.objects.create(name="Acme", description="")
+        url = f"/api/organizations/{organization.id}/"
+
+        def append(client, i):
+            # Чтение-изменение-запись без блокировок: при 412 — повтор с новой версией
+            while True:
+                current = client.get(url)
+                response = client.patch(url, {"description": current.json()["description"] + f"{i};"},
+                                        content_type="application/json", HTTP_IF_MATCH=current["ETag"])
+                if response.status_code != 412:
+                    return response
+
+        self.assertEqual(self.run_concurrently(append), [200] * self.threads)
+        organization.refresh_from_db()
+        self.assertEqual(sorted(organization.description.split(";")[:-1], key=int),
+                         [str(i) for i in range(self.threads)])
+
+
+@override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+class ListFilterTest(TestCase):
+    def setUp(self):
+        self.acme, other = Organization.objects.create(name="Acme"), Organization.objects.create(name="Other")
+        self.engineer, manager = Position.objects.create(name="Engineer"), Position.objects.create(name="Manager")
+        self.root = Division.objects.create(name="Root", organization=self.acme)
+        self.child = Division.objects.create(name="Child", organization=self.acme, parent=self.root)
+        Division.objects.create(name="Elsewhere", organization=other)
+        self.child.positions.set([self.engineer])
+        names = [("Ada", "Lovelace"), ("Alan", "Turing"), ("Grace", "Hopper"), ("Alan", "Kay"), ("Edsger", "Dijkstra")]
+        for i, (first_name, last_name) in enumerate(names):
+            employee = Employee.objects.create(first_name=first_name, last_name=last_name)
+            employee.positions.set([self.engineer if i % 2 else manager])
+        Permission.objects.create(name="deploy", description="Release builds to production servers")
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [item["id"] for item in response.json()["results"]]
+
+    def names(self, url):
+        results, after = [], ""
+        while True:
+            page = self.client.get(url + after).json()
+            results += [item["last_name"] for item in page["results"]]
+            if not page["next"]:
+                return results
+            after = "&after=" + page["next"]
+
+    def test_filters(self):
+        self.assertEqual(self.ids(f"/api/divisions/?organization_id={self.acme.id}&parent_id=null"), [self.root.id])
+        self.assertEqual(self.ids(f"/api/divisions/?parent_id={self.root.id}&position_id={self.engineer.id}"),
+                         [self.child.id])
+        self.assertEqual(len(self.ids(f"/api/employees/?position_id={self.engineer.id}")), 2)
+        self.assertEqual(len(self.ids("/api/employees/?name__icontains=AL")), 2)
+        self.assertEqual(self.client.get("/api/divisions/?parent_id=x").status_code, 400)
+
+    def test_ordering_pages_through_keyset(self):
+        self.assertEqual(self.names("/api/employees/?limit=2&ordering=last_name"),
+                         ["Dijkstra", "Hopper", "Kay", "Lovelace", "Turing"])
+        self.assertEqual(self.names("/api/employees/?limit=2&ordering=-first_name,last_name"),
+                         ["Hopper", "Dijkstra", "Kay", "Turing", "Lovelace"])
+        after = self.client.get("/api/employees/?limit=2&ordering=last_name").json()["next"]
+        self.assertEqual(self.client.get(f"/api/employees/?after={after}").status_code, 400)
+        self.assertEqual(self.client.get("/api/employees/?ordering=version").status_code, 400)
+
+    def test_full_text_search(self):
+        self.assertEqual(len(self.ids("/api/employees/?search=alan")), 2)
+        self.assertEqual(len(self.ids("/api/permissions/?search=production")), 1)
+        self.assertEqual(self.client.get("/api/positions/?search=x").status_code, 400)
+
+
+class EmployeeSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        engineer, designer = Position.objects.create(name="Backend Engineer"), Position.objects.create(name="Designer")
+        organization = Organization.objects.create(name="Acme")
+        Division.objects.create(name="Research Lab", organization=organization).positions.set([engineer])
+        for first_name, last_name, position in (("Ada", "Lovelace", engineer), ("Adam", "Smith", designer),
+                                                ("Linus", "Adams", designer), ("Grace", "Hopper", engineer)):
+            Employee.objects.create(first_name=first_name, last_name=last_name).positions.set([position])
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, **params):
+        response = self.client.get("/api/employees/search/", dict(params, q=query))
+        self.assertEqual(response.status_code, 200)
+        return [(item["last_name"], item["rank"]) for item in response.json()["results"]]
+
+    def test_ranking(self):
+        # Начало ФИО в любом порядке — по совпавшей строке: «ada lovelace», «adam smith», «adams linus»
+        self.assertEqual(self.search("Ada"), [("Lovelace", 3), ("Smith", 3), ("Adams", 3)])
+        self.assertEqual(self.search("hopper  GR"), [("Hopper", 3)])
+        self.assertEqual(self.search("ada", limit=1), [("Lovelace", 3)])
+        # Подразделение с должностью сотрудника, слова из разных полей
+        self.assertEqual(self.search("research"), [("Hopper", 1), ("Lovelace", 1)])
+        self.assertEqual(self.search("ada eng"), [("Lovelace", 1)])
+
+    def test_results_carry_context_in_constant_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.client.get("/api/employees/search/?q=lovelace&limit=1").json()["results"][0]
+        self.assertEqual(result["positions"], [{"id": Position.objects.get(name="Backend Engineer").id,
+                                                "name": "Backend Engineer"}])
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(self.client.get("/api/employees/search/?q=").status_code, 400)
+        self.assertEqual(self.client.get("/api/employees/search/?q=ada&limit=500").status_code, 400)
+
+    def test_follows_writes(self):
+        self.assertEqual(self.search("research"), [("Hopper", 1), ("Lovelace", 1)])
+        hopper = Employee.objects.get(last_name="Hopper")
+        division = Division.objects.get(name="Research Lab")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f"/api/employees/{hopper.id}/", {"positions_ids": [Position.objects.get(name="Designer").id]},
+                            content_type="application/json")
+            self.client.patch(f"/api/divisions/{division.id}/", {"name": "Design Lab"}, content_type="application/json")
+        self.assertEqual(self.search("grace design"), [("Hopper", 1)])
+        self.assertEqual(self.search("design lab"), [("Lovelace", 1)])
+        self.assertEqual(self.search("research"), [])
+
+
+@skipUnless(connection.vendor == "postgresql", "EXPLAIN (FORMAT JSON) is PostgreSQL-only")
+@override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+class QueryPlanTest(TestCase):
+    """Запросы горячих путей на реалистичных объёмах не должны читать большие таблицы целиком"""
+    # Таблица считается большой от стольких строк: на маленьких seq scan — нормальный выбор планировщика
+    large_table_rows = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        organizations = Organization.objects.bulk_create([Organization(name=f"Org {i}") for i in range(20)])
+        positions = Position.objects.bulk_create([Position(name=f"Position {i}") for i in range(200)])
+        # Подразделения — лес глубиной 4: у каждого узла до 5 дочерних
+        divisions = Division.objects.bulk_create(
+            [Division(name=f"Division {i}", organization=organizations[i % 20]) for i in range(5000)])
+        for i, division in enumerate(divisions[20:], start=20):
+            division.parent = divisions[(i - 20) // 5]
+        Division.objects.bulk_update(divisions[20:], ["parent"], batch_size=2000)
+        Division.rebuild_paths()
+        employees = Employee.objects.bulk_create(
+            [Employee(first_name=f"First{i % 700}", last_name=f"Last{i % 3000}") for i in range(10000)],
+            batch_size=2000)
+        Employee.positions.through.objects.bulk_create(
+            [Employee.positions.through(employee_id=employee.pk, position_id=positions[(i + k) % 200].pk)
+             for i, employee in enumerate(employees) for k in range(2)], batch_size=2000)
+        permissions = Permission.objects.bulk_create([Permission(name=f"Permission {i}") for i in range(400)])
+        Permission.positions.through.objects.bulk_create(
+            [Permission.positions.through(permission_id=permission.pk, position_id=positions[i % 200].pk)
+             for i, permission in enumerate(permissions)])
+        Division.positions.through.objects.bulk_create(
+            [Division.positions.through(division_id=division.pk, position_id=positions[i % 200].pk)
+             for i, division in enumerate(divisions)], batch_size=2000)
+        access.refresh_employees([employee.pk for employee in employees])
+        Change.objects.bulk_create([Change(resource="employees", object_id=employee.pk, action=Change.UPDATED)
+                                    for employee in employees], batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        cls.division = divisions[100]
+        cls.employee = employees[1234]
+        cls.permission = permissions[7]
+
+    def large_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples >= %s",
+                           [self.large_table_rows])
+            return {row[0] for row in cursor.fetchall()}
+
+    def full_scans(self, sql, params, large):
+        """Seq Scan по большим таблицам в плане запроса; полный проход агрегата без условия допустим
+        (COUNT/MAX для ETag списка)"""
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans = []
+
+        def walk(node, parent):
+            if node["Node Type"] == "Seq Scan" and node["Relation Name"] in large:
+                if not (parent and parent["Node Type"] == "Aggregate" and "Filter" not in node):
+                    scans.append(node["Relation Name"])
+            for child in node.get("Plans", ()):
+                walk(child, node)
+
+        walk(plan[0]["Plan"], None)
+        return scans
+
+    def assertIndexed(self, label, queries):
+        large = self.large_tables()
+        for sql, params in queries:
+            if sql.lstrip("(").startswith("SELECT"):
+                scans = self.full_scans(sql, params, large)
+                self.assertFalse(scans, f"{label}: seq scan on {scans}\n{sql}")
+
+    def test_endpoints(self):
+        since = Change.objects.order_by("-seq").values_list("seq", flat=True)[50]
+        requests = [
+            ("get", "/api/divisions/"), ("get", "/api/divisions/?after=" + encode_cursor(2500)),
+            ("get", f"/api/divisions/{self.division.id}/"), ("get", f"/api/divisions/{self.division.id}/subtree/"),
+            ("get", f"/api/divisions/{self.division.id}/ancestors/"), ("get", "/api/employees/"),
+            ("get", "/api/employees/?after=" + encode_cursor(self.employee.id)),
+            ("get", f"/api/employees/{self.employee.id}/"), ("get", f"/api/employees/{self.employee.id}/permissions/"),
+            ("get", "/api/permissions/"), ("get", f"/api/permissions/{self.permission.id}/"),
+            ("get", f"/api/changes/?since={since}"),
+            ("get", f"/api/divisions/?organization_id={self.division.organization_id}&parent_id={self.division.id}"),
+            ("get", "/api/employees/?search=Last2999"), ("get", "/api/permissions/?search=Permission"),
+            ("get", "/api/employees/search/?q=first69"), ("get", "/api/employees/search/?q=last2999 f"),
+            ("get", "/api/employees/search/?q=first69 173"),
+            ("get", "/api/employees/?ordering=last_name,first_name"),
+            ("post", "/api/permissions/check/", [{"employee_id": self.employee.id, "permission_id": self.permission.id}]),
+        ]
+        for method, url, *body in requests:
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                if body:
+                    response = self.client.post(url, body[0], content_type="application/json")
+                else:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIndexed(url, [(query["sql"], None) for query in queries])
+
+    def test_filters(self):
+        filters = {
+            "employee by name": Employee.objects.filter(last_name="Last42", first_name="First42"),
+            "employee by last name prefix": Employee.objects.filter(last_name__startswith="Last29"),
+            "employee by first name prefix": Employee.objects.filter(first_name__startswith="First69"),
+            "child divisions": Division.objects.filter(organization_id=self.division.organization_id,
+                                                       parent_id=self.division.id),
+            "root divisions": Division.objects.filter(organization_id=self.division.organization_id,
+                                                      parent__isnull=True),
+        }
+        for label, queryset in filters.items():
+            with self.subTest(label):
+                self.assertIndexed(label, [queryset.query.sql_with_params()])
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        self.acme = Organization.objects.create(name="Acme", description="Rockets")
+        engineer, manager = Position.objects.create(name="Engineer"), Position.objects.create(name="Manager")
+        root = Division.objects.create(name="Root", organization=self.acme)
+        child = Division.objects.create(name="Child", organization=self.acme, parent=root)
+        Division.objects.create(name="Leaf", organization=self.acme, parent=child).positions.set([engineer])
+        root.positions.set([manager])
+        for first_name, position in (("Ada", engineer), ("Alan", manager)):
+            Employee.objects.create(first_name=first_name, last_name="X").positions.set([position])
+        Permission.objects.create(name="deploy").positions.set([engineer])
+
+    def export(self):
+        response = self.client.get(f"/api/organizations/{self.acme.id}/export/")
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_round_trip_remaps_ids(self):
+        data = self.export()
+        response = self.client.post("/api/organizations/import/?name=Acme copy", data,
+                                    content_type="application/gzip")
+        self.assertEqual(response.status_code, 201, response.content)
+        result = response.json()
+        self.assertEqual(result["counts"], {"organizations": 1, "positions": 2, "permissions": 1,
+                                            "divisions": 3, "employees": 2})
+
+        copy = Organization.objects.get(pk=result["organization_id"])
+        self.assertEqual((copy.name, copy.description), ("Acme copy", "Rockets"))
+        leaf = Division.objects.get(organization=copy, name="Leaf")
+        self.assertEqual([Division.objects.get(pk=pk).name for pk in leaf.ancestor_ids()], ["Root", "Child"])
+        self.assertEqual(Division.rebuild_paths(Division.objects.filter(organization=copy)), 0)
+        engineer = leaf.positions.get()
+        self.assertNotEqual(engineer.pk, Position.objects.filter(name="Engineer").first().pk)
+        ada = engineer.employees.get()
+        self.assertEqual(ada.first_name, "Ada")
+        self.assertEqual([p.name for p in Permission.objects.filter(effective_grants__employee=ada)], ["deploy"])
+
+    def test_rejects_taken_name_and_garbage(self):
+        data = self.export()
+        response = self.client.post("/api/organizations/import/", data, content_type="application/gzip")
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post("/api/organizations/import/", b"not gzip", content_type="application/gzip")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Organization.objects.count(), 1)
+
+
+@override_settings(ORGANIZATION_PURGE={"THREAD": False, "BATCH_SIZE": 2})
+class PurgeTest(TestCase):
+    def setUp(self):
+        self.acme, other = Organization.objects.create(name="Acme"), Organization.objects.create(name="Other")
+        engineer = Position.objects.create(name="Engineer")
+        self.root = Division.objects.create(name="Root", organization=self.acme)
+        self.child = Division.objects.create(name="Child", organization=self.acme, parent=self.root)
+        for i in range(3):
+            Division.objects.create(name=f"Leaf {i}", organization=self.acme, parent=self.child).positions.set([engineer])
+        self.sibling = Division.objects.create(name="Sibling", organization=self.acme, parent=self.root)
+        # Подразделение другой организации под удаляемым
+        self.guest = Division.objects.create(name="Guest", organization=other, parent=self.child)
+        self.guest_child = Division.objects.create(name="Guest child", organization=other, parent=self.guest)
+        Division.rebuild_paths()
+
+    def test_organization_purge_in_background(self):
+        response = self.client.delete(f"/api/organizations/{self.acme.id}/")
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job["status"], job["total"]), ("pending", 6))
+        self.assertEqual(self.client.delete(f"/api/organizations/{self.acme.id}/").json()["id"], job["id"])
+
+        self.assertTrue(purge.run(job["id"]))
+        self.assertFalse(purge.run(job["id"]))
+        status = self.client.get(response["Location"]).json()
+        self.assertEqual((status["status"], status["deleted"]), ("done", 6))
+        self.assertFalse(Organization.objects.filter(pk=self.acme.id).exists())
+        self.assertFalse(Division.positions.through.objects.exists())
+        self.assertEqual(Change.objects.filter(resource="divisions", action=Change.DELETED).count(), 6)
+        self.guest_child.refresh_from_db()
+        self.assertEqual(self.guest_child.path, f"/{self.guest.id}/{self.guest_child.id}/")
+        self.assertIsNone(Division.objects.get(pk=self.guest.id).parent_id)
+        self.assertEqual(self.client.get("/api/jobs/0/").status_code, 404)
+
+    def test_division_subtree_purge(self):
+        response = self.client.delete(f"/api/divisions/{self.child.id}/subtree/")
+        self.assertEqual(response.status_code, 202)
+        purge.run(response.json()["id"])
+        self.assertEqual(sorted(Division.objects.filter(organization=self.acme).values_list("name", flat=True)),
+                         ["Root", "Sibling"])
+        self.assertEqual(PurgeJob.objects.get().status, PurgeJob.DONE)
+        self.assertEqual(self.acme.counters.division_count, 2)
+        self.assertEqual(self.client.delete(f"/api/divisions/{self.child.id}/subtree/").status_code, 404)
+
+
+class SeedBenchmarkTest(TestCase):
+    def test_seeds_consistent_structure(self):
+        call_command("seed_benchmark", organizations=2, divisions=30, positions=6, employees=40, permissions=5,
+                     branching=2, stdout=StringIO())
+        self.assertEqual([Organization.objects.count(), Division.objects.count(), Employee.objects.count()],
+                         [2, 60, 40])
+        self.assertEqual(Division.rebuild_paths(), 0)
+        self.assertGreater(Division.objects.order_by("-depth").first().depth, 2)
+        self.assertFalse(Employee.objects.filter(positions=None).exists())
+        through = Employee.positions.through
+        expected = set(through.objects.filter(position__permissions__isnull=False)
+                       .values_list("employee_id", "position__permissions"))
+        self.assertEqual(set(access.EffectivePermission.objects.values_list("employee_id", "permission_id")),
+                         expected)
+
+
+@override_settings(CHANGE_FEED={"POLL_INTERVAL": 0.01})
+class ChangeFeedTest(TestCase):
+    def test_events_follow_writes(self):
+        position = self.client.post("/api/positions/", {"name": "Engineer"}, content_type="application/json").json()
+        self.client.put(f"/api/positions/{position['id']}/", {"name": "Senior"}, content_type="application/json")
+        self.client.delete(f"/api/positions/{position['id']}/")
+
+        feed = self.client.get("/api/changes/?since=0&limit=2").json()
+        self.assertEqual([(event["resource"], event["action"]) for event in feed["results"]],
+                         [("positions", Change.CREATED), ("positions", Change.UPDATED)])
+        feed = self.client.get(f"/api/changes/?since={feed['next']}").json()
+        self.assertEqual([event["action"] for event in feed["results"]], [Change.DELETED])
+
+    def test_sync_feed_does_not_wait(self):
+        started = time.monotonic()
+        feed = self.client.get("/api/changes/?since=0&wait=30").json()
+        self.assertEqual(feed, {"results": [], "next": 0})
+        self.assertLess(time.monotonic() - started, 5)
+
+    async def test_long_poll_returns_empty_after_wait(self):
+        feed = (await self.async_client.get("/api/async/changes/?since=0&wait=0.05")).json()
+        self.assertEqual(feed, {"results": [], "next": 0})
+
+    def test_deleted_division_reports_children(self):
+        organization = Organization.objects.create(name="Acme", description="")
+        parent = Division.objects.create(name="Parent", organization=organization)
+        child = Division.objects.create(name="Child", organization=organization, parent=parent)
+        self.client.delete(f"/api/divisions/{parent.id}/")
+        events = self.client.get("/api/changes/?since=0").json()["results"]
+        self.assertEqual({(event["object_id"], event["action"]) for event in events},
+                         {(parent.id, Change.DELETED), (child.id, Change.UPDATED)})
+
+
+@override_settings(ORGANIZATION_CACHE={"ENABLED": False})
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        organization = Organization.objects.create(name="Acme", description="Corp")
+        self.position = Position.objects.create(name="Engineer")
+        root = Division.objects.create(name="Root", organization=organization)
+        self.division = Division.objects.create(name="Child", organization=organization, parent=root)
+        self.division.positions.set([self.position])
+        employee = Employee.objects.create(first_name="Ada", last_name="Lovelace")
+        employee.positions.set([self.position])
+        Permission.objects.create(name="read", description="").positions.set([self.position])
+        tracking.changed("positions", [self.position.pk])
+        self.paths = (
+            "organizations/", "divisions/", "positions/", "employees/", "permissions/",
+            "divisions/?limit=1", "divisions/?fields=name,parent.name", f"divisions/?ids={root.id},{self.division.id}",
+            f"divisions/?ids={root.id},0", "divisions/?after=broken", "divisions/?limit=-1",
+            f"divisions/{self.division.id}/", f"employees/{employee.id}/", f"positions/{self.position.id}/",
+            "divisions/0/", "employees/0/", "permissions/0/", "changes/?since=0", "changes/?since=x",
+        )
+
+    async def test_same_responses(self):
+        for path in self.paths:
+            with self.subTest(path=path):
+                sync = await self.async_client.get(f"/api/{path}")
+                response = await self.async_client.get(f"/api/async/{path}")
+                self.assertEqual(response.status_code, sync.status_code)
+                self.assertEqual(response.json(), sync.json())
+
+    async def test_not_modified(self):
+        for path in ("divisions/", f"divisions/{self.division.id}/"):
+            for prefix in ("/api/", "/api/async/"):
+                with self.subTest(url=f"{prefix}{path}"):
+                    etag = (await self.async_client.get(f"{prefix}{path}"))["ETag"]
+                    response = await self.async_client.get(f"{prefix}{path}", headers={"If-None-Match": etag})
+                    self.assertEqual(response.status_code, 304)
+        etag = (await self.async_client.get(f"/api/async/divisions/{self.division.id}/"))["ETag"]
+        await self.async_client.put(f"/api/divisions/{self.division.id}/", {"name": "Renamed"},
+                                    content_type="application/json")
+        response = await self.async_client.get(f"/api/async/divisions/{self.division.id}/",
+                                               headers={"If-None-Match": etag})
+        self.assertEqual((response.status_code, response.json()["name"]), (200, "Renamed"))
+
+
+@skipUnless(connection.vendor == "postgresql", "needs concurrent transactions")
+class ChangeOrderTest(TransactionTestCase):
+    def test_seq_follows_commit_order(self):
+        position = Position.objects.create(name="Engineer")
+        started, finish = threading.Event(), threading.Event()
+
+        def long_write():
+            with transaction.atomic(), tracking.collect():
+                tracking.changed("positions", [position.pk])
+                started.set()
+                finish.wait(5)
+            connections.close_all()
+
+        worker = threading.Thread(target=long_write)
+        worker.start()
+        started.wait(5)
+        self.client.post("/api/organizations/", {"name": "Acme"}, content_type="application/json")
+        # Запись, которая началась раньше и ещё идёт, получит seq после уже видимых событий: курсор её не пропустит
+        visible = feed.read(0, 10)
+        self.assertEqual([event.resource for event in visible], ["organizations"])
+        finish.set()
+        worker.join()
+        self.assertEqual([event.resource for event in feed.read(visible[-1].seq, 10)], ["positions"])
+
+    def test_foreign_keys_checked_before_log_lock(self):
+        employee = Employee.objects.create(first_name="Ada", last_name="Lovelace")
+        permission = Permission.objects.create(name="deploy")
+        locked, inserted = threading.Event(), threading.Event()
+        errors = []
+
+        def locking_write():
+            # Как update_or_create: строка права под FOR UPDATE, журнал — в конце транзакции
+            try:
+                with transaction.atomic(), tracking.collect():
+                    Permission.objects.select_for_update().get(pk=permission.pk)
+                    locked.set()
+                    inserted.wait(5)
+                    time.sleep(0.2)
+                    tracking.changed("permissions", [permission.pk])
+            except Exception as e:
+                errors.append(e)
+            connections.close_all()
+
+        worker = threading.Thread(target=locking_write)
+        worker.start()
+        locked.wait(5)
+        # Отложенная проверка внешнего ключа ждёт строку права: под блокировкой журнала это была бы взаимоблокировка
+        with transaction.atomic(), tracking.collect():
+            access.EffectivePermission.objects.create(employee=employee, permission=permission)
+            tracking.changed("employees", [employee.pk])
+            inserted.set()
+        worker.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Change.objects.count(), 2)
+
+
+
+class WebhookStub(object):
+    """Получатель webhooks на asyncio: запоминает запросы и отвечает status с keep-alive"""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.requests = []
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while request_line := await reader.readline():
+            headers = {}
+            while (line := await reader.readline()) != b"\r\n":
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers["content-length"]))
+            self.requests.append((request_line, headers, body))
+            writer.write(f"HTTP/1.1 {self.status} X\r\nContent-Length: 0\r\n\r\n".encode())
+            await writer.drain()
+        writer.close()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = "http://127.0.0.1:%d/hook" % self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *args):
+        self.server.close()
+
+
+@override_settings(ORGANIZATION_WEBHOOKS={"BATCH_SIZE": 2, "POLL_INTERVAL": 0.01, "BACKOFF_BASE": 60})
+class WebhookTest(TestCase):
+    def test_subscription_api(self):
+        self.client.post("/api/positions/", {"name": "Engineer"}, content_type="application/json")
+        response = self.client.post("/api/webhooks/", {"url": "http://example.com/hook", "resources": ["teams"]},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/webhooks/", {"url": "http://example.com/hook", "secret": "s"},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        subscription = response.json()
+        # События до создания подписки не доставляются, секрет не отдаётся
+        self.assertEqual(subscription["cursor"], Change.objects.latest("seq").seq)
+        self.assertNotIn("secret", subscription)
+        self.assertEqual([item["id"] for item in self.client.get("/api/webhooks/").json()], [subscription["id"]])
+        self.assertEqual(self.client.delete(f"/api/webhooks/{subscription['id']}/").status_code, 200)
+        self.assertEqual(self.client.get(f"/api/webhooks/{subscription['id']}/").status_code, 404)
+
+    async def test_batched_delivery_over_one_connection(self):
+        async with WebhookStub() as stub:
+            subscription = await WebhookSubscription.objects.acreate(url=stub.url, resources=["positions"],
+                                                                      secret="s")
+            # Запросы на запись только пишут журнал; 5 событий должностей и одно чужое
+            for i in range(5):
+                await self.async_client.post("/api/positions/", {"name": f"Position {i}"},
+                                             content_type="application/json")
+            await self.async_client.post("/api/organizations/", {"name": "Acme"}, content_type="application/json")
+            self.assertEqual(stub.requests, [])
+
+            client = webhooks.Client(timeout=5)
+            await webhooks.run(once=True, client=client)
+
+        self.assertEqual((len(stub.requests), client.opened, stub.connections), (3, 1, 1))
+        events = []
+        for request_line, headers, body in stub.requests:
+            self.assertEqual(request_line, b"POST /hook HTTP/1.1\r\n")
+            digest = hmac.new(b"s", body, hashlib.sha256).hexdigest()
+            self.assertEqual(headers["x-webhook-signature"], f"sha256={digest}")
+            events += json.loads(body)["events"]
+        self.assertEqual([(event["resource"], event["action"]) for event in events],
+                         [("positions", Change.CREATED)] * 5)
+        await subscription.arefresh_from_db()
+        self.assertEqual(subscription.cursor, (await Change.objects.alatest("seq")).seq)
+        self.assertIsNotNone(subscription.delivered_at)
+
+    async def test_failure_backs_off(self):
+        async with WebhookStub(status=500) as stub:
+            subscription = await WebhookSubscription.objects.acreate(url=stub.url)
+            await self.async_client.post("/api/positions/", {"name": "Engineer"}, content_type="application/json")
+            with self.assertLogs("organization.webhooks", "WARNING"):
+                await webhooks.run(once=True)
+
+        self.assertEqual(len(stub.requests), 1)
+        await subscription.arefresh_from_db()
+        self.assertEqual((subscription.cursor, subscription.failures, subscription.last_error), (0, 1, "HTTP 500"))
+        self.assertGreater(subscription.next_attempt_at, subscription.created_at)
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        metrics.reset()
+        cache.clear()
+        Organization.objects.create(name="Acme")
+
+    def test_server_timing_and_histograms(self):
+        response = self.client.get("/api/organizations/")
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, total')
+
+        body = self.client.get("/metrics").content.decode()
+        labels = 'view="organization_list",method="GET"'
+        self.assertIn(f'organization_request_duration_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'organization_response_size_bytes_bucket{{{labels},le="+Inf"}} 1', body)
+
+    @override_settings(ORGANIZATION_METRICS={"SLOW_REQUEST_MS": 0})
+    def test_slow_requests_log_queries(self):
+        with self.assertLogs("organization.metrics", "WARNING") as logs:
+            self.client.get("/api/organizations/")
+        self.assertIn("organization_organization", logs.output[0])
+
+
+@skipUnless(connection.vendor == "postgresql", "pg_stat_activity is PostgreSQL-only")
+class ConnectionReuseTest(TransactionTestCase):
+    threads = 16
+    requests_per_thread = 20
+
+    def backend_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")
+            return cursor.fetchone()[0]
+
+    def test_connections_bounded_under_concurrent_load(self):
+        Employee.objects.create(first_name="Ada", last_name="Lovelace")
+        pool = settings.DATABASES["default"]["OPTIONS"].get("pool")
+        # Пул ограничивает число соединений max_size, без пула каждый поток держит одно постоянное
+        bound = (pool["max_size"] if pool else self.threads) + 1
+        peak = 0
+        done = threading.Event()
+
+        def load():
+            client = Client()
+            for _ in range(self.requests_per_thread):
+                self.assertEqual(client.get("/api/employees/?limit=10").status_code, 200)
+            connections.close_all()
+
+        workers = [threading.Thread(target=load) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            peak = max(peak, self.backend_connections())
+            done.wait(0.01)
+        self.assertLessEqual(peak, bound)
@@ -0,0 +1,178 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import reduce
+from operator import or_
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import cache
+from .models import Organization, Division, Position, Employee, Permission, Change, ListVersion
+
+RESOURCES = {
+    "organizations": Organization,
+    "divisions": Division,
+    "positions": Position,
+    "employees": Employee,
+    "permissions": Permission,
+}
+
+BATCH_SIZE = 2000
+# Больше стольких корней поддеревьев — версии меняются у всех подразделений разом
+SUBTREE_LIMIT = 1000
+
+# Ключ pg_advisory_xact_lock журнала изменений, см. lock_log
+LOG_LOCK = 0x6f72672d6c6f67
+
+_pending = ContextVar("tracking_pending", default=None)
+
+
+def resource_name(model):
+    return next(name for name, resource_model in RESOURCES.items() if resource_model is model)
+
+
+def _with_subtrees(divisions):
+    """Подразделения вместе с потомками: их ответы встраивают цепочку parent"""
+    paths = list(divisions.exclude(path="").values_list("path", flat=True)[:SUBTREE_LIMIT + 1])
+    if len(paths) > SUBTREE_LIMIT:
+        return Division.objects.all()
+    if not paths:
+        return divisions
+    prefixes = reduce(or_, (Q(path__startswith=path) for path in paths))
+    return Division.objects.filter(prefixes | Q(pk__in=divisions.values("pk")))
+
+
+def _holders(model, position_ids):
+    """Объекты model, у которых есть хотя бы одна из должностей (без дублей от JOIN)"""
+    field = model._meta.get_field("positions")
+    through = field.remote_field.through
+    holder_ids = through.objects.filter(position_id__in=position_ids).values(f"{field.m2m_field_name()}_id")
+    return model.objects.filter(pk__in=holder_ids)
+
+
+def affected(resource, ids):
+    """QuerySet'ы по ресурсам: сами объекты ids и все, чьи ответы их встраивают"""
+    result = {resource: RESOURCES[resource].objects.filter(pk__in=ids)}
+    if resource == "organizations":
+        result["divisions"] = Division.objects.filter(organization_id__in=ids)
+    elif resource == "positions":
+        for name in ("divisions", "employees", "permissions"):
+            result[name] = _holders(RESOURCES[name], ids)
+    if resource in ("divisions", "positions"):
+        result["divisions"] = _with_subtrees(result["divisions"])
+    return result
+
+
+def changed(resource, ids, action=Change.UPDATED):
+    """Объекты ids ресурса созданы, изменены или сейчас будут удалены (action)
+
+    Пишет события в журнал изменений (log), повышает версию и updated_at у самих объектов
+    и у всех встраивающих их строк, сбрасывает их кэш. Вызывается в транзакции записи.
+    """
+    ids = list(ids)
+    log(resource, ids, action)
+    limit = cache.get_config()["INVALIDATE_LIMIT"]
+    now = timezone.now()
+    pending = _pending.get()
+    for start in range(0, len(ids), BATCH_SIZE):
+        for name, queryset in affected(resource, ids[start:start + BATCH_SIZE]).items():
+            touched = list(queryset.values_list("pk", flat=True)[:limit + 1])
+            if not touched:
+                continue
+            if pending is not None and pending.written.get(name):
+                queryset = queryset.exclude(pk__in=pending.written[name])
+            queryset.update(version=F("version") + 1, updated_at=now)
+            cache.invalidate(name, touched if len(touched) <= limit else None)
+            lists_changed([name])
+
+
+class Pending(object):
+    """Отложенное до конца collect(): события журнала и изменённые списки"""
+
+    def __init__(self):
+        self.events = []
+        self.lists = set()
+        # {ресурс: id}: версию уже повысила сама запись (schemas.save), changed() её не повышает
+        self.written = {}
+
+
+def lock_log():
+    """Блокировка журнала до конца транзакции: события пишутся только под ней
+
+    Транзакции пишут журнал по очереди и держат блокировку до коммита, поэтому seq выдаются в порядке коммитов:
+    событие с меньшим seq не может стать видимым позже (feed.visible). Берётся перед версиями списков (_bump) и
+    после счётчиков (counters.collect) — в одном порядке у всех записей.
+
+    Отложенные до COMMIT проверки внешних ключей выполняются до неё: проверка блокирует строку, на которую
+    ссылается запись (FOR KEY SHARE), и под блокировкой журнала ждала бы транзакцию, которая держит эту строку
+    и сама ждёт журнал. Потом проверки снова откладываются, как у Django по умолчанию.
+    """
+    with connection.cursor() as cursor:
+        # Одним обращением к БД: без параметров, LOG_LOCK — константа
+        cursor.execute(f"SET CONSTRAINTS ALL IMMEDIATE; SET CONSTRAINTS ALL DEFERRED; "
+                       f"SELECT pg_advisory_xact_lock({LOG_LOCK})")
+
+
+def _write(events, names):
+    lock_log()
+    Change.objects.bulk_create(events, batch_size=BATCH_SIZE)
+    if names:
+        _bump(names)
+
+
+def written(resource, ids):
+    """Запись сама повысила версию объектов ids: до конца collect() changed() не повышает её ещё раз"""
+    pending = _pending.get()
+    if pending is not None:
+        pending.written.setdefault(resource, set()).update(ids)
+
+
+def log(resource, ids, action):
+    """События журнала без повышения версий (например, для строк, которые сейчас будут удалены)"""
+    events = [Change(resource=resource, object_id=pk, action=action) for pk in ids]
+    pending = _pending.get()
+    if pending is None:
+        _write(events, ())
+    else:
+        pending.events.extend(events)
+
+
+def _bump(names):
+    """Повышение версий списков одним запросом; строки блокируются по порядку имён"""
+    table = connection.ops.quote_name(ListVersion._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {table} (resource, version) SELECT unnest(%s::varchar[]), 1 "
+                       f"ON CONFLICT (resource) DO UPDATE SET version = {table}.version + 1", [sorted(names)])
+
+
+def lists_changed(names):
+    """Списки ресурсов names изменились (версия для ETag списков); вне collect() версия повышается сразу"""
+    pending = _pending.get()
+    if pending is None:
+        _write([], set(names))
+    else:
+        pending.lists.update(names)
+
+
+@contextmanager
+def collect():
+    """События журнала и версии списков внутри блока пишутся один раз при выходе из него, как в counters.collect:
+    блокировки журнала и строк версий держатся от конца транзакции до коммита, а не с первой записи.
+    Вызывается внутри транзакции, снаружи counters.collect() (счётчики пересчитываются раньше)."""
+    if _pending.get() is not None:
+        yield
+        return
+    pending = Pending()
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+    if (pending.events or pending.lists) and not transaction.get_rollback():
+        _write(pending.events, pending.lists)
+
+
+def list_version(resource):
+    """Версия списков ресурса одним запросом по ключу"""
+    return ListVersion.objects.filter(pk=resource).values_list("version", flat=True).first() or 0
@@ -0,0 +1,58 @@
+from django.db.models import Count
+from marshmallow import ValidationError
+
+from .models import Division, Employee
+
+
+def parse_max_depth(value):
+    if value is None or value == "":
+        return None
+    try:
+        max_depth = int(value)
+    except ValueError:
+        max_depth = -1
+    if max_depth < 0:
+        raise ValidationError({"max_depth": ["max_depth must be a non-negative integer."]})
+    return max_depth
+
+
+def division_tree(organization_id, root=None, max_depth=None):
+    """Дерево подразделений организации: вложенные узлы с должностями и числом сотрудников на каждой
+
+    root — подразделение, с которого начинается дерево (иначе все корневые), max_depth — сколько уровней
+    под ним отдать; у обрезанных узлов с потомками children = None (их можно догрузить через root).
+    Постоянное число запросов по индексу пути, сборка дерева за один проход.
+    """
+    divisions = Division.objects.filter(organization_id=organization_id)
+    if root is not None:
+        divisions = divisions.filter(path__startswith=root.path)
+    limit = None
+    if max_depth is not None:
+        limit = (root.depth if root is not None else 0) + max_depth
+        divisions = divisions.filter(depth__lte=limit)
+
+    rows = divisions.order_by("depth", "id").values_list("id", "name", "parent_id", "depth")
+    links = Division.positions.through.objects.filter(division__in=divisions).order_by("position_id")
+    # Число держателей считается по должностям (один GROUP BY), а не по подразделениям: подразделения
+    # делят должности, и подсчёт различных сотрудников на подразделение соединял бы всех держателей с каждым
+    counts = dict(Employee.positions.through.objects.filter(position__in=links.values("position_id"))
+                  .values("position_id").annotate(count=Count("id")).values_list("position_id", "count"))
+    collapsed = set()
+    if limit is not None:
+        collapsed = set(Division.objects.filter(organization_id=organization_id, depth=limit + 1,
+                                                parent__in=divisions).values_list("parent_id", flat=True))
+
+    nodes, roots = {}, []
+    for pk, name, parent_id, depth in rows:
+        node = {"id": pk, "name": name, "depth": depth, "positions": [], "children": None if pk in collapsed else []}
+        nodes[pk] = node
+        # Подразделения идут по глубине: родитель уже собран, если он входит в дерево
+        parent = nodes.get(parent_id)
+        if parent is None:
+            roots.append(node)
+        else:
+            parent["children"].append(node)
+    for division_id, position_id, position_name in links.values_list("division_id", "position_id", "position__name"):
+        nodes[division_id]["positions"].append({"id": position_id, "name": position_name,
+                                                "employee_count": counts.get(position_id, 0)})
+    return roots
@@ -1,16 +1,42 @@
 from django.urls import path
 from .views import OrganizationsListView, OrganizationView, DivisionsListView, DivisionView, PositionsListView, \
-    PositionView, EmployeesListView, EmployeeView, PermissionsListView, PermissionView
+    PositionView, EmployeesListView, EmployeeView, PermissionsListView, PermissionView, BulkView, \
+    DivisionSubtreeView, DivisionAncestorsView, EmployeePermissionsView, PermissionCheckView, \
+    ChangesView, OrganizationExportView, OrganizationImportView, OrganizationTreeView, PurgeJobView, \
+    BatchView, StatsView, WebhooksListView, WebhookView, EmployeeSearchView
+from .models import Organization, Division, Position
+from .schemas import DivisionSchema, PositionSchema, EmployeeSchema, PermissionSchema
 
 urlpatterns = [
     path('organizations/', OrganizationsListView.as_view(), name='organization_list'),
     path('organizations/<int:organization_id>/', OrganizationView.as_view(), name='organization'),
+    path('organizations/<int:organization_id>/stats/', StatsView.as_view(model=Organization),
+         name='organization_stats'),
+    path('organizations/<int:organization_id>/tree/', OrganizationTreeView.as_view(), name='organization_tree'),
+    path('organizations/<int:organization_id>/export/', OrganizationExportView.as_view(), name='organization_export'),
+    path('organizations/import/', OrganizationImportView.as_view(), name='organization_import'),
     path('divisions/', DivisionsListView.as_view(), name='division_list'),
     path('divisions/<int:division_id>/', DivisionView.as_view(), name='division'),
+    path('divisions/<int:division_id>/subtree/', DivisionSubtreeView.as_view(), name='division_subtree'),
+    path('divisions/<int:division_id>/ancestors/', DivisionAncestorsView.as_view(), name='division_ancestors'),
+    path('divisions/<int:division_id>/stats/', StatsView.as_view(model=Division), name='division_stats'),
+    path('divisions/bulk/', BulkView.as_view(schema_class=DivisionSchema), name='division_bulk'),
     path('positions/', PositionsListView.as_view(), name='position_list'),
     path('positions/<int:position_id>/', PositionView.as_view(), name='position'),
+    path('positions/<int:position_id>/stats/', StatsView.as_view(model=Position), name='position_stats'),
+    path('positions/bulk/', BulkView.as_view(schema_class=PositionSchema), name='position_bulk'),
     path('employees/', EmployeesListView.as_view(), name='employee_list'),
+    path('employees/search/', EmployeeSearchView.as_view(), name='employee_search'),
     path('employees/<int:employee_id>/', EmployeeView.as_view(), name='employee'),
+    path('employees/<int:employee_id>/permissions/', EmployeePermissionsView.as_view(), name='employee_permissions'),
+    path('employees/bulk/', BulkView.as_view(schema_class=EmployeeSchema), name='employee_bulk'),
     path('permissions/', PermissionsListView.as_view(), name='permission_list'),
     path('permissions/<int:permission_id>/', PermissionView.as_view(), name='permission'),
-]
\ No newline at end of file
+    path('permissions/check/', PermissionCheckView.as_view(), name='permission_check'),
+    path('permissions/bulk/', BulkView.as_view(schema_class=PermissionSchema), name='permission_bulk'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('changes/', ChangesView.as_view(), name='changes'),
+    path('jobs/<int:job_id>/', PurgeJobView.as_view(), name='purge_job'),
+    path('webhooks/', WebhooksListView.as_view(), name='webhook_list'),
+    path('webhooks/<int:webhook_id>/', WebhookView.as_view(), name='webhook'),
+]
@@ -1,33 +1,54 @@
 import json
 
-from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.views import View
-from .models import Organization, Division, Position, Employee, Permission
+from . import access, counters, directory, feed, purge, tracking
+from .batch import MAX_IDS, resolve_lookups
+from .bulk import bulk_upsert, parse_items
+from .models import Organization, Division, Position, Employee, Permission, Change, PurgeJob, WebhookSubscription
+from .cache import cached
+from .conditional import conditional
+from .filters import filter_queryset
+from .pagination import paginate, parse_limit, stream_queryset
+from .serializers import dump_rows, json_response
+from .snapshot import export_snapshot, import_snapshot
+from .tree import division_tree, parse_max_depth
+from .writes import atomic_write, parse_body, write_context
 
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
-from .schemas import OrganizationSchema, DivisionSchema, EmployeeSchema, PermissionSchema, PositionSchema
+from .schemas import OrganizationSchema, DivisionSchema, EmployeeSchema, PermissionSchema, PositionSchema, \
+    DivisionNodeSchema, PermissionCheckSchema, ChangeSchema, PurgeJobSchema, BatchLookupSchema, requested_schema, \
+    with_related, reload_related, WebhookSubscriptionSchema
 from marshmallow import ValidationError
 
 
+def job_response(job):
+    """202 с состоянием фонового задания и адресом, по которому его можно опрашивать"""
+    response = JsonResponse(PurgeJobSchema().dump(job), status=202)
+    response["Location"] = reverse("purge_job", args=[job.pk])
+    return response
+
+
 @method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Organization), name="dispatch")
+@method_decorator(cached("organizations"), name="dispatch")
+@method_decorator(atomic_write(Organization), name="dispatch")
 class OrganizationsListView(View):
     def get(self, request, *args, **kwargs):
-        organizations = Organization.objects.all()
-        return JsonResponse(OrganizationSchema().dump(organizations, many=True),
-                            safe=False)
+        try:
+            schema = requested_schema(OrganizationSchema, request.GET)
+            queryset, ordering = filter_queryset(Organization.objects.all(), request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        return paginate(request, with_related(queryset, schema), schema, ordering)
 
     def post(self, request, *args, **kwargs):
         try:
-            data = json.loads(request.body)
-            organization_id = data.get("id")
-
-            if organization_id:
-                if Organization.objects.filter(pk=organization_id).exists():
-                    return JsonResponse({"error": "An organization with this ID already exists."}, status=400)
-
-            organization = OrganizationSchema().load(json.loads(request.body))
+            organization = OrganizationSchema(context={"create": True}).load(parse_body(request))
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
 
@@ -35,139 +56,292 @@ class OrganizationsListView(View):
 
 
 @method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Organization, "organization_id"), name="dispatch")
+@method_decorator(cached("organizations", "organization_id"), name="dispatch")
+@method_decorator(atomic_write(Organization), name="dispatch")
 class OrganizationView(View):
     def dispatch(self, request, organization_id, *args, **kwargs):
         try:
-            self.organization = Organization.objects.get(pk=organization_id)
+            self.schema = requested_schema(OrganizationSchema, request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        try:
+            self.organization = with_related(Organization.objects.all(), self.schema).get(pk=organization_id)
         except Organization.DoesNotExist:
             return JsonResponse({"error": "No organization matches the given query"}, status=404)
-        self.data = request.body and dict(json.loads(request.body), id=self.organization.id)
+        try:
+            self.data = request.body and dict(parse_body(request), id=self.organization.id)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
         return super(OrganizationView, self).dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
-        return JsonResponse(OrganizationSchema().dump(self.organization))
+        return JsonResponse(self.schema.dump(self.organization))
 
     def put(self, request, *args, **kwargs):
         try:
-            self.organization = OrganizationSchema().load(self.data)
+            context = write_context(request, self.organization)
+            self.organization = OrganizationSchema(context=context).load(self.data)
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
-        return JsonResponse(OrganizationSchema().dump(self.organization))
+        return JsonResponse(self.schema.dump(self.organization))
+
+    patch = put
 
     def delete(self, request, *args, **kwargs):
-        self.organization.delete()
-        return JsonResponse({'message': f'{self.organization} deleted'})
+        # Подразделения удаляются в фоне пачками (purge.py), организация — последней
+        return job_response(purge.schedule(PurgeJob.ORGANIZATION, self.organization.pk))
 
 
 @method_decorator(csrf_exempt, name="dispatch")
-class DivisionsListView(View):
-    def get(self, request, *args, **kwargs):
-        divisions = Division.objects.all()
-        return JsonResponse(DivisionSchema().dump(divisions, many=True), safe=False)
+class OrganizationExportView(View):
+    """Снимок организации потоком gzip NDJSON (см. snapshot.py)"""
+
+    def get(self, request, organization_id, *args, **kwargs):
+        if not Organization.objects.filter(pk=organization_id).exists():
+            return JsonResponse({"error": "No organization matches the given query"}, status=404)
+        response = StreamingHttpResponse(export_snapshot(organization_id), content_type="application/gzip")
+        response["Content-Disposition"] = f'attachment; filename="organization-{organization_id}.ndjson.gz"'
+        return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class OrganizationTreeView(View):
+    """Оргструктура деревом: ?root=<id подразделения> — поддерево, ?max_depth=N — уровней под корнем"""
+
+    def get(self, request, organization_id, *args, **kwargs):
+        try:
+            organization = Organization.objects.only("name").get(pk=organization_id)
+        except Organization.DoesNotExist:
+            return JsonResponse({"error": "No organization matches the given query"}, status=404)
+        try:
+            max_depth = parse_max_depth(request.GET.get("max_depth"))
+            root = request.GET.get("root")
+            root = int(root) if root else None
+        except ValueError:
+            return JsonResponse({"root": ["root must be an integer."]}, status=400)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        if root is not None:
+            try:
+                root = Division.objects.only("path", "depth").get(pk=root, organization_id=organization_id)
+            except Division.DoesNotExist:
+                return JsonResponse({"error": "No division matches the given query"}, status=404)
+        return json_response({
+            "id": organization.id,
+            "name": organization.name,
+            "divisions": division_tree(organization.id, root, max_depth),
+        })
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class OrganizationImportView(View):
+    """Загрузка снимка из тела запроса (gzip NDJSON), ?name= — новое имя организации"""
 
     def post(self, request, *args, **kwargs):
         try:
-            data = json.loads(request.body)
-            division_id = data.get("id")
+            # Тело читается потоком, не целиком в память
+            result = import_snapshot(request, name=request.GET.get("name"))
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        except IntegrityError:
+            return JsonResponse({"name": ["Organization with this Name already exists."]}, status=409)
+        return JsonResponse(result, status=201)
 
-            if division_id:
-                if Division.objects.filter(pk=division_id).exists():
-                    return JsonResponse({"error": "A division with this ID already exists."}, status=400)
 
-            division = DivisionSchema().load(json.loads(request.body))
+@method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Division), name="dispatch")
+@method_decorator(cached("divisions"), name="dispatch")
+@method_decorator(atomic_write(Division), name="dispatch")
+class DivisionsListView(View):
+    def get(self, request, *args, **kwargs):
+        try:
+            schema = requested_schema(DivisionSchema, request.GET)
+            queryset, ordering = filter_queryset(Division.objects.all(), request.GET)
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
+        return paginate(request, with_related(queryset, schema), schema, ordering)
 
-        return JsonResponse(OrganizationSchema().dump(division), status=201)
+    def post(self, request, *args, **kwargs):
+        try:
+            division = DivisionSchema(context={"create": True}).load(parse_body(request))
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+
+        schema = DivisionSchema()
+        return JsonResponse(schema.dump(reload_related(division, schema)), status=201)
 
 
 @method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Division, "division_id"), name="dispatch")
+@method_decorator(cached("divisions", "division_id"), name="dispatch")
+@method_decorator(atomic_write(Division), name="dispatch")
 class DivisionView(View):
     def dispatch(self, request, division_id, *args, **kwargs):
         try:
-            self.division = Division.objects.get(pk=division_id)
+            self.schema = requested_schema(DivisionSchema, request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        try:
+            self.division = with_related(Division.objects.all(), self.schema).get(pk=division_id)
         except Division.DoesNotExist:
             return JsonResponse({"error": "No division matches the given query"}, status=404)
-        self.data = request.body and dict(json.loads(request.body), id=self.division.id)
+        try:
+            self.data = request.body and dict(parse_body(request), id=self.division.id)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
         return super(DivisionView, self).dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
-        return JsonResponse(DivisionSchema().dump(self.division))
+        return JsonResponse(self.schema.dump(self.division))
 
     def put(self, request, *args, **kwargs):
         try:
-            self.division = DivisionSchema().load(self.data, partial=True)
+            context = write_context(request, self.division)
+            self.division = DivisionSchema(context=context).load(self.data, partial=True)
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
-        return JsonResponse(DivisionSchema().dump(self.division))
+        return JsonResponse(self.schema.dump(self.division))
+
+    patch = put
 
     def delete(self, request, *args, **kwargs):
-        self.division.delete()
+        with transaction.atomic():
+            tracking.changed("divisions", [self.division.pk], Change.DELETED)
+            # Дочерние подразделения становятся корневыми (SET_NULL): у них меняется parent_id, как в purge.py
+            tracking.changed("divisions", self.division.subdivisions.values_list("pk", flat=True))
+            self.division.delete()
         return JsonResponse({'message': f'{self.division} deleted'})
 
 
 @method_decorator(csrf_exempt, name="dispatch")
+class DivisionSubtreeView(View):
+    def get(self, request, division_id, *args, **kwargs):
+        try:
+            schema = requested_schema(DivisionNodeSchema, request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        try:
+            division = Division.objects.only("path").get(pk=division_id)
+        except Division.DoesNotExist:
+            return JsonResponse({"error": "No division matches the given query"}, status=404)
+        return paginate(request, with_related(division.descendants(), schema), schema)
+
+    def delete(self, request, division_id, *args, **kwargs):
+        """Удаление подразделения вместе со всем поддеревом, в фоне (purge.py)"""
+        if not Division.objects.filter(pk=division_id).exists():
+            return JsonResponse({"error": "No division matches the given query"}, status=404)
+        try:
+            with transaction.atomic():
+                job = purge.schedule(PurgeJob.DIVISION, division_id)
+        except IntegrityError:
+            return JsonResponse({"error": "The request conflicts with a concurrent change, retry it."}, status=409)
+        return job_response(job)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class PurgeJobView(View):
+    def get(self, request, job_id, *args, **kwargs):
+        try:
+            job = PurgeJob.objects.get(pk=job_id)
+        except PurgeJob.DoesNotExist:
+            return JsonResponse({"error": "No job matches the given query"}, status=404)
+        return JsonResponse(PurgeJobSchema().dump(job))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class DivisionAncestorsView(View):
+    def get(self, request, division_id, *args, **kwargs):
+        try:
+            schema = requested_schema(DivisionNodeSchema, request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        try:
+            division = Division.objects.only("path").get(pk=division_id)
+        except Division.DoesNotExist:
+            return JsonResponse({"error": "No division matches the given query"}, status=404)
+        ancestors = Division.objects.filter(pk__in=division.ancestor_ids()).order_by("depth")
+        return JsonResponse(schema.dump(with_related(ancestors, schema), many=True), safe=False)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Position), name="dispatch")
+@method_decorator(cached("positions"), name="dispatch")
+@method_decorator(atomic_write(Position), name="dispatch")
 class PositionsListView(View):
     def get(self, request, *args, **kwargs):
-        positions = Position.objects.all()
-        return JsonResponse(PositionSchema().dump(positions, many=True), safe=False)
+        try:
+            schema = requested_schema(PositionSchema, request.GET)
+            queryset, ordering = filter_queryset(Position.objects.all(), request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        return paginate(request, with_related(queryset, schema), schema, ordering)
 
     def post(self, request, *args, **kwargs):
         try:
-            data = json.loads(request.body)
-            position_id = data.get("id")
-
-            if position_id:
-                if Position.objects.filter(pk=position_id).exists():
-                    return JsonResponse({"error": "A position with this ID already exists."}, status=400)
-
-            position = PositionSchema().load(json.loads(request.body))
+            position = PositionSchema(context={"create": True}).load(parse_body(request))
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
 
-        return JsonResponse(OrganizationSchema().dump(position), status=201)
+        schema = PositionSchema()
+        return JsonResponse(schema.dump(reload_related(position, schema)), status=201)
 
 
 @method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Position, "position_id"), name="dispatch")
+@method_decorator(cached("positions", "position_id"), name="dispatch")
+@method_decorator(atomic_write(Position), name="dispatch")
 class PositionView(View):
     def dispatch(self, request, position_id, *args, **kwargs):
         try:
-            self.position = Position.objects.get(pk=position_id)
+            self.schema = requested_schema(PositionSchema, request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        try:
+            self.position = with_related(Position.objects.all(), self.schema).get(pk=position_id)
         except Position.DoesNotExist:
-            return JsonResponse({"error": "No division matches the given query"}, status=404)
-        self.data = request.body and dict(json.loads(request.body), id=self.position.id)
+            return JsonResponse({"error": "No position matches the given query"}, status=404)
+        try:
+            self.data = request.body and dict(parse_body(request), id=self.position.id)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
         return super(PositionView, self).dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
-        return JsonResponse(PositionSchema().dump(self.position))
+        return JsonResponse(self.schema.dump(self.position))
 
     def put(self, request, *args, **kwargs):
         try:
-            self.position = PositionSchema().load(self.data, partial=True)
+            context = write_context(request, self.position)
+            self.position = PositionSchema(context=context).load(self.data, partial=True)
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
-        return JsonResponse(PositionSchema().dump(self.position))
+        return JsonResponse(self.schema.dump(self.position))
+
+    patch = put
 
     def delete(self, request, *args, **kwargs):
-        self.position.delete()
+        with transaction.atomic():
+            tracking.changed("positions", [self.position.pk], Change.DELETED)
+            self.position.delete()
         return JsonResponse({'message': f'{self.position} deleted'})
 
 @method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Employee), name="dispatch")
+@method_decorator(cached("employees"), name="dispatch")
+@method_decorator(atomic_write(Employee), name="dispatch")
 class EmployeesListView(View):
     def get(self, request, *args, **kwargs):
-        employees = Employee.objects.all()
-        return JsonResponse(EmployeeSchema().dump(employees, many=True), safe=False)
+        try:
+            schema = requested_schema(EmployeeSchema, request.GET)
+            queryset, ordering = filter_queryset(Employee.objects.all(), request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        return paginate(request, with_related(queryset, schema), schema, ordering)
 
     def post(self, request, *args, **kwargs):
         try:
-            data = json.loads(request.body)
-            employee_id = data.get("id")
-
-            if employee_id:
-                if Employee.objects.filter(pk=employee_id).exists():
-                    return JsonResponse({"error": "A position with this ID already exists."}, status=400)
-
-            employee = EmployeeSchema().load(json.loads(request.body))
+            employee = EmployeeSchema(context={"create": True}).load(parse_body(request))
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
 
@@ -175,45 +349,82 @@ class EmployeesListView(View):
 
 
 @method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Employee, "employee_id"), name="dispatch")
+@method_decorator(cached("employees", "employee_id"), name="dispatch")
+@method_decorator(atomic_write(Employee), name="dispatch")
 class EmployeeView(View):
     def dispatch(self, request, employee_id, *args, **kwargs):
         try:
-            self.employee = Employee.objects.get(pk=employee_id)
+            self.schema = requested_schema(EmployeeSchema, request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        try:
+            self.employee = with_related(Employee.objects.all(), self.schema).get(pk=employee_id)
         except Employee.DoesNotExist:
-            return JsonResponse({"error": "No division matches the given query"}, status=404)
-        self.data = request.body and dict(json.loads(request.body), id=self.employee.id)
+            return JsonResponse({"error": "No employee matches the given query"}, status=404)
+        try:
+            self.data = request.body and dict(parse_body(request), id=self.employee.id)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
         return super(EmployeeView, self).dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
-        return JsonResponse(EmployeeSchema().dump(self.employee))
+        return JsonResponse(self.schema.dump(self.employee))
 
     def put(self, request, *args, **kwargs):
         try:
-            self.employee = EmployeeSchema().load(self.data, partial=True)
+            context = write_context(request, self.employee)
+            self.employee = EmployeeSchema(context=context).load(self.data, partial=True)
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
-        return JsonResponse(EmployeeSchema().dump(self.employee))
+        return JsonResponse(self.schema.dump(self.employee))
+
+    patch = put
 
     def delete(self, request, *args, **kwargs):
-        self.employee.delete()
+        with transaction.atomic():
+            tracking.changed("employees", [self.employee.pk], Change.DELETED)
+            self.employee.delete()
         return JsonResponse({'message': f'{self.employee} deleted'})
 
+
+@method_decorator(csrf_exempt, name="dispatch")
+class EmployeeSearchView(View):
+    """Подсказки для выбора сотрудника: ?q=<начало ФИО, должности или подразделения>&limit= (directory.py)"""
+
+    def get(self, request, *args, **kwargs):
+        try:
+            phrase, tokens, limit = directory.parse_query(request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        return json_response({"results": directory.search(phrase, tokens, limit)})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class EmployeePermissionsView(View):
+    def get(self, request, employee_id, *args, **kwargs):
+        if not Employee.objects.filter(pk=employee_id).exists():
+            return JsonResponse({"error": "No employee matches the given query"}, status=404)
+        permissions = Permission.objects.filter(effective_grants__employee_id=employee_id).order_by("id")
+        return json_response([data for _, data in dump_rows(permissions, PermissionSchema(exclude=("positions",)))])
+
+
 @method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Permission), name="dispatch")
+@method_decorator(cached("permissions"), name="dispatch")
+@method_decorator(atomic_write(Permission), name="dispatch")
 class PermissionsListView(View):
     def get(self, request, *args, **kwargs):
-        permissions = Permission.objects.all()
-        return JsonResponse(PermissionSchema().dump(permissions, many=True), safe=False)
+        try:
+            schema = requested_schema(PermissionSchema, request.GET)
+            queryset, ordering = filter_queryset(Permission.objects.all(), request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        return paginate(request, with_related(queryset, schema), schema, ordering)
 
     def post(self, request, *args, **kwargs):
         try:
-            data = json.loads(request.body)
-            permission_id = data.get("id")
-
-            if permission_id:
-                if Permission.objects.filter(pk=permission_id).exists():
-                    return JsonResponse({"error": "A position with this ID already exists."}, status=400)
-
-            permission = PermissionSchema().load(json.loads(request.body))
+            permission = PermissionSchema(context={"create": True}).load(parse_body(request))
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
 
@@ -221,25 +432,173 @@ class PermissionsListView(View):
 
 
 @method_decorator(csrf_exempt, name="dispatch")
+@method_decorator(conditional(Permission, "permission_id"), name="dispatch")
+@method_decorator(cached("permissions", "permission_id"), name="dispatch")
+@method_decorator(atomic_write(Permission), name="dispatch")
 class PermissionView(View):
     def dispatch(self, request, permission_id, *args, **kwargs):
         try:
-            self.permission = Permission.objects.get(pk=permission_id)
+            self.schema = requested_schema(PermissionSchema, request.GET)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        try:
+            self.permission = with_related(Permission.objects.all(), self.schema).get(pk=permission_id)
         except Permission.DoesNotExist:
-            return JsonResponse({"error": "No division matches the given query"}, status=404)
-        self.data = request.body and dict(json.loads(request.body), id=self.permission.id)
+            return JsonResponse({"error": "No permission matches the given query"}, status=404)
+        try:
+            self.data = request.body and dict(parse_body(request), id=self.permission.id)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
         return super(PermissionView, self).dispatch(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
-        return JsonResponse(PermissionSchema().dump(self.permission))
+        return JsonResponse(self.schema.dump(self.permission))
 
     def put(self, request, *args, **kwargs):
         try:
-            self.permission = PermissionSchema().load(self.data, partial=True)
+            context = write_context(request, self.permission)
+            self.permission = PermissionSchema(context=context).load(self.data, partial=True)
         except ValidationError as e:
             return JsonResponse(e.messages, status=400)
-        return JsonResponse(PermissionSchema().dump(self.permission))
+        return JsonResponse(self.schema.dump(self.permission))
+
+    patch = put
+
+    def delete(self, request, *args, **kwargs):
+        with transaction.atomic():
+            tracking.changed("permissions", [self.permission.pk], Change.DELETED)
+            self.permission.delete()
+        return JsonResponse({'message': f'{self.permission} deleted'})
+
+@method_decorator(csrf_exempt, name="dispatch")
+class BulkView(View):
+    """Массовое создание/обновление: JSON-массив или NDJSON"""
+    schema_class = None
+
+    def post(self, request, *args, **kwargs):
+        schema = self.schema_class(context={"bulk": True})
+        try:
+            results = bulk_upsert(schema, parse_items(request))
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+
+        summary = {status: 0 for status in ("created", "updated", "error")}
+        for result in results:
+            summary[result["status"]] += 1
+        return JsonResponse(dict(summary, results=results))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class StatsView(View):
+    """Счётчики объекта (counters.py) одним запросом по первичному ключу"""
+    model = None
+
+    def get(self, request, *args, **kwargs):
+        (pk,) = kwargs.values()
+        counted = counters.COUNTERS[self.model]
+        fields = [field.attname for field in counted._meta.concrete_fields if not field.primary_key]
+        stats = counted.objects.filter(pk=pk).values(*fields).first()
+        if stats is None:
+            return JsonResponse({"error": f"No {self.model._meta.verbose_name} matches the given query"}, status=404)
+        return JsonResponse(dict(id=pk, **stats))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class BatchView(View):
+    """Объекты разных ресурсов одним запросом: [{"type": "employees", "id": 1}, ...] (JSON-массив или NDJSON)"""
+    schemas = {
+        "organizations": OrganizationSchema(),
+        "divisions": DivisionSchema(),
+        "positions": PositionSchema(),
+        "employees": EmployeeSchema(),
+        "permissions": PermissionSchema(),
+    }
+
+    def post(self, request, *args, **kwargs):
+        try:
+            lookups = BatchLookupSchema(many=True).load(parse_items(request))
+            if len(lookups) > MAX_IDS:
+                raise ValidationError({"error": f"At most {MAX_IDS} lookups are allowed."})
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        return json_response({"results": resolve_lookups(lookups, self.schemas)})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class PermissionCheckView(View):
+    """Пакетная проверка прав: [{"employee_id": .., "permission_id": ..}, ...]"""
+
+    def post(self, request, *args, **kwargs):
+        try:
+            checks = PermissionCheckSchema(many=True).load(json.loads(request.body))
+        except ValueError:
+            return JsonResponse({"error": "Malformed JSON payload."}, status=400)
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+
+        pairs = [(item["employee_id"], item["permission_id"]) for item in checks]
+        return JsonResponse([dict(item, allowed=allowed) for item, allowed in zip(checks, access.check(pairs))],
+                            safe=False)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class ChangesView(View):
+    """Журнал изменений: ?since=<seq>&limit=, ?stream=1 — всё после since потоком
+
+    Ответ сразу, без ожидания: long-poll (?wait=) — только у async_views.AsyncChangesView.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.GET.get("since") or 0)
+            # Проверяется так же, как в AsyncChangesView, но не ждёт
+            float(request.GET.get("wait") or 0)
+        except ValueError:
+            return JsonResponse({"error": "since and wait must be numbers."}, status=400)
+        try:
+            limit = parse_limit(request.GET.get("limit"))
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+
+        if request.GET.get("stream") not in (None, "", "0"):
+            return StreamingHttpResponse(stream_queryset(feed.visible(since), ChangeSchema()),
+                                         content_type="application/json")
+
+        events = feed.read(since, limit)
+        return JsonResponse({
+            "results": ChangeSchema(many=True).dump(events),
+            "next": events[-1].seq if events else since,
+        })
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class WebhooksListView(View):
+    """Подписки на журнал изменений; доставляет события manage.py run_webhook_worker (webhooks.py)"""
+
+    def get(self, request, *args, **kwargs):
+        subscriptions = WebhookSubscription.objects.order_by("pk")
+        return JsonResponse(WebhookSubscriptionSchema(many=True).dump(subscriptions), safe=False)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            subscription = WebhookSubscriptionSchema().load(parse_body(request))
+        except ValidationError as e:
+            return JsonResponse(e.messages, status=400)
+        return JsonResponse(WebhookSubscriptionSchema().dump(subscription), status=201)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class WebhookView(View):
+    def dispatch(self, request, webhook_id, *args, **kwargs):
+        try:
+            self.subscription = WebhookSubscription.objects.get(pk=webhook_id)
+        except WebhookSubscription.DoesNotExist:
+            return JsonResponse({"error": "No webhook subscription matches the given query"}, status=404)
+        return super(WebhookView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(WebhookSubscriptionSchema().dump(self.subscription))
 
     def delete(self, request, *args, **kwargs):
-        self.permission.delete()
-        return JsonResponse({'message': f'{self.permission} deleted'})
\ No newline at end of file
+        self.subscription.delete()
+        return JsonResponse({'message': f'Webhook subscription {self.subscription.url} deleted'})
@@ -0,0 +1,221 @@
+"""Доставка журнала изменений подписчикам (webhooks)
+
+Журнал изменений (Change) служит outbox: события пишутся в транзакции записи (tracking.changed), подписчики
+получают только закоммиченные изменения, а время ответа API не зависит ни от числа подписчиков, ни от их
+скорости. У подписки свой курсор — seq последнего доставленного события. Воркер (manage.py run_webhook_worker)
+на asyncio берёт подписки, у которых есть новые события, и отправляет их пачками до BATCH_SIZE: всплеск
+изменений уходит несколькими запросами POST {"subscription": id, "events": [...]}, а не запросом на событие.
+После ответа 2xx курсор сдвигается, после ошибки следующая попытка откладывается экспоненциально
+(BACKOFF_BASE, 2·BACKOFF_BASE, ... до BACKOFF_MAX). Доставка «хотя бы один раз»: после сбоя пачка уходит
+повторно, по seq событий получатель отбрасывает дубли.
+
+HTTP-клиент без зависимостей: HTTP/1.1 на asyncio, соединения с получателями переиспользуются (keep-alive).
+Подписку захватывает один воркер на LEASE секунд, так что воркеров можно запускать несколько.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import random
+import ssl
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import feed
+from .models import WebhookSubscription
+from .schemas import ChangeSchema
+
+DEFAULTS = {
+    "BATCH_SIZE": 500,
+    "CONCURRENCY": 64,
+    "TIMEOUT": 10,
+    "BACKOFF_BASE": 1,
+    "BACKOFF_MAX": 600,
+    "POLL_INTERVAL": 0.5,
+    # Подписка, захваченная воркером, не берётся другими столько секунд (продлевается после каждой пачки)
+    "LEASE": 60,
+}
+
+logger = logging.getLogger("organization.webhooks")
+
+
+def get_config():
+    return dict(DEFAULTS, **getattr(settings, "ORGANIZATION_WEBHOOKS", {}))
+
+
+class DeliveryError(Exception):
+    pass
+
+
+class Client(object):
+    """POST по HTTP/1.1 с пулом keep-alive соединений по (схема, хост, порт)"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.idle = {}
+        # Открыто соединений за всё время (для бенчмарка: при переиспользовании их мало)
+        self.opened = 0
+
+    async def _open(self, scheme, host, port):
+        self.opened += 1
+        return await asyncio.open_connection(host, port, ssl=ssl.create_default_context() if scheme == "https" else None)
+
+    async def _exchange(self, reader, writer, netloc, path, body, headers):
+        head = [f"POST {path} HTTP/1.1", f"Host: {netloc}", f"Content-Length: {len(body)}"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed")
+        version, status = status_line.split()[:2]
+        response = {}
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            response[name.strip().lower()] = value.strip()
+        keep_alive = version == b"HTTP/1.1" and response.get("connection", "").lower() != "close"
+        if response.get("transfer-encoding", "").lower() == "chunked":
+            while (size := int((await reader.readline()).split(b";")[0].strip(), 16)):
+                await reader.readexactly(size + 2)
+            await reader.readline()
+        elif "content-length" in response:
+            await reader.readexactly(int(response["content-length"]))
+        else:
+            await reader.read()
+            keep_alive = False
+        return int(status), keep_alive
+
+    async def post(self, url, body, headers):
+        """Статус ответа; соединение из пула, закрытое получателем, заменяется новым"""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        while True:
+            pooled = bool(self.idle.get(key))
+            reader, writer = self.idle[key].pop() if pooled else await asyncio.wait_for(self._open(*key), self.timeout)
+            try:
+                status, keep_alive = await asyncio.wait_for(
+                    self._exchange(reader, writer, parts.netloc, path, body, headers), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if pooled:
+                    # Получатель закрыл соединение, пока оно лежало в пуле
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.idle.setdefault(key, []).append((reader, writer))
+            else:
+                writer.close()
+            return status
+
+    async def close(self):
+        writers = [writer for connections in self.idle.values() for _, writer in connections]
+        self.idle = {}
+        for writer in writers:
+            writer.close()
+        await asyncio.gather(*(writer.wait_closed() for writer in writers), return_exceptions=True)
+
+
+def _body(subscription, events):
+    """Тело запроса: события в том же виде, что и в /api/changes/"""
+    return json.dumps({"subscription": subscription.pk, "events": ChangeSchema(many=True).dump(events)},
+                      separators=(",", ":")).encode()
+
+
+def _headers(subscription, body):
+    headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+    if subscription.secret:
+        digest = hmac.new(subscription.secret.encode(), body, hashlib.sha256).hexdigest()
+        headers["X-Webhook-Signature"] = f"sha256={digest}"
+    return headers
+
+
+def backoff(failures, config=None):
+    """Пауза перед следующей попыткой после failures ошибок подряд, секунды (со случайным разбросом)"""
+    config = config or get_config()
+    delay = min(config["BACKOFF_MAX"], config["BACKOFF_BASE"] * 2 ** (failures - 1))
+    return delay * random.uniform(0.5, 1)
+
+
+async def deliver(client, subscription, head, config):
+    """Пачки событий подписки до seq=head включительно; False, если доставка не удалась"""
+    events_of = feed.visible(subscription.cursor).filter(seq__lte=head)
+    if subscription.resources:
+        events_of = events_of.filter(resource__in=subscription.resources)
+    while True:
+        events = [event async for event in events_of.filter(seq__gt=subscription.cursor)[:config["BATCH_SIZE"]]]
+        if events:
+            body = _body(subscription, events)
+            try:
+                status = await client.post(subscription.url, body, _headers(subscription, body))
+                if not 200 <= status < 300:
+                    raise DeliveryError(f"HTTP {status}")
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, DeliveryError) as e:
+                subscription.failures += 1
+                error = str(e) or type(e).__name__
+                logger.warning("Webhook %s delivery failed (%s attempt): %s", subscription.pk, subscription.failures,
+                               error)
+                await WebhookSubscription.objects.filter(pk=subscription.pk).aupdate(
+                    failures=subscription.failures, last_error=error, locked_until=None,
+                    next_attempt_at=timezone.now() + timedelta(seconds=backoff(subscription.failures, config)))
+                return False
+        # Неполная пачка — событий до head больше нет, курсор встаёт на head (неподходящие ресурсы пропущены)
+        done = len(events) < config["BATCH_SIZE"]
+        subscription.cursor = head if done else events[-1].seq
+        now = timezone.now()
+        await WebhookSubscription.objects.filter(pk=subscription.pk).aupdate(
+            cursor=subscription.cursor, failures=0, last_error="", next_attempt_at=None,
+            delivered_at=now if events else subscription.delivered_at,
+            locked_until=None if done else now + timedelta(seconds=config["LEASE"]))
+        if done:
+            return True
+
+
+async def claim(head, limit, config, exclude=()):
+    """Подписки с событиями до head, которые пора доставлять; захватываются на LEASE секунд"""
+    now = timezone.now()
+    available = (Q(active=True, cursor__lt=head) & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+                 & (Q(locked_until__isnull=True) | Q(locked_until__lt=now)))
+    candidates = WebhookSubscription.objects.filter(available).exclude(pk__in=exclude).order_by("cursor")[:limit]
+    claimed = []
+    async for subscription in candidates:
+        if await WebhookSubscription.objects.filter(available, pk=subscription.pk).aupdate(
+                locked_until=now + timedelta(seconds=config["LEASE"])):
+            claimed.append(subscription)
+    return claimed
+
+
+async def run(once=False, client=None):
+    """Цикл доставки; once — вернуться, когда доставлять больше нечего (подписки с паузой после ошибки ждут)"""
+    config = get_config()
+    client = client or Client(config["TIMEOUT"])
+    running = {}
+    try:
+        while True:
+            head = await feed.visible(0).order_by("-seq").values_list("seq", flat=True).afirst() or 0
+            for subscription in await claim(head, config["CONCURRENCY"] - len(running), config, list(running)):
+                running[subscription.pk] = asyncio.create_task(deliver(client, subscription, head, config))
+            if not running:
+                if once:
+                    return
+                await asyncio.sleep(config["POLL_INTERVAL"])
+                continue
+            done, _ = await asyncio.wait(running.values(), timeout=config["POLL_INTERVAL"],
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for pk, task in list(running.items()):
+                if task in done:
+                    del running[pk]
+                    if task.exception() is not None:
+                        logger.error("Webhook %s worker failed", pk, exc_info=task.exception())
+    finally:
+        for task in running.values():
+            task.cancel()
+        await client.close()
@@ -0,0 +1,83 @@
+import json
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils.text import capfirst
+from marshmallow import ValidationError
+
+from . import counters, tracking
+
+
+class PreconditionFailed(Exception):
+    """Объект изменился после версии из If-Match: запись не выполнена (412)"""
+
+
+class ObjectDeleted(Exception):
+    """Объект удалён параллельным запросом до условной записи: запись не выполнена (404)"""
+
+
+def write_context(request, instance=None):
+    """Контекст схемы для PUT/PATCH: условие записи из conditional.py, частичная ли запись и объект, уже
+    загруженный view (условная запись обходится без повторного чтения, см. schemas.save)"""
+    return {"condition": getattr(request, "write_condition", None), "patch": request.method == "PATCH",
+            "instance": instance}
+
+
+def parse_body(request):
+    """JSON-объект из тела запроса (разбирается один раз)"""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        raise ValidationError({"error": "Malformed JSON payload."})
+    if not isinstance(data, dict):
+        raise ValidationError({"error": "Expected a JSON object."})
+    return data
+
+
+def conflict_response(model, request):
+    """409 после IntegrityError: какие уникальные поля заняты (транзакция уже откачена)"""
+    try:
+        data = parse_body(request)
+    except ValidationError:
+        data = {}
+    messages = {}
+    for field in model._meta.concrete_fields:
+        if not field.unique or field.name not in data or (field.primary_key and request.method != "POST"):
+            continue
+        if model.objects.filter(**{field.name: data[field.name]}).exists():
+            messages[field.name] = [field.error_messages["unique"] % {
+                "model_name": capfirst(model._meta.verbose_name),
+                "field_label": capfirst(field.verbose_name),
+            }]
+    return JsonResponse(messages or {"error": "The request conflicts with a concurrent change, retry it."},
+                        status=409)
+
+
+def atomic_write(model):
+    """Запросы на запись выполняются одной транзакцией, IntegrityError даёт 409 вместо 500
+
+    Счётчики (counters.py), события журнала и версии списков (tracking.py), затронутые запросом, пишутся один раз
+    в конце транзакции. Запись поверх изменившейся версии (PreconditionFailed) откатывается и даёт 412, поверх
+    удалённого за это время объекта — 404.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in ("GET", "HEAD", "OPTIONS"):
+                return view(request, *args, **kwargs)
+            try:
+                with transaction.atomic(), tracking.collect(), counters.collect():
+                    return view(request, *args, **kwargs)
+            except IntegrityError:
+                return conflict_response(model, request)
+            except PreconditionFailed:
+                return JsonResponse({"error": "The object was changed by another request, re-read it and retry."},
+                                    status=412)
+            except ObjectDeleted:
+                return JsonResponse({"error": f"No {model._meta.verbose_name} matches the given query"}, status=404)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+"""Бенчмарк эндпоинтов organization/urls.py: перцентили задержки, число запросов к БД и пик памяти.
+
+Данные создаёт manage.py seed_benchmark в транзакции, которая откатывается в конце, так что скрипт
+можно запускать на любой БД из настроек проекта. Результат пишется в JSON и сравнивается с базовым:
+рост числа запросов, медианы задержки или пика памяти сверх допуска — регрессия, скрипт завершается с кодом 1.
+
+    python scripts/benchmark.py --scale small --requests 30 --output /tmp/benchmark.json
+    python scripts/benchmark.py --update-baseline   # записать новый scripts/benchmark_baseline.json
+
+Запросы идут через django.test.Client в этом же процессе (без HTTP), кэш ответов выключен (--cache включает).
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "company.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext, override_settings  # noqa: E402
+from django.urls import get_resolver  # noqa: E402
+
+from organization import cache  # noqa: E402
+from organization.models import Organization, Division, Position, Employee, Permission, PurgeJob  # noqa: E402
+from organization.snapshot import export_snapshot  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# Разница медиан меньше стольких мс не считается регрессией (шум на быстрых эндпоинтах)
+MIN_LATENCY_DELTA_MS = 5.0
+ORDERING = {"employee": "last_name,first_name"}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Scenario(object):
+    """Один запрос: url и тело строятся заново на каждой итерации (setup — вне замера)"""
+
+    def __init__(self, url_name, method, url, body=None, setup=None, variant="", content_type="application/json",
+                 headers=None):
+        self.url_name, self.method, self.variant = url_name, method, variant
+        self.url, self.body, self.setup, self.content_type = url, body, setup, content_type
+        self.headers = headers
+
+    @property
+    def key(self):
+        return f"{self.url_name} {self.method}" + (f" {self.variant}" if self.variant else "")
+
+    def request(self, client, context):
+        state = self.setup(context) if self.setup else None
+        url = self.url(context, state) if callable(self.url) else self.url
+        body = self.body(context, state) if callable(self.body) else self.body
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        headers = self.headers(context, state) if callable(self.headers) else self.headers
+        return lambda: client.generic(self.method, url, body or "", content_type=self.content_type, headers=headers)
+
+
+def crud(name, collection, model, create, update):
+    """Список, объект, создание, изменение и удаление ресурса"""
+    counter = itertools.count()
+    first = f"first_{name}"
+    return [
+        Scenario(f"{name}_list", "GET", f"/api/{collection}/?limit=100"),
+        Scenario(f"{name}_list", "GET", f"/api/{collection}/?limit=100&ordering={ORDERING.get(name, '-name')}",
+                 variant="ordering"),
+        Scenario(f"{name}_list", "GET", f"/api/{collection}/?stream=1", variant="stream"),
+        Scenario(name, "GET", lambda c, s: f"/api/{collection}/{c[first]}/"),
+        Scenario(f"{name}_list", "POST", f"/api/{collection}/", lambda c, s: create(c, next(counter))),
+        Scenario(name, "PUT", lambda c, s: f"/api/{collection}/{c[first]}/", lambda c, s: update(c, next(counter))),
+        Scenario(name, "DELETE", lambda c, s: f"/api/{collection}/{s}/",
+                 setup=lambda c: model.objects.create(**create_orm(model, c, next(counter))).pk),
+    ]
+
+
+def create_orm(model, context, i):
+    if model is Organization:
+        return {"name": f"Benchmark deleted {i}"}
+    if model is Division:
+        return {"name": f"Deleted {i}", "organization_id": context["organization"]}
+    if model is Employee:
+        return {"first_name": "Deleted", "last_name": str(i)}
+    return {"name": f"Deleted {i}"}
+
+
+def scenarios():
+    bulk = itertools.count()
+    result = [
+        *crud("organization", "organizations", Organization,
+              lambda c, i: {"name": f"Benchmark created {i}"},
+              lambda c, i: {"description": f"Updated {i}"}),
+        *crud("division", "divisions", Division,
+              lambda c, i: {"name": f"Created {i}", "organization_id": c["organization"], "parent_id": c["leaf"],
+                            "positions_ids": c["positions"][:2]},
+              lambda c, i: {"name": f"Updated {i}", "positions_ids": c["positions"][:3]}),
+        *crud("position", "positions", Position,
+              lambda c, i: {"name": f"Created {i}"},
+              lambda c, i: {"name": f"Updated {i}"}),
+        *crud("employee", "employees", Employee,
+              lambda c, i: {"first_name": "Created", "last_name": str(i), "positions_ids": c["positions"][:2]},
+              lambda c, i: {"last_name": f"Updated {i}", "positions_ids": c["positions"][1:3]}),
+        *crud("permission", "permissions", Permission,
+              lambda c, i: {"name": f"Created {i}", "positions_ids": c["positions"][:2]},
+              lambda c, i: {"description": f"Updated {i}", "positions_ids": c["positions"][:1]}),
+        Scenario("employee", "PATCH", lambda c, s: f"/api/employees/{c['first_employee']}/",
+                 lambda c, s: {"last_name": f"Patched {next(bulk)}"}, variant="if-match",
+                 setup=lambda c: Client().get(f"/api/employees/{c['first_employee']}/")["ETag"],
+                 headers=lambda c, s: {"If-Match": s}),
+        Scenario("employee_list", "GET", "/api/employees/?search=ada&limit=100", variant="search"),
+        Scenario("employee_list", "GET", lambda c, s: f"/api/employees/?position_id={c['positions'][0]}&limit=100",
+                 variant="filter"),
+        Scenario("employee_search", "GET", "/api/employees/search/?q=ada%20lov"),
+        Scenario("employee_search", "GET", "/api/employees/search/?q=ada%20division%2012", variant="positions"),
+        Scenario("organization_tree", "GET", lambda c, s: f"/api/organizations/{c['organization']}/tree/"),
+        Scenario("organization_stats", "GET", lambda c, s: f"/api/organizations/{c['organization']}/stats/"),
+        Scenario("division_stats", "GET", lambda c, s: f"/api/divisions/{c['root']}/stats/"),
+        Scenario("position_stats", "GET", lambda c, s: f"/api/positions/{c['positions'][0]}/stats/"),
+        Scenario("organization_export", "GET", lambda c, s: f"/api/organizations/{c['organization']}/export/"),
+        Scenario("organization_import", "POST", lambda c, s: f"/api/organizations/import/?name=Imported {next(bulk)}",
+                 lambda c, s: c["snapshot"], content_type="application/gzip"),
+        Scenario("division_subtree", "GET", lambda c, s: f"/api/divisions/{c['root']}/subtree/"),
+        Scenario("division_subtree", "DELETE", lambda c, s: f"/api/divisions/{s}/subtree/",
+                 setup=lambda c: subtree(c, next(bulk))),
+        Scenario("purge_job", "GET", lambda c, s: f"/api/jobs/{c['job']}/"),
+        Scenario("division_ancestors", "GET", lambda c, s: f"/api/divisions/{c['leaf']}/ancestors/"),
+        Scenario("employee_permissions", "GET", lambda c, s: f"/api/employees/{c['first_employee']}/permissions/"),
+        Scenario("permission_check", "POST", "/api/permissions/check/",
+                 lambda c, s: [{"employee_id": c["first_employee"], "permission_id": c["first_permission"]}] * 50),
+        Scenario("changes", "GET", "/api/changes/?since=0&limit=100"),
+        Scenario("employee_list", "GET", lambda c, s: f"/api/employees/?ids={','.join(map(str, c['employees']))}",
+                 variant="ids"),
+        Scenario("batch", "POST", "/api/batch/",
+                 lambda c, s: [{"type": "employees", "id": pk} for pk in c["employees"]]
+                 + [{"type": "divisions", "id": c["leaf"]}, {"type": "organizations", "id": c["organization"]}]),
+    ]
+    bulk_items = {
+        "divisions": lambda c, i: {"name": f"Bulk {i}", "organization_id": c["organization"], "parent_id": c["leaf"]},
+        "positions": lambda c, i: {"name": f"Bulk {i}"},
+        "employees": lambda c, i: {"first_name": "Bulk", "last_name": str(i), "positions_ids": c["positions"][:1]},
+        "permissions": lambda c, i: {"name": f"Bulk {i}", "positions_ids": c["positions"][:1]},
+    }
+    for collection, item in bulk_items.items():
+        result.append(Scenario(f"{collection[:-1]}_bulk", "POST", f"/api/{collection}/bulk/",
+                               lambda c, s, item=item: [item(c, next(bulk)) for _ in range(20)]))
+    return result
+
+
+def subtree(context, i):
+    """Небольшое поддерево под листом для удаления: корень и два потомка"""
+    root = Division.objects.create(name=f"Purged {i}", organization_id=context["organization"], parent_id=context["leaf"])
+    for division in [root] + [Division.objects.create(name=f"Purged {i}.{j}", organization_id=context["organization"],
+                                                      parent=root) for j in range(2)]:
+        division.update_path()
+    return root.pk
+
+
+def prepare_context(seeded):
+    """id для сценариев: только из данных seed_benchmark (seeded — {модель: id до загрузки})"""
+    def new(model):
+        return model.objects.filter(id__gt=seeded[model]).order_by("id")
+
+    organization = new(Organization).values_list("id", flat=True).first()
+    positions = list(new(Position).values_list("id", flat=True)[:3])
+    divisions = new(Division).filter(organization_id=organization)
+    leaf = divisions.order_by("-depth", "id").first()
+    small = Organization.objects.create(name="Benchmark snapshot source")
+    Division.objects.create(name="Snapshot root", organization=small).positions.set(positions[:1])
+    context = {
+        "organization": organization,
+        "positions": positions,
+        "root": divisions.filter(parent=None).first().pk,
+        "leaf": leaf.pk,
+        "first_organization": organization,
+        "first_division": leaf.pk,
+        "first_position": positions[0],
+        "first_employee": new(Employee).values_list("id", flat=True).first(),
+        "employees": list(new(Employee).values_list("id", flat=True)[:300]),
+        "first_permission": new(Permission).values_list("id", flat=True).first(),
+        "snapshot": b"".join(export_snapshot(small.pk)),
+        "job": PurgeJob.objects.create(kind=PurgeJob.ORGANIZATION, target_id=small.pk).pk,
+    }
+    return context
+
+
+def measure(scenario, client, context, requests):
+    latencies, queries = [], []
+    for _ in range(requests):
+        send = scenario.request(client, context)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = send()
+            if response.streaming:
+                b"".join(response.streaming_content)
+            latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{scenario.key}: HTTP {response.status_code} {response.content[:200]!r}")
+        queries.append(len(captured))
+
+    # Пик памяти — отдельным запросом: под tracemalloc всё заметно медленнее
+    send = scenario.request(client, context)
+    tracemalloc.start()
+    response = send()
+    if response.streaming:
+        b"".join(response.streaming_content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2),
+        "queries": max(queries),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Регрессии относительно базового прогона: [(ключ, описание)]"""
+    regressions = []
+    for key, base in baseline["results"].items():
+        current = results.get(key)
+        if current is None:
+            regressions.append((key, "scenario missing"))
+            continue
+        if current["queries"] > base["queries"]:
+            regressions.append((key, f"queries {base['queries']} -> {current['queries']}"))
+        # Медиана: хвосты на нескольких десятках запросов слишком шумные для проверки
+        if current["p50_ms"] > base["p50_ms"] * (1 + tolerance) and \
+                current["p50_ms"] - base["p50_ms"] > MIN_LATENCY_DELTA_MS:
+            regressions.append((key, f"p50 {base['p50_ms']} -> {current['p50_ms']} ms"))
+        if current["peak_kib"] > base["peak_kib"] * (1 + tolerance):
+            regressions.append((key, f"peak memory {base['peak_kib']} -> {current['peak_kib']} KiB"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", default="small", help="Масштаб seed_benchmark (small, medium, large)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=30, help="Запросов на сценарий")
+    parser.add_argument("--only", nargs="*", help="Только сценарии с этими именами URL")
+    parser.add_argument("--cache", action="store_true", help="Не выключать кэш ответов")
+    parser.add_argument("--output", help="Куда записать результаты (JSON)")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=1.0, help="Допустимый рост медианы задержки и памяти, доля")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    selected = [s for s in scenarios() if not args.only or s.url_name in args.only]
+    covered = {s.url_name for s in scenarios()}
+    missing = sorted(name for name in get_resolver().reverse_dict if isinstance(name, str)
+                     and name not in covered and not name.startswith("async_") and name != "metrics")
+    if missing:
+        print(f"Endpoints without scenarios: {', '.join(missing)}", file=sys.stderr)
+
+    results = {}
+    settings = {} if args.cache else {"ORGANIZATION_CACHE": {"ENABLED": False}}
+    try:
+        with override_settings(**settings), transaction.atomic():
+            seeded = {model: model.objects.order_by("-id").values_list("id", flat=True).first() or 0
+                      for model in (Organization, Division, Position, Employee, Permission)}
+            call_command("seed_benchmark", scale=args.scale, seed=args.seed, stdout=sys.stderr)
+            cache.clear()
+            context = prepare_context(seeded)
+            client = Client()
+            print(f"{'scenario':<42} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'peak KiB':>10}")
+            for scenario in selected:
+                result = results[scenario.key] = measure(scenario, client, context, args.requests)
+                print(f"{scenario.key:<42} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+                      f"{result['queries']:>8} {result['peak_kib']:>10}")
+            raise Rollback
+    except Rollback:
+        pass
+
+    report = {
+        "meta": {"database": connection.vendor, "scale": args.scale, "seed": args.seed, "requests": args.requests,
+                 "python": platform.python_version(), "django": django.get_version()},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, run with --update-baseline", file=sys.stderr)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.only:
+        baseline["results"] = {key: value for key, value in baseline["results"].items()
+                               if key.split()[0] in args.only}
+    # Сценарии меняют данные (число запросов зависит от накопленного), поэтому сравнимы только одинаковые прогоны
+    if [baseline["meta"][key] for key in ("scale", "seed", "requests")] != [args.scale, args.seed, args.requests]:
+        sys.exit("Baseline was recorded with another --scale, --seed or --requests")
+    if baseline["meta"]["database"] != connection.vendor:
+        print("Baseline was recorded on another database, comparing query counts only", file=sys.stderr)
+        args.tolerance = float("inf")
+    regressions = compare(results, baseline, args.tolerance)
+    for key, message in regressions:
+        print(f"REGRESSION {key}: {message}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Удаление большой организации: collector Django против пачек purge.py.
+
+Для каждого размера создаёт организацию (manage.py seed_benchmark, без сотрудников и прав) и меряет:
+прежнее удаление organization.delete() одной транзакцией (откатывается, так что данные остаются) и фоновое
+удаление пачками. Пик памяти — tracemalloc, время блокировок — длительность самой длинной транзакции:
+у collector это всё удаление, у purge.py — одна пачка. Пик памяти purge.py не растёт с размером организации.
+
+    python scripts/benchmark_purge.py --divisions 10000 50000 --batch-size 1000
+
+Данные пишутся в БД из настроек проекта и удаляются в конце вместе с записями журнала изменений и заданиями.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "company.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+# С DEBUG соединение копит текст всех запросов, и память росла бы с числом пачек
+settings.DEBUG = False
+
+from django.core.management import call_command  # noqa: E402
+from django.db import transaction  # noqa: E402
+from django.db.models import Max  # noqa: E402
+
+from organization import purge, tracking  # noqa: E402
+from organization.models import Organization, Position, Change, PurgeJob  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def seed(divisions, seed):
+    call_command("seed_benchmark", organizations=1, divisions=divisions, positions=200, employees=0,
+                 permissions=0, seed=seed, stdout=open(os.devnull, "w"))
+    return Organization.objects.order_by("-id").values_list("id", flat=True).first()
+
+
+def collector_delete(organization_id):
+    """Прежний DELETE /organizations/<id>/: всё в одной транзакции, она же — время блокировок"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with transaction.atomic():
+            tracking.changed("organizations", [organization_id], Change.DELETED)
+            Organization.objects.get(pk=organization_id).delete()
+            elapsed = time.perf_counter() - started
+            raise Rollback
+    except Rollback:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": elapsed, "max_transaction_seconds": elapsed, "peak_mb": peak / 2 ** 20}
+
+
+def batched_purge(organization_id, batch_size):
+    job = PurgeJob.objects.create(kind=PurgeJob.ORGANIZATION, target_id=organization_id)
+    tracemalloc.start()
+    started = time.perf_counter()
+    longest, batch_started = 0.0, time.perf_counter()
+    for _ in purge.batches(job, batch_size):
+        longest = max(longest, time.perf_counter() - batch_started)
+        batch_started = time.perf_counter()
+    with transaction.atomic():
+        tracking.changed("organizations", [organization_id], Change.DELETED)
+        Organization.objects.filter(pk=organization_id).delete()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    PurgeJob.objects.filter(pk=job.pk).update(status=PurgeJob.DONE)
+    return {"seconds": elapsed, "max_transaction_seconds": longest, "peak_mb": peak / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--divisions", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--batch-size", type=int, default=purge.get_config()["BATCH_SIZE"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    last_position = Position.objects.aggregate(last=Max("id"))["last"] or 0
+    last_change = Change.objects.aggregate(last=Max("seq"))["last"] or 0
+    last_job = PurgeJob.objects.aggregate(last=Max("id"))["last"] or 0
+    print(f"{'divisions':>10} {'method':>10} {'total s':>9} {'max tx s':>9} {'peak MB':>9}")
+    try:
+        for size in args.divisions:
+            organization_id = seed(size, args.seed)
+            for name, result in (("collector", collector_delete(organization_id)),
+                                 ("purge", batched_purge(organization_id, args.batch_size))):
+                print(f"{size:>10} {name:>10} {result['seconds']:>9.2f} {result['max_transaction_seconds']:>9.3f} "
+                      f"{result['peak_mb']:>9.1f}")
+    finally:
+        Position.objects.filter(id__gt=last_position).delete()
+        Change.objects.filter(seq__gt=last_change).delete()
+        PurgeJob.objects.filter(id__gt=last_job).delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Задержка подсказок /api/employees/search/ (directory.py) против списка с ?name__icontains=.
+
+Данные создаёт manage.py seed_benchmark (по умолчанию --scale large, 400 тысяч сотрудников) в транзакции, которая
+откатывается в конце. Запросы — ввод по буквам: все префиксы «имя фамилия» и «фамилия имя» --samples случайных
+сотрудников, а также слов должностей и подразделений. Список с icontains получает первое слово запроса (фильтр
+ищет подстроку в одном поле) и ?limit= того же размера.
+
+    python scripts/benchmark_search.py --scale large --samples 20
+
+Запросы идут через django.test.Client в этом же процессе, кэш ответов выключен.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "company.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from organization.models import Division, Employee, Position  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def prefixes(text):
+    return [text[:i] for i in range(1, len(text) + 1) if not text[i - 1].isspace()]
+
+
+def typed_queries(samples, rng):
+    """Все префиксы ФИО выбранных сотрудников и слов «должность/подразделение номер»"""
+    employees = list(Employee.objects.order_by("?").values_list("first_name", "last_name")[:samples])
+    positions = list(Position.objects.order_by("?").values_list("name", flat=True)[:samples])
+    divisions = list(Division.objects.order_by("?").values_list("name", flat=True)[:samples])
+    queries = []
+    for first_name, last_name in employees:
+        queries += prefixes(f"{first_name} {last_name}") + prefixes(f"{last_name} {first_name}")
+    for name in positions + divisions:
+        queries += prefixes(f"{rng.choice(employees)[0]} {name}")
+    return queries
+
+
+def measure(client, urls):
+    latencies, found = [], []
+    for url in urls:
+        started = time.perf_counter()
+        response = client.get(url)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url}: HTTP {response.status_code} {response.content[:200]!r}")
+        found.append(len(response.json()["results"]))
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "max": latencies[-1],
+        "found": statistics.mean(found),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", default="large", help="Масштаб seed_benchmark (small, medium, large)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=20, help="Сотрудников, должностей и подразделений для запросов")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    try:
+        with override_settings(ORGANIZATION_CACHE={"ENABLED": False}), transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = 0")
+            call_command("seed_benchmark", scale=args.scale, seed=args.seed, stdout=sys.stderr)
+            queries = typed_queries(args.samples, rng)
+            client = Client()
+            endpoints = {
+                "search": [f"/api/employees/search/?{urlencode({'q': q, 'limit': args.limit})}" for q in queries],
+                "icontains": [f"/api/employees/?{urlencode({'name__icontains': q.split()[0], 'limit': args.limit})}"
+                              for q in queries],
+            }
+            print(f"{len(queries)} queries, {Employee.objects.count()} employees", file=sys.stderr)
+            print(f"{'endpoint':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'found':>6}")
+            for name, urls in endpoints.items():
+                measure(client, urls[:20])  # прогрев соединения и кэшей PostgreSQL
+                result = measure(client, urls)
+                print(f"{name:<10} {result['p50']:>8.2f} {result['p95']:>8.2f} {result['p99']:>8.2f} "
+                      f"{result['max']:>8.2f} {result['found']:>6.1f}")
+            raise Rollback
+    except Rollback:
+        pass
+
+
+if __name__ == "__main__":
+    main()
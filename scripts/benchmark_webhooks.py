@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Пропускная способность доставки webhooks (webhooks.py) на локальном получателе-заглушке.
+
+Запускает HTTP-сервер на asyncio, который отвечает 200 через --latency секунд, создаёт --subscriptions подписок
+и пишет в журнал изменений --events событий, затем воркер доставляет их с разными BATCH_SIZE. Размер пачки 1 —
+запрос на событие; с пачками число запросов падает в BATCH_SIZE раз, а соединения переиспользуются (их не больше,
+чем одновременных доставок).
+
+    python scripts/benchmark_webhooks.py --subscriptions 50 --events 20000 --latency 0.02 --batch-sizes 1 100 500
+
+Данные пишутся в БД из настроек проекта и удаляются в конце вместе с записями журнала изменений.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "company.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+settings.DEBUG = False
+
+from django.db.models import Max  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from organization import feed, tracking, webhooks  # noqa: E402
+from organization.models import Change, WebhookSubscription  # noqa: E402
+
+
+class Stub(object):
+    """Получатель: читает запросы и отвечает 200 с keep-alive через latency секунд"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while await reader.readline():
+                length = 0
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                await asyncio.sleep(self.latency)
+                self.requests += 1
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+async def deliver(stub, subscriptions, batch_size):
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    await WebhookSubscription.objects.filter(pk__in=subscriptions).aupdate(
+        url=f"http://127.0.0.1:{port}/hook")
+    client = webhooks.Client(timeout=30)
+    started = time.perf_counter()
+    with override_settings(ORGANIZATION_WEBHOOKS=dict(settings.ORGANIZATION_WEBHOOKS, BATCH_SIZE=batch_size)):
+        await webhooks.run(once=True, client=client)
+    elapsed = time.perf_counter() - started
+    server.close()
+    # Обработчики заглушки завершаются, прочитав закрытие соединений клиентом
+    await asyncio.sleep(0.1)
+    return elapsed, client.opened
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscriptions", type=int, default=50)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.02, help="Время ответа получателя, секунды")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 500])
+    args = parser.parse_args()
+
+    last_change = feed.last_seq()
+    last_subscription = WebhookSubscription.objects.aggregate(last=Max("id"))["last"] or 0
+    resources = list(tracking.RESOURCES)
+    print(f"{'batch':>6} {'seconds':>9} {'events/s':>10} {'requests':>9} {'connections':>12}")
+    try:
+        subscriptions = [subscription.pk for subscription in WebhookSubscription.objects.bulk_create(
+            WebhookSubscription(url="http://127.0.0.1:0/hook", cursor=last_change) for _ in range(args.subscriptions))]
+        Change.objects.bulk_create(
+            (Change(resource=resources[i % len(resources)], object_id=i, action=Change.UPDATED)
+             for i in range(args.events)), batch_size=5000)
+        delivered = args.events * len(subscriptions)
+        for batch_size in args.batch_sizes:
+            WebhookSubscription.objects.filter(pk__in=subscriptions).update(
+                cursor=last_change, failures=0, next_attempt_at=None, locked_until=None)
+            stub = Stub(args.latency)
+            elapsed, opened = asyncio.run(deliver(stub, subscriptions, batch_size))
+            print(f"{batch_size:>6} {elapsed:>9.2f} {delivered / elapsed:>10.0f} {stub.requests:>9} {opened:>12}")
+    finally:
+        WebhookSubscription.objects.filter(id__gt=last_subscription).delete()
+        Change.objects.filter(seq__gt=last_change).delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Нагрузочный тест read-эндпоинтов: req/s и перцентили задержки для нескольких режимов.
+
+Каждый режим — базовый URL уже запущенного сервера, например WSGI (gunicorn company.wsgi)
+и ASGI (SERVER_MODE=asgi gunicorn company.asgi) с асинхронными view:
+
+    python scripts/loadtest.py --mode wsgi=http://localhost:8000/api \\
+        --mode asgi=http://localhost:8001/api/async --path /employees/ --concurrency 64 --duration 30
+
+Зависимостей нет: клиент на asyncio с keep-alive соединениями.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def request(reader, writer, host, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        while (size := int((await reader.readline()).strip(), 16)):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    else:
+        await reader.readexactly(int(headers.get("content-length", 0)))
+    return status
+
+
+async def client(url, deadline, latencies, errors):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    connection = None
+    while time.monotonic() < deadline:
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            started = time.perf_counter()
+            status = await request(*connection, parts.netloc, parts.path + (f"?{parts.query}" if parts.query else ""))
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+            errors.append(type(e).__name__)
+            connection = None
+
+
+async def run(url, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(client(url, deadline, latencies, errors) for _ in range(concurrency)))
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", action="append", required=True, metavar="NAME=BASE_URL")
+    parser.add_argument("--path", default="/employees/")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.mode:
+        name, _, base_url = mode.partition("=")
+        latencies, errors = asyncio.run(run(base_url.rstrip("/") + args.path, args.concurrency, args.duration))
+        results[name] = {
+            "requests": len(latencies),
+            "errors": len(errors),
+            "rps": round(len(latencies) / args.duration, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['rps']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}{result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
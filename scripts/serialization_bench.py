@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Сравнение сериализации списков: marshmallow против values() + скомпилированных схем (и orjson).
+
+Данные создаются в транзакции, которая откатывается в конце, так что скрипт можно запускать
+на рабочей БД из настроек проекта:
+
+    python scripts/serialization_bench.py --sizes 1000 10000 100000 --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "company.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import transaction  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from organization.models import Position, Employee  # noqa: E402
+from organization.schemas import EmployeeSchema, with_related  # noqa: E402
+from organization.serializers import dump_rows, dumps  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def seed(size, positions):
+    employees = Employee.objects.bulk_create(
+        [Employee(first_name=f"First {i}", last_name=f"Last {i}") for i in range(size)], batch_size=2000)
+    through = Employee.positions.through
+    through.objects.bulk_create(
+        [through(employee_id=employee.pk, position_id=positions[i % len(positions)].pk)
+         for i, employee in enumerate(employees)], batch_size=2000)
+
+
+def marshmallow(queryset):
+    schema = EmployeeSchema()
+    return dumps(schema.dump(with_related(queryset, schema), many=True))
+
+
+def fast(queryset):
+    return dumps([data for _, data in dump_rows(queryset, EmployeeSchema())])
+
+
+def fast_orjson(queryset):
+    with override_settings(ORGANIZATION_SERIALIZER={"ORJSON": True}):
+        return fast(queryset)
+
+
+def best(func, queryset, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(queryset)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'marshmallow':>12} {'fast':>10} {'fast+orjson':>12} {'speedup':>8}")
+    try:
+        with transaction.atomic():
+            positions = Position.objects.bulk_create([Position(name=f"Position {i}") for i in range(20)])
+            seeded = 0
+            for size in sorted(args.sizes):
+                seed(size - seeded, positions)
+                seeded = size
+                queryset = Employee.objects.order_by("id")[:size]
+                slow = best(marshmallow, queryset, args.repeat)
+                plain = best(fast, queryset, args.repeat)
+                compact = best(fast_orjson, queryset, args.repeat)
+                print(f"{size:>8} {slow:>11.3f}s {plain:>9.3f}s {compact:>11.3f}s {slow / compact:>7.1f}x")
+            raise Rollback
+    except Rollback:
+        pass
+
+
+if __name__ == "__main__":
+    main()